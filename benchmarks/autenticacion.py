@@ -0,0 +1,80 @@
+"""
+Peticiones por segundo de un endpoint que solo autentica (/api/matriculas/role/) con la
+JWTAuthentication de simplejwt frente a CachedJWTAuthentication.
+
+    python -m benchmarks.autenticacion --peticiones 5000
+"""
+import argparse
+import json
+import time
+
+from benchmarks.comun import configurar_django, crear_base_de_pruebas, percentiles
+
+
+def medir_autenticacion(clase, client, peticiones):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from matriculas.authentication import cache_usuarios
+    from matriculas.views import UserRoleAPIView
+
+    UserRoleAPIView.authentication_classes = [clase]
+    cache_usuarios.limpiar()
+    client.get('/api/matriculas/role/')
+
+    latencias = []
+    with CaptureQueriesContext(connection) as ctx:
+        inicio_total = time.perf_counter()
+        for _ in range(peticiones):
+            inicio = time.perf_counter()
+            response = client.get('/api/matriculas/role/')
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            assert response.status_code == 200
+        total = time.perf_counter() - inicio_total
+
+    return {
+        'peticiones_por_segundo': round(peticiones / total, 1),
+        'consultas_por_peticion': round(len(ctx.captured_queries) / peticiones, 2),
+        **percentiles(latencias),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peticiones', type=int, default=5000)
+    parser.add_argument('--json', help='Guarda el resultado en este archivo.')
+    args = parser.parse_args()
+
+    configurar_django()
+    from django.contrib.auth.models import User
+    from django.test.utils import setup_test_environment
+    from rest_framework.test import APIClient
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.tokens import AccessToken
+    from matriculas.authentication import CachedJWTAuthentication
+
+    # Permite el host 'testserver' del cliente de pruebas
+    setup_test_environment()
+    destruir = crear_base_de_pruebas()
+    try:
+        user = User.objects.create_user(username='benchmark', password='benchmark')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+        resultados = {
+            'JWTAuthentication': medir_autenticacion(JWTAuthentication, client, args.peticiones),
+            'CachedJWTAuthentication': medir_autenticacion(CachedJWTAuthentication, client, args.peticiones),
+        }
+    finally:
+        destruir()
+
+    for nombre, datos in resultados.items():
+        print(f"{nombre:<26} {datos['peticiones_por_segundo']:>8} req/s  "
+              f"p50 {datos['p50_ms']} ms  p99 {datos['p99_ms']} ms  consultas/petición {datos['consultas_por_peticion']}")
+
+    if args.json:
+        with open(args.json, 'w') as archivo:
+            json.dump(resultados, archivo, indent=2)
+
+
+if __name__ == '__main__':
+    main()
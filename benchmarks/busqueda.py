@@ -0,0 +1,71 @@
+"""
+Latencia del endpoint de búsqueda de matrículas (/api/matriculas/buscar/) con la tabla
+sembrada, por prefijo de nombre, DNI completo y prefijo de DNI.
+
+    python -m benchmarks.busqueda --filas 1000000 --repeticiones 200
+"""
+import argparse
+import json
+import random
+
+from benchmarks.comun import APELLIDOS, NOMBRES, configurar_django, crear_base_de_pruebas, medir, percentiles, sembrar
+
+
+def terminos(filas, repeticiones):
+    rnd = random.Random(1)
+    return {
+        'prefijo de nombre': [rnd.choice(NOMBRES)[:rnd.randint(3, 5)].lower() for _ in range(repeticiones)],
+        'nombre y apellido': [f'{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)[:3]}' for _ in range(repeticiones)],
+        'dni completo': [f'{rnd.randint(1, filas):08d}' for _ in range(repeticiones)],
+        'prefijo de dni': [f'{rnd.randint(1, filas):08d}'[:5] for _ in range(repeticiones)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=1_000_000)
+    parser.add_argument('--repeticiones', type=int, default=200)
+    parser.add_argument('--json', help='Guarda el resultado en este archivo.')
+    parser.add_argument('--conservar', action='store_true', help='Reutiliza y no elimina la base de pruebas.')
+    args = parser.parse_args()
+
+    configurar_django()
+    from django.contrib.auth.models import User
+    from django.test.utils import setup_test_environment
+    from rest_framework.test import APIClient
+    from rest_framework_simplejwt.tokens import AccessToken
+    from matriculas.busqueda import buscar_matriculas
+
+    # Permite el host 'testserver' del cliente de pruebas
+    setup_test_environment()
+    destruir = crear_base_de_pruebas(args.conservar)
+    try:
+        if not args.conservar or not User.objects.exists():
+            sembrar(args.filas)
+        admin = User.objects.create(id=args.filas + 1, username='benchmark_admin', is_staff=True)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(admin)}')
+
+        resultados = {}
+        for nombre, valores in terminos(args.filas, args.repeticiones).items():
+            plan = buscar_matriculas({'q': valores[0]}).order_by('orden', 'estudiante_id')[:51].explain()
+
+            def buscar(i):
+                response = client.get('/api/matriculas/buscar/', {'q': valores[i]})
+                assert response.status_code == 200
+
+            resultados[nombre] = {'plan': plan, **percentiles(medir(buscar, args.repeticiones))}
+        admin.delete()
+    finally:
+        destruir()
+
+    for nombre, datos in resultados.items():
+        print(f"{nombre:<20} p50 {datos['p50_ms']} ms  p95 {datos['p95_ms']} ms  p99 {datos['p99_ms']} ms")
+
+    if args.json:
+        with open(args.json, 'w') as archivo:
+            json.dump(resultados, archivo, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Utilidades compartidas por los scripts de benchmark.
+
+Los scripts se ejecutan desde la raíz del proyecto, por ejemplo::
+
+    python -m benchmarks.indices --filas 1000000
+
+y trabajan sobre la base de datos de pruebas (``test_<NAME>``), nunca sobre la real.
+"""
+import os
+import random
+import statistics
+import time
+from datetime import date
+
+import django
+
+NOMBRES = ['José', 'María', 'Ángel', 'Lucía', 'Sofía', 'Martín', 'Camila', 'Tomás', 'Valentina', 'Iñaki',
+           'Andrés', 'Renata', 'Joaquín', 'Ximena', 'Raúl', 'Inés', 'Diego', 'Paula', 'Héctor', 'Noemí']
+APELLIDOS = ['Pérez', 'García', 'Rodríguez', 'Núñez', 'López', 'Martínez', 'Sánchez', 'Gómez', 'Díaz', 'Muñoz',
+             'Álvarez', 'Romero', 'Ruiz', 'Ibáñez', 'Castro', 'Ortiz', 'Rubio', 'Marín', 'Quispe', 'Mamani']
+
+def configurar_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sistema_matriculas.settings')
+    django.setup()
+
+
+def crear_base_de_pruebas(conservar=False):
+    """Crea y migra la base de datos de pruebas. Devuelve una función que la elimina."""
+    from django.db import connection
+
+    nombre_original = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=conservar)
+
+    def destruir():
+        if not conservar:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+
+    return destruir
+
+
+def sembrar(filas, lote=10000, estados_matricula=None, estados_pago=None, semilla=0):
+    """
+    Inserta ``filas`` usuarios con su Estudiante, Matricula y Pago usando bulk_create.
+
+    Los ids se asignan de forma explícita (el mismo id en las cuatro tablas) para no
+    depender de que el motor devuelva las claves en bulk_create.
+    """
+    from django.contrib.auth.models import User
+    from matriculas.models import Estudiante, Matricula, Pago, normalizar_busqueda
+    from matriculas.resumen import reconstruir_resumen
+
+    rnd = random.Random(semilla)
+    estados_matricula = estados_matricula or ['Pendiente', 'Pagado', 'Aprobado', 'Rechazado']
+    estados_pago = estados_pago or ['Pendiente', 'Completado']
+
+    for inicio in range(1, filas + 1, lote):
+        ids = range(inicio, min(inicio + lote, filas + 1))
+        User.objects.bulk_create(
+            [User(id=i, username=f'alumno{i}', email=f'alumno{i}@example.com', password='!') for i in ids]
+        )
+        nombres = {i: f'{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)} {i}' for i in ids}
+        Estudiante.objects.bulk_create([
+            Estudiante(
+                id=i, usuario_id=i, nombre=nombres[i], nombre_busqueda=normalizar_busqueda(nombres[i]),
+                dni=f'{i:08d}', fecha_nacimiento=date(2000, 1, 1), grado='5to Primaria', direccion='Calle 123'
+            )
+            for i in ids
+        ])
+        Matricula.objects.bulk_create(
+            [Matricula(id=i, estudiante_id=i, curso='Curso Ejemplo', estado=rnd.choice(estados_matricula)) for i in ids]
+        )
+        Pago.objects.bulk_create([
+            Pago(id=i, matricula_id=i, stripe_payment_intent_id=f'pi_{i}', client_secret=f'pi_{i}_secret',
+                 estado=rnd.choice(estados_pago))
+            for i in ids
+        ])
+
+    # bulk_create no actualiza la tabla de resumen del panel
+    reconstruir_resumen()
+
+
+def medir(funcion, repeticiones):
+    """Ejecuta ``funcion(i)`` ``repeticiones`` veces y devuelve las latencias en milisegundos."""
+    latencias = []
+    for i in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(i)
+        latencias.append((time.perf_counter() - inicio) * 1000)
+    return latencias
+
+
+def percentiles(latencias):
+    ordenadas = sorted(latencias)
+
+    def p(valor):
+        return ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * valor))]
+
+    return {
+        'n': len(ordenadas),
+        'media_ms': round(statistics.mean(ordenadas), 3),
+        'p50_ms': round(p(0.50), 3),
+        'p95_ms': round(p(0.95), 3),
+        'p99_ms': round(p(0.99), 3),
+    }
@@ -0,0 +1,77 @@
+"""
+Duración de ``reconcile_payments`` con todos los pagos pendientes, contra el servidor local
+que imita a Stripe con una latencia fija por llamada, en los dos modos: recorriendo la
+lista de PaymentIntents y con retrieves en paralelo.
+
+    python -m benchmarks.conciliacion --filas 100000 --latencia-stripe 0.05 --hilos 32
+
+Cada modo corrige los pagos dentro de una transacción que se deshace al terminar, así que
+los dos parten de los mismos datos.
+"""
+import argparse
+import json
+import random
+import time
+
+from benchmarks.comun import configurar_django, crear_base_de_pruebas, sembrar
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=100_000)
+    parser.add_argument('--latencia-stripe', type=float, default=0.05, help='Segundos por llamada a Stripe.')
+    parser.add_argument('--hilos', type=int, default=32)
+    parser.add_argument('--json', help='Guarda el resultado en este archivo.')
+    parser.add_argument('--conservar', action='store_true', help='Reutiliza y no elimina la base de pruebas.')
+    args = parser.parse_args()
+
+    configurar_django()
+    import stripe
+    from django.contrib.auth.models import User
+    from django.db import transaction
+    from matriculas.conciliacion import conciliar
+    from matriculas.fake_stripe import ServidorStripeFalso
+
+    destruir = crear_base_de_pruebas(args.conservar)
+    resultados = {'filas': args.filas, 'latencia_stripe_s': args.latencia_stripe, 'hilos': args.hilos}
+    try:
+        if not args.conservar or not User.objects.exists():
+            sembrar(args.filas, estados_matricula=['Pendiente'], estados_pago=['Pendiente'])
+
+        with ServidorStripeFalso(latencia=args.latencia_stripe) as servidor:
+            stripe.api_base = servidor.url
+            stripe.api_key = 'sk_test_benchmark'
+            rnd = random.Random(0)
+            for i in range(1, args.filas + 1):
+                servidor.intents[f'pi_{i}'] = {
+                    'id': f'pi_{i}', 'object': 'payment_intent', 'amount': 10000,
+                    'status': rnd.choice(['succeeded', 'succeeded', 'canceled', 'requires_payment_method']),
+                }
+
+            for modo in ('listar', 'consultar'):
+                servidor.llamadas.clear()
+                inicio = time.perf_counter()
+                with transaction.atomic():
+                    informe = conciliar(modo, args.hilos)
+                    transaction.set_rollback(True)
+                resultados[modo] = {
+                    'segundos': round(time.perf_counter() - inicio, 2),
+                    'llamadas_stripe': sum(servidor.llamadas.values()),
+                    'corregidos': informe['Completado'] + informe['Fallido'],
+                }
+    finally:
+        destruir()
+
+    print(f"{args.filas} pagos pendientes, {args.latencia_stripe * 1000:.0f} ms por llamada a Stripe:")
+    for modo in ('listar', 'consultar'):
+        datos = resultados[modo]
+        print(f"  {modo:<9} {datos['segundos']} s  llamadas {datos['llamadas_stripe']}  corregidos {datos['corregidos']}")
+    print(f"  (una llamada secuencial por pago serían {args.filas * args.latencia_stripe:.0f} s solo de espera)")
+
+    if args.json:
+        with open(args.json, 'w') as archivo:
+            json.dump(resultados, archivo, indent=2)
+
+
+if __name__ == '__main__':
+    main()
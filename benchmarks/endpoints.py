@@ -0,0 +1,226 @@
+"""
+Escenarios de carga repetibles sobre los endpoints principales, con Stripe sustituido
+por el servidor local de matriculas.fake_stripe.
+
+    python -m benchmarks.endpoints --filas 100000 --peticiones 500 --concurrencia 8 \\
+        --latencia-stripe 0.05 --json resultados/2.3.0.json --comparar resultados/2.2.0.json
+
+Para cada escenario informa p50/p95/p99, peticiones por segundo y consultas SQL por
+petición. Con --comparar muestra la variación respecto a un resultado anterior.
+Con SQLite en memoria solo se puede usar --concurrencia 1.
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import date
+
+from benchmarks.comun import configurar_django, crear_base_de_pruebas, percentiles, sembrar
+
+ESCENARIOS = ['registro', 'crear_estudiante', 'estado_estudiante', 'listado_admin', 'verificar']
+
+
+class Contador:
+    """Cuenta las consultas de todos los hilos (execute_wrapper es por conexión)."""
+
+    def __init__(self):
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.total += 1
+        return execute(sql, params, many, context)
+
+
+def cliente(usuario=None):
+    from rest_framework.test import APIClient
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    client = APIClient()
+    if usuario is not None:
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(usuario)}')
+    return client
+
+
+def preparar_escenarios(filas, peticiones):
+    """
+    Devuelve {nombre: función(i) -> response}. Los datos que necesita cada escenario se
+    crean aquí, fuera de la medición.
+    """
+    from django.contrib.auth.models import User
+
+    admin = User.objects.create(id=filas + 1, username='benchmark_admin', is_staff=True)
+    cliente_admin = cliente(admin)
+
+    # Usuarios sin estudiante para el escenario de creación
+    base = filas + 2
+    nuevos = User.objects.bulk_create(
+        [User(id=base + i, username=f'nuevo{i}', password='!') for i in range(peticiones)]
+    )
+    clientes_nuevos = [cliente(u) for u in nuevos]
+
+    alumnos = list(User.objects.filter(id__lte=filas).order_by('id')[:peticiones])
+    clientes_alumnos = [cliente(u) for u in alumnos]
+
+    def registro(i):
+        return cliente().post('/api/matriculas/registro/', {
+            'username': f'registro{i}', 'email': f'registro{i}@example.com', 'password': 'clave-segura'
+        }, format='multipart')
+
+    def crear_estudiante(i):
+        return clientes_nuevos[i].post('/api/matriculas/estudiante/crear/', {
+            'nombre': f'Nuevo {i}', 'dni': f'9{i:07d}', 'fecha_nacimiento': date(2010, 1, 1).isoformat(),
+            'grado': '5to Primaria', 'direccion': 'Calle 123'
+        }, format='multipart')
+
+    def estado_estudiante(i):
+        return clientes_alumnos[i % len(clientes_alumnos)].get('/api/matriculas/check-student/')
+
+    def listado_admin(i):
+        return cliente_admin.get('/api/matriculas/', {'page_size': 100})
+
+    def verificar(i):
+        estado = 'Aprobado' if i % 2 == 0 else 'Pendiente'
+        return cliente_admin.patch(f'/api/matriculas/{i % filas + 1}/verificar/', {'estado': estado}, format='json')
+
+    return {
+        'registro': registro,
+        'crear_estudiante': crear_estudiante,
+        'estado_estudiante': estado_estudiante,
+        'listado_admin': listado_admin,
+        'verificar': verificar,
+    }
+
+
+def ejecutar_escenario(funcion, peticiones, concurrencia):
+    from django.db import connection
+
+    contador = Contador()
+    latencias = []
+    errores = []
+    lock = threading.Lock()
+
+    def trabajador(indices):
+        propias = []
+        try:
+            with connection.execute_wrapper(contador):
+                for i in indices:
+                    inicio = time.perf_counter()
+                    response = funcion(i)
+                    propias.append((time.perf_counter() - inicio) * 1000)
+                    if response.status_code >= 400:
+                        errores.append(response.status_code)
+        finally:
+            # Cada hilo abre su propia conexión
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
+            with lock:
+                latencias.extend(propias)
+
+    inicio_total = time.perf_counter()
+    if concurrencia == 1:
+        trabajador(range(peticiones))
+    else:
+        hilos = [
+            threading.Thread(target=trabajador, args=(range(n, peticiones, concurrencia),))
+            for n in range(concurrencia)
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+    total = time.perf_counter() - inicio_total
+
+    return {
+        'peticiones_por_segundo': round(peticiones / total, 1),
+        'consultas_por_peticion': round(contador.total / peticiones, 2),
+        'errores': len(errores),
+        **percentiles(latencias),
+    }
+
+
+def comparar(actual, anterior):
+    """Variación porcentual de p50/p95/p99 y throughput respecto a un resultado anterior."""
+    diferencias = {}
+    for nombre, datos in actual['escenarios'].items():
+        previo = anterior.get('escenarios', {}).get(nombre)
+        if not previo:
+            continue
+        diferencias[nombre] = {
+            clave: round((datos[clave] - previo[clave]) / previo[clave] * 100, 1) if previo[clave] else None
+            for clave in ('p50_ms', 'p95_ms', 'p99_ms', 'peticiones_por_segundo', 'consultas_por_peticion')
+        }
+    return diferencias
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=100_000, help='Matrículas sembradas antes de medir.')
+    parser.add_argument('--peticiones', type=int, default=500, help='Peticiones por escenario.')
+    parser.add_argument('--concurrencia', type=int, default=1)
+    parser.add_argument('--latencia-stripe', type=float, default=0.0, help='Segundos por llamada a Stripe.')
+    parser.add_argument('--escenarios', nargs='+', choices=ESCENARIOS, default=ESCENARIOS)
+    parser.add_argument('--json', help='Guarda el resultado en este archivo.')
+    parser.add_argument('--comparar', help='Resultado JSON anterior con el que comparar.')
+    parser.add_argument('--conservar', action='store_true', help='Reutiliza y no elimina la base de pruebas.')
+    args = parser.parse_args()
+
+    configurar_django()
+    import stripe
+    from django.conf import settings
+    from django.core.cache import cache
+    from django.test.utils import setup_test_environment
+    from matriculas.fake_stripe import ServidorStripeFalso
+
+    # Permite el host 'testserver' del cliente de pruebas
+    setup_test_environment()
+    # Se mide el servidor, no el hash de contraseñas del registro
+    settings.PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+    # Todo sale de la misma IP: límites que no rechazan pero cuyo coste sí se mide
+    settings.LIMITES_PETICIONES = {alcance: (10 ** 9, 10 ** 9) for alcance in settings.LIMITES_PETICIONES}
+
+    destruir = crear_base_de_pruebas(args.conservar)
+    try:
+        with ServidorStripeFalso(latencia=args.latencia_stripe) as servidor:
+            stripe.api_base = servidor.url
+            stripe.api_key = 'sk_test_benchmark'
+
+            sembrar(args.filas)
+            escenarios = preparar_escenarios(args.filas, args.peticiones)
+            cache.clear()
+
+            resultados = {}
+            for nombre in args.escenarios:
+                resultados[nombre] = ejecutar_escenario(escenarios[nombre], args.peticiones, args.concurrencia)
+                print(f"{nombre:<18} {resultados[nombre]['peticiones_por_segundo']:>8} req/s  "
+                      f"p50 {resultados[nombre]['p50_ms']} ms  p95 {resultados[nombre]['p95_ms']} ms  "
+                      f"p99 {resultados[nombre]['p99_ms']} ms  consultas/petición "
+                      f"{resultados[nombre]['consultas_por_peticion']}  errores {resultados[nombre]['errores']}")
+            llamadas_stripe = dict(servidor.llamadas)
+    finally:
+        destruir()
+
+    salida = {
+        'parametros': {
+            'filas': args.filas, 'peticiones': args.peticiones, 'concurrencia': args.concurrencia,
+            'latencia_stripe': args.latencia_stripe, 'motor': settings.DATABASES['default']['ENGINE'],
+        },
+        'llamadas_stripe': llamadas_stripe,
+        'escenarios': resultados,
+    }
+
+    if args.comparar:
+        with open(args.comparar) as archivo:
+            salida['comparacion'] = comparar(salida, json.load(archivo))
+        for nombre, cambios in salida['comparacion'].items():
+            print(f"{nombre:<18} " + '  '.join(f'{clave} {valor:+}%' for clave, valor in cambios.items()
+                                                 if valor is not None))
+
+    if args.json:
+        with open(args.json, 'w') as archivo:
+            json.dump(salida, archivo, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Compara planes de ejecución y latencias de las consultas de las vistas antes y
+después de la migración 0006_indices_consultas.
+
+    python -m benchmarks.indices --filas 1000000 --repeticiones 200
+"""
+import argparse
+import json
+import random
+
+from benchmarks.comun import configurar_django, crear_base_de_pruebas, medir, percentiles, sembrar
+
+MIGRACION_ANTES = '0005_notificacionemail'
+MIGRACION_DESPUES = '0006_indices_consultas'
+
+
+def consultas(filas):
+    """Consultas que emiten las vistas, parametrizadas por un id aleatorio existente."""
+    from matriculas.models import Estudiante, Matricula, Pago
+
+    return {
+        'ConfirmarPago: pago por intent': lambda i: Pago.objects.filter(stripe_payment_intent_id=f'pi_{i}'),
+        'VerificarEstudiante: matrícula del estudiante': lambda i: Matricula.objects.filter(estudiante_id=i),
+        'VerificarEstudiante: pago pendiente': lambda i: Pago.objects.filter(
+            matricula_id=i, estado__in=['Pendiente', 'Fallido']
+        ),
+        'CheckStudentStatus: pago de la matrícula': lambda i: Pago.objects.filter(matricula_id=i),
+        'Verificación en lote: matrículas pagadas': lambda i: Matricula.objects.filter(estado='Pagado').values_list(
+            'id', flat=True
+        )[:1000],
+        # Solo columnas que ya existen en MIGRACION_ANTES
+        'Estudiante por DNI': lambda i: Estudiante.objects.filter(dni=f'{i:08d}').only(
+            'id', 'usuario_id', 'nombre', 'dni', 'fecha_nacimiento', 'grado', 'direccion'
+        ),
+    }
+
+
+def ejecutar_fase(filas, repeticiones):
+    rnd = random.Random(1)
+    resultado = {}
+    for nombre, construir in consultas(filas).items():
+        ids = [rnd.randint(1, filas) for _ in range(repeticiones)]
+        plan = construir(ids[0]).explain()
+        latencias = medir(lambda n: list(construir(ids[n])[:1000]), repeticiones)
+        resultado[nombre] = {'plan': plan, **percentiles(latencias)}
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=1_000_000)
+    parser.add_argument('--repeticiones', type=int, default=200)
+    parser.add_argument('--json', help='Guarda el resultado en este archivo.')
+    parser.add_argument('--conservar', action='store_true', help='Reutiliza y no elimina la base de pruebas.')
+    args = parser.parse_args()
+
+    configurar_django()
+    from django.core.management import call_command
+    from matriculas.models import Matricula
+
+    destruir = crear_base_de_pruebas(args.conservar)
+    try:
+        # Se siembra con el esquema actual (sembrar usa todos los campos) y luego se vuelve atrás
+        if not Matricula.objects.exists():
+            print(f'Sembrando {args.filas} filas...')
+            sembrar(args.filas)
+        call_command('migrate', 'matriculas', MIGRACION_ANTES, verbosity=0)
+
+        resultados = {'antes': ejecutar_fase(args.filas, args.repeticiones)}
+        call_command('migrate', 'matriculas', MIGRACION_DESPUES, verbosity=0)
+        resultados['despues'] = ejecutar_fase(args.filas, args.repeticiones)
+    finally:
+        destruir()
+
+    for nombre in resultados['antes']:
+        antes, despues = resultados['antes'][nombre], resultados['despues'][nombre]
+        print(f'\n== {nombre}')
+        print(f"  antes:   p50 {antes['p50_ms']} ms  p95 {antes['p95_ms']} ms\n    {antes['plan']}")
+        print(f"  después: p50 {despues['p50_ms']} ms  p95 {despues['p95_ms']} ms\n    {despues['plan']}")
+
+    if args.json:
+        with open(args.json, 'w') as archivo:
+            json.dump(resultados, archivo, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Tiempo de serialización y render JSON del listado de matrículas por cada 10 000 filas:
+MatriculaSerializer + JSONRenderer de DRF frente a serializacion_rapida + JSONRapidoRenderer.
+
+    python -m benchmarks.serializacion --filas 10000 --repeticiones 10
+
+Las consultas se hacen fuera de la medición (en ambos casos son dos: matrículas con su
+estudiante y pagos). Comprueba además que las dos salidas son idénticas byte a byte.
+"""
+import argparse
+import json
+import statistics
+import time
+
+from benchmarks.comun import configurar_django, crear_base_de_pruebas, sembrar
+
+
+def cronometrar(funcion, repeticiones):
+    """Mediana en milisegundos de ``repeticiones`` ejecuciones y el último resultado."""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos), resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=10_000)
+    parser.add_argument('--repeticiones', type=int, default=10)
+    parser.add_argument('--json', help='Guarda el resultado en este archivo.')
+    parser.add_argument('--conservar', action='store_true', help='Reutiliza y no elimina la base de pruebas.')
+    args = parser.parse_args()
+
+    configurar_django()
+    from django.contrib.auth.models import User
+    from rest_framework.renderers import JSONRenderer
+    from matriculas.models import Matricula
+    from matriculas.renderers import JSONRapidoRenderer, orjson
+    from matriculas.serializacion_rapida import filas_matriculas, primeros_pagos, serializar_filas
+    from matriculas.serializers import MatriculaSerializer
+
+    destruir = crear_base_de_pruebas(args.conservar)
+    try:
+        if not args.conservar or not User.objects.exists():
+            sembrar(args.filas)
+        matriculas = list(Matricula.objects.con_detalle().order_by('id'))
+        filas = list(filas_matriculas(Matricula.objects.order_by('id')))
+        pagos = primeros_pagos([fila['id'] for fila in filas])
+    finally:
+        destruir()
+
+    ms_drf, datos_drf = cronometrar(lambda: MatriculaSerializer(matriculas, many=True).data, args.repeticiones)
+    ms_render_drf, json_drf = cronometrar(lambda: JSONRenderer().render(datos_drf), args.repeticiones)
+    ms_rapida, datos_rapidos = cronometrar(lambda: serializar_filas(filas, pagos), args.repeticiones)
+    ms_render_rapido, json_rapido = cronometrar(lambda: JSONRapidoRenderer().render(datos_rapidos), args.repeticiones)
+    assert json_rapido == json_drf, 'Las salidas no son idénticas'
+
+    por_10k = 10_000 / len(matriculas)
+    resultados = {
+        'filas': len(matriculas),
+        'codificador': 'orjson' if orjson is not None else 'json',
+        'drf': {'serializacion_ms': round(ms_drf * por_10k, 1), 'render_ms': round(ms_render_drf * por_10k, 1)},
+        'rapida': {'serializacion_ms': round(ms_rapida * por_10k, 1), 'render_ms': round(ms_render_rapido * por_10k, 1)},
+    }
+
+    print(f"Por cada 10 000 filas ({resultados['filas']} medidas, codificador {resultados['codificador']}):")
+    for nombre in ('drf', 'rapida'):
+        datos = resultados[nombre]
+        total = datos['serializacion_ms'] + datos['render_ms']
+        print(f"  {nombre:<7} serialización {datos['serializacion_ms']} ms  render {datos['render_ms']} ms  "
+              f"total {round(total, 1)} ms")
+    print(f"  aceleración total x{round((ms_drf + ms_render_drf) / (ms_rapida + ms_render_rapido), 1)}")
+
+    if args.json:
+        with open(args.json, 'w') as archivo:
+            json.dump(resultados, archivo, indent=2)
+
+
+if __name__ == '__main__':
+    main()
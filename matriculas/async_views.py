@@ -0,0 +1,128 @@
+"""
+Variantes asíncronas (ASGI) de las vistas que llaman a Stripe.
+
+Esperan a Stripe y al ORM con límites de tiempo (STRIPE_TIMEOUT, ASYNC_DB_TIMEOUT), de
+modo que un proceso ASGI puede mantener miles de consultas de estado en curso sin
+ocupar un hilo por petición. Devuelven las mismas respuestas que las vistas de views.py.
+"""
+import asyncio
+import math
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+
+from .authentication import CachedJWTAuthentication
+from .estado_estudiante import ESTADOS_PAGO_PENDIENTE, obtener_estado_estudiante_async
+from .inscripcion import con_idempotencia_async, falta_intent, guardar_pago, parametros_intent, preparar_inscripcion, respuesta_pago
+from .models import Estudiante, Pago
+from .pagos import confirmar_pago
+from .serializers import EstudianteSerializer
+from .stripe_client import cliente_stripe, llamar_stripe_async, obtener_client_secret_async, obtener_payment_intent_async
+from .throttling import clave_de_cubo, consumir, limite_de_alcance
+
+
+class VistaAsincrona(View):
+    """
+    Autentica con JWT y aplica ``throttle_scope`` como las vistas de DRF, y traduce los
+    tiempos agotados a 504.
+    """
+    throttle_scope = None
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Igual que APIView: la autenticación es por token, no por sesión
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            resultado = await sync_to_async(CachedJWTAuthentication().authenticate)(request)
+        except exceptions.APIException as e:
+            return JsonResponse({"detail": str(e.detail)}, status=401)
+        if resultado is None:
+            return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+        request.user = resultado[0]
+
+        limite = limite_de_alcance(self.throttle_scope)
+        if limite is not None:
+            espera = await sync_to_async(consumir)(clave_de_cubo(self.throttle_scope, f'u{request.user.pk}'), *limite)
+            if espera:
+                respuesta = JsonResponse({"detail": "Demasiadas peticiones."}, status=429)
+                respuesta['Retry-After'] = str(math.ceil(espera))
+                return respuesta
+
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except asyncio.TimeoutError:
+            return JsonResponse({"error": "Tiempo de espera agotado."}, status=504)
+
+
+class VerificarEstudianteAsyncView(VistaAsincrona):
+    throttle_scope = 'estado'
+
+    async def get(self, request):
+        estado = await obtener_estado_estudiante_async(request.user.id)
+        if estado['estudiante'] is None:
+            return JsonResponse({"exists": False})
+
+        datos = EstudianteSerializer(Estudiante(**estado['estudiante'])).data
+        respuesta = {"exists": True, "estudiante": datos}
+        if estado['pago_estado'] in ESTADOS_PAGO_PENDIENTE:
+            respuesta["client_secret"] = estado['client_secret']
+        return JsonResponse(respuesta)
+
+
+class CheckStudentStatusAsyncView(VistaAsincrona):
+    throttle_scope = 'estado'
+
+    async def get(self, request):
+        estado = await obtener_estado_estudiante_async(request.user.id)
+        if estado['matricula_id']:
+            return JsonResponse({
+                "has_student": True,
+                "matricula_rechazada": estado['matricula_estado'] == "Rechazado",
+                "payment_completed": estado['pago_estado'] == "Completado",
+                "client_secret": estado['client_secret']
+            })
+        return JsonResponse({"has_student": False})
+
+
+class ConfirmarPagoAsyncView(VistaAsincrona):
+    async def post(self, request, payment_intent_id):
+        consulta = Pago.objects.filter(stripe_payment_intent_id=payment_intent_id).only('estado').afirst()
+        pago = await asyncio.wait_for(consulta, settings.ASYNC_DB_TIMEOUT)
+        if pago is None:
+            return JsonResponse({"error": "Pago no encontrado."}, status=404)
+
+        if pago.estado != 'Completado':
+            payment_intent = await obtener_payment_intent_async(payment_intent_id, usar_cache=False)
+            if payment_intent['status'] != 'succeeded':
+                return JsonResponse({"message": "El pago no está completado."}, status=400)
+            await asyncio.wait_for(sync_to_async(confirmar_pago)(payment_intent_id), settings.ASYNC_DB_TIMEOUT)
+
+        return JsonResponse({"message": "Pago confirmado exitosamente."})
+
+
+class CrearEstudianteAsyncView(VistaAsincrona):
+    async def post(self, request):
+        data = request.POST.copy()
+        data.update(request.FILES)
+        codigo, cuerpo = await con_idempotencia_async(request, data, lambda: self.inscribir(request, data))
+        return JsonResponse(cuerpo, status=codigo)
+
+    async def inscribir(self, request, data):
+        serializer = EstudianteSerializer(data=data, context={'request': request})
+        preparar = sync_to_async(preparar_inscripcion)(serializer, request.user)
+        matricula, pago, error = await asyncio.wait_for(preparar, settings.ASYNC_DB_TIMEOUT)
+        if error:
+            return error
+
+        if falta_intent(pago):
+            intent = await llamar_stripe_async(cliente_stripe().payment_intents.create, params=parametros_intent(matricula))
+            pago = await asyncio.wait_for(
+                sync_to_async(guardar_pago)(matricula, intent, pago), settings.ASYNC_DB_TIMEOUT
+            )
+        return 200, respuesta_pago(pago, await obtener_client_secret_async(pago))
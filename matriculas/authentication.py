@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+# Campos del usuario que usan las vistas; el resto (p. ej. password) se carga bajo demanda.
+# Van en el orden de los campos del modelo, como espera Model.from_db().
+CAMPOS_USUARIO = tuple(
+    f.attname for f in User._meta.concrete_fields
+    if f.attname in {'id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser'}
+)
+CACHE_PREFIX = 'auth_usuario:'
+
+
+class CacheUsuarios:
+    """LRU en memoria del proceso con expiración por entrada, protegida por un lock."""
+
+    def __init__(self, maximo, ttl):
+        self.maximo = maximo
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, usuario_id):
+        with self._lock:
+            entrada = self._datos.get(usuario_id)
+            if entrada is None:
+                return None
+            expira, valores = entrada
+            if expira < time.monotonic():
+                del self._datos[usuario_id]
+                return None
+            self._datos.move_to_end(usuario_id)
+            return valores
+
+    def guardar(self, usuario_id, valores):
+        with self._lock:
+            self._datos[usuario_id] = (time.monotonic() + self.ttl, valores)
+            self._datos.move_to_end(usuario_id)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+
+    def invalidar(self, usuario_id):
+        with self._lock:
+            self._datos.pop(usuario_id, None)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+cache_usuarios = CacheUsuarios(settings.AUTH_CACHE_MAX_USUARIOS, settings.AUTH_CACHE_TTL)
+
+
+def _valores_usuario(usuario_id):
+    valores = cache_usuarios.obtener(usuario_id)
+    if valores is None and settings.AUTH_CACHE_COMPARTIDA:
+        valores = cache.get(f'{CACHE_PREFIX}{usuario_id}')
+        if valores is not None:
+            cache_usuarios.guardar(usuario_id, valores)
+    return valores
+
+
+def _guardar_valores(usuario_id, valores):
+    cache_usuarios.guardar(usuario_id, valores)
+    if settings.AUTH_CACHE_COMPARTIDA:
+        cache.set(f'{CACHE_PREFIX}{usuario_id}', valores, settings.AUTH_CACHE_TTL)
+
+
+def _borrar_usuario(usuario_id):
+    cache_usuarios.invalidar(usuario_id)
+    if settings.AUTH_CACHE_COMPARTIDA:
+        cache.delete(f'{CACHE_PREFIX}{usuario_id}')
+
+
+def invalidar_usuario(usuario_id):
+    # Como el estado del estudiante, tras el commit: antes, una petición concurrente
+    # volvería a guardar la fila anterior (activo, contraseña antigua) durante todo el TTL
+    transaction.on_commit(lambda: _borrar_usuario(usuario_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication que evita la consulta del usuario en cada petición.
+
+    Guarda CAMPOS_USUARIO en una LRU por proceso (y opcionalmente en la caché compartida)
+    durante AUTH_CACHE_TTL segundos. El usuario se reconstruye con ``from_db`` y los demás
+    campos quedan diferidos, así que ``user.save()`` solo escribe los campos cargados.
+    Las entradas se invalidan al guardar o borrar el User (ver signals.py); en otros
+    procesos caducan como máximo tras el TTL.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN or api_settings.USER_ID_FIELD != 'id':
+            return super().get_user(validated_token)
+
+        try:
+            usuario_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        valores = _valores_usuario(usuario_id)
+        if valores is None:
+            valores = User.objects.filter(id=usuario_id).values_list(*CAMPOS_USUARIO).first()
+            if valores is None:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            _guardar_valores(usuario_id, valores)
+
+        user = User.from_db(DEFAULT_DB_ALIAS, CAMPOS_USUARIO, valores)
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
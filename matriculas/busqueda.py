@@ -0,0 +1,35 @@
+"""
+Búsqueda de matrículas por nombre o DNI del estudiante para el panel de administración.
+
+Ambas búsquedas son por prefijo sobre columnas indexadas (Estudiante.nombre_busqueda y
+Estudiante.dni) y el orden de los resultados sigue esa misma columna, de modo que la
+paginación por cursor recorre el índice en lugar de ordenar todas las coincidencias.
+"""
+from django.db.models import F
+
+from .models import Matricula, normalizar_busqueda
+
+FILTROS = {
+    'estado': 'estado',
+    'curso': 'curso',
+}
+
+
+def buscar_matriculas(params):
+    """
+    ``q`` con solo dígitos busca por prefijo de DNI; cualquier otro texto, por prefijo
+    del nombre sin tildes ni mayúsculas. Devuelve el queryset anotado con ``orden``.
+    """
+    termino = normalizar_busqueda(params.get('q'))
+    campo = 'estudiante__dni' if termino.isdigit() else 'estudiante__nombre_busqueda'
+
+    queryset = Matricula.objects.con_detalle().annotate(orden=F(campo))
+    if termino:
+        # LIKE 'jose%' recorre el índice con la collation de la columna. Un rango calculado
+        # a mano (['jose', 'josf')) dependería de cómo ordena esa collation los signos. Se usa
+        # istartswith porque en MySQL startswith es LIKE BINARY, que no usa el índice; las
+        # dos columnas ya están en minúsculas y sin tildes, así que el resultado es el mismo.
+        queryset = queryset.filter(**{f'{campo}__istartswith': termino})
+
+    filtros = {campo: params[nombre] for nombre, campo in FILTROS.items() if params.get(nombre)}
+    return queryset.filter(**filtros)
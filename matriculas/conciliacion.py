@@ -0,0 +1,139 @@
+"""
+Conciliación de los pagos pendientes con Stripe (comando reconcile_payments).
+
+Si el cliente nunca llama a ConfirmarPagoAPIView y el webhook no llega, el Pago se queda
+'Pendiente'. Aquí se obtiene el estado real de los PaymentIntents de los pagos pendientes
+sin hacer una llamada secuencial por pago, de una de dos formas:
+
+- ``listar``: recorre la lista de PaymentIntents de la cuenta, POR_PAGINA por llamada,
+  hasta haber visto todos los pendientes. Es lo habitual con muchos pendientes.
+- ``consultar``: un retrieve por pago, en paralelo con un número acotado de hilos. Conviene
+  cuando los pendientes son pocos frente al total de intents de la cuenta.
+
+Las correcciones se aplican por bloques de TAMANO_BLOQUE con actualizaciones por conjunto
+que siguen la máquina de estados (estados.cambiar_estado_en_lote): como en confirmar_pago,
+la matrícula solo pasa a 'Pagado' si seguía 'Pendiente', y un pago que cambió mientras
+tanto no se toca.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import stripe
+from django.db import transaction
+
+from .estado_estudiante import ESTADOS_PAGO_PENDIENTE, invalidar_estado_por_matriculas
+from .estados import TAMANO_BLOQUE, cambiar_estado_en_lote
+from .models import Matricula, Pago
+from .stripe_client import cliente_stripe, invalidar_payment_intents
+
+MODOS = ('listar', 'consultar')
+POR_PAGINA = 100  # máximo que admite la API de Stripe
+
+# Estado de Stripe -> estado del Pago; el resto ('processing', 'requires_*') sigue pendiente
+ESTADOS_STRIPE = {
+    'succeeded': 'Completado',
+    'canceled': 'Fallido',
+}
+
+
+def _pagos_pendientes():
+    """{intent_id: (pago_id, matricula_id, estado, monto en céntimos)} de los pagos por cobrar."""
+    filas = Pago.objects.filter(
+        estado__in=ESTADOS_PAGO_PENDIENTE, stripe_payment_intent_id__isnull=False
+    ).exclude(stripe_payment_intent_id='').values_list(
+        'stripe_payment_intent_id', 'id', 'matricula_id', 'estado', 'matricula__monto'
+    )
+    return {
+        intent_id: (pago_id, matricula_id, estado, int(monto * 100))
+        for intent_id, pago_id, matricula_id, estado, monto in filas.iterator(chunk_size=TAMANO_BLOQUE)
+    }
+
+
+def _listar(pendientes, informe):
+    """Intents de la cuenta que están en ``pendientes``, página a página."""
+    faltan = set(pendientes)
+    parametros = {'limit': POR_PAGINA}
+    while faltan:
+        pagina = cliente_stripe().payment_intents.list(params=parametros)
+        informe['llamadas_stripe'] += 1
+        for intent in pagina.data:
+            if intent['id'] in faltan:
+                faltan.discard(intent['id'])
+                yield intent
+        if not pagina.has_more or not pagina.data:
+            return
+        parametros['starting_after'] = pagina.data[-1]['id']
+
+
+def _recuperar(intent_id):
+    try:
+        return cliente_stripe().payment_intents.retrieve(intent_id)
+    except stripe.InvalidRequestError as e:
+        if e.code == 'resource_missing':
+            return None
+        raise
+
+
+def _consultar(pendientes, informe, hilos):
+    """Un retrieve por pendiente, como mucho ``hilos`` a la vez y por bloques."""
+    intent_ids = iter(list(pendientes))
+    with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='conciliacion') as pool:
+        while bloque := list(islice(intent_ids, TAMANO_BLOQUE)):
+            informe['llamadas_stripe'] += len(bloque)
+            yield from (intent for intent in pool.map(_recuperar, bloque) if intent is not None)
+
+
+def _aplicar(correcciones):
+    """
+    Aplica un bloque de ``(pago_id, matricula_id, intent_id, estado nuevo)``. Devuelve
+    los ids de los pagos cambiados.
+    """
+    por_estado = {nuevo: [pago_id for pago_id, _, _, estado in correcciones if estado == nuevo]
+                  for nuevo in ESTADOS_STRIPE.values()}
+    with transaction.atomic():
+        completados = cambiar_estado_en_lote(Pago, por_estado['Completado'], 'Completado')
+        fallidos = cambiar_estado_en_lote(Pago, por_estado['Fallido'], 'Fallido')
+        cambiar_estado_en_lote(Matricula, [m for p, m, _, _ in correcciones if p in completados], 'Pagado')
+    cambiados = completados.keys() | fallidos.keys()
+    invalidar_payment_intents([intent_id for p, _, intent_id, _ in correcciones if p in cambiados])
+    invalidar_estado_por_matriculas([m for p, m, _, _ in correcciones if p in cambiados])
+    return cambiados
+
+
+def conciliar(modo='listar', hilos=16, simular=False):
+    """
+    Compara los pagos pendientes con Stripe y corrige los que ya terminaron. Con
+    ``simular`` solo informa. Devuelve el informe de desviaciones: cuántos pagos se
+    revisaron y se corrigieron por estado, los que ya coincidían, los que cambiaron entre la
+    lectura y la corrección (``conflictos``) y los intent ids no encontrados en Stripe o
+    con un importe distinto del de la matrícula.
+    """
+    if modo not in MODOS:
+        raise ValueError(f'Modo desconocido: {modo}')
+
+    pendientes = _pagos_pendientes()
+    informe = {
+        'revisados': len(pendientes), 'llamadas_stripe': 0, 'Completado': 0, 'Fallido': 0,
+        'sin_cambios': 0, 'conflictos': 0, 'no_encontrados': [], 'montos_distintos': [],
+    }
+    intents = _listar(pendientes, informe) if modo == 'listar' else _consultar(pendientes, informe, hilos)
+
+    while bloque := list(islice(intents, TAMANO_BLOQUE)):
+        correcciones = []
+        for intent in bloque:
+            pago_id, matricula_id, estado, monto = pendientes.pop(intent['id'])
+            if intent['amount'] != monto:
+                informe['montos_distintos'].append(intent['id'])
+            nuevo = ESTADOS_STRIPE.get(intent['status'], estado)
+            if nuevo == estado:
+                informe['sin_cambios'] += 1
+            else:
+                correcciones.append((pago_id, matricula_id, intent['id'], nuevo))
+
+        if correcciones:
+            cambiados = {c[0] for c in correcciones} if simular else _aplicar(correcciones)
+            for pago_id, _, _, nuevo in correcciones:
+                informe[nuevo if pago_id in cambiados else 'conflictos'] += 1
+
+    informe['no_encontrados'] = sorted(pendientes)
+    return informe
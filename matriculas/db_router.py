@@ -0,0 +1,73 @@
+"""
+Enrutado de lecturas a réplicas (settings.DATABASE_REPLICAS).
+
+Solo van a réplica las lecturas hechas dentro de ``lecturas_en_replica()`` (listados y
+reportes de administración); el resto del tráfico, y en particular el flujo de pago,
+sigue en ``default``. Dentro de ese contexto, en cuanto hay una escritura (o un
+select_for_update, que Django enruta como escritura) las lecturas siguientes vuelven al
+primario para leer lo escrito.
+Las réplicas pueden ir algo retrasadas respecto al primario.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+_contexto_replica = contextvars.ContextVar('contexto_replica', default=None)
+
+
+class _ContextoReplica:
+    __slots__ = ('alias', 'escrito')
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.escrito = False
+
+
+def elegir_replica():
+    """Alias de una réplica al azar, o ``default`` si no hay réplicas configuradas."""
+    replicas = settings.DATABASE_REPLICAS
+    return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def lecturas_en_replica():
+    """Envía a una misma réplica las lecturas del bloque (también sirve como decorador)."""
+    token = _contexto_replica.set(_ContextoReplica(elegir_replica()))
+    try:
+        yield
+    finally:
+        _contexto_replica.reset(token)
+
+
+class RouterReplicas:
+    def db_for_read(self, model, **hints):
+        instancia = hints.get('instance')
+        if instancia is not None and instancia._state.db:
+            # Relaciones y prefetch se leen de la misma base que el objeto de origen
+            return instancia._state.db
+
+        contexto = _contexto_replica.get()
+        if contexto is None or contexto.escrito:
+            return None
+        return contexto.alias
+
+    def db_for_write(self, model, **hints):
+        contexto = _contexto_replica.get()
+        if contexto is not None:
+            contexto.escrito = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        bases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in bases and obj2._state.db in bases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Las réplicas reciben el esquema por replicación
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
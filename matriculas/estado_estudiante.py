@@ -0,0 +1,107 @@
+import asyncio
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .models import Estudiante, Matricula, Pago
+from .stripe_client import obtener_client_secret, obtener_client_secret_async
+
+CACHE_PREFIX = 'estado_estudiante:'
+CAMPOS_ESTUDIANTE = (
+    'id', 'usuario_id', 'nombre', 'dni', 'fecha_nacimiento', 'grado', 'direccion', 'certificado_estudios'
+)
+ESTADOS_PAGO_PENDIENTE = ('Pendiente', 'Fallido')
+
+
+def _cache_key(usuario_id):
+    return f'{CACHE_PREFIX}{usuario_id}'
+
+
+def _consulta_estado(usuario_id):
+    """Estudiante, primera matrícula y primer pago del usuario en una sola consulta con LEFT JOIN."""
+    return (
+        Estudiante.objects.filter(usuario_id=usuario_id)
+        .order_by('matricula__id', 'matricula__pago__id')
+        .values(
+            *CAMPOS_ESTUDIANTE,
+            matricula_id=F('matricula__id'),
+            matricula_estado=F('matricula__estado'),
+            pago_id=F('matricula__pago__id'),
+            pago_estado=F('matricula__pago__estado'),
+            stripe_payment_intent_id=F('matricula__pago__stripe_payment_intent_id'),
+            client_secret=F('matricula__pago__client_secret'),
+        )
+    )
+
+
+def _separar_fila(fila):
+    """
+    Convierte la fila de _consulta_estado en el diccionario de estado. Devuelve también
+    el Pago cuyo client_secret falta por obtener (pagos antiguos), o None.
+    """
+    if fila is None:
+        return {'estudiante': None, 'matricula_id': None, 'matricula_estado': None,
+                'pago_id': None, 'pago_estado': None, 'client_secret': None}, None
+
+    estado = {campo: fila.pop(campo) for campo in (
+        'matricula_id', 'matricula_estado', 'pago_id', 'pago_estado', 'client_secret'
+    )}
+    intent_id = fila.pop('stripe_payment_intent_id')
+    estado['estudiante'] = fila
+    if estado['pago_id'] and not estado['client_secret'] and intent_id:
+        return estado, Pago(id=estado['pago_id'], stripe_payment_intent_id=intent_id)
+    return estado, None
+
+
+def obtener_estado_estudiante(usuario_id):
+    """
+    Devuelve el estado del estudiante del usuario: sus datos (valores de los campos del
+    modelo), el estado de su primera matrícula y el de su primer pago con el client_secret.
+
+    El resultado se guarda en caché por usuario y se invalida al confirmarse la transacción
+    que guarda Estudiante, Matricula o Pago (ver signals.py) o hace una actualización por
+    conjunto.
+    """
+    key = _cache_key(usuario_id)
+    estado = cache.get(key)
+    if estado is None:
+        estado, pago = _separar_fila(_consulta_estado(usuario_id).first())
+        if pago:
+            estado['client_secret'] = obtener_client_secret(pago)
+        cache.set(key, estado, settings.ESTADO_ESTUDIANTE_CACHE_TTL)
+    return estado
+
+
+async def obtener_estado_estudiante_async(usuario_id):
+    """Versión asíncrona de obtener_estado_estudiante; la consulta se limita a ASYNC_DB_TIMEOUT."""
+    key = _cache_key(usuario_id)
+    estado = await cache.aget(key)
+    if estado is None:
+        fila = await asyncio.wait_for(_consulta_estado(usuario_id).afirst(), settings.ASYNC_DB_TIMEOUT)
+        estado, pago = _separar_fila(fila)
+        if pago:
+            estado['client_secret'] = await obtener_client_secret_async(pago)
+        await cache.aset(key, estado, settings.ESTADO_ESTUDIANTE_CACHE_TTL)
+    return estado
+
+
+def invalidar_estado_estudiante(*usuario_ids):
+    claves = [_cache_key(usuario_id) for usuario_id in usuario_ids if usuario_id]
+    if claves:
+        # Tras el commit: si se borrara antes, una consulta entre el borrado y el commit
+        # volvería a guardar en caché el estado anterior durante todo el TTL
+        transaction.on_commit(lambda: cache.delete_many(claves))
+
+
+def invalidar_estado_por_matriculas(matricula_ids):
+    usuario_ids = Matricula.objects.filter(id__in=matricula_ids).values_list('estudiante__usuario_id', flat=True)
+    invalidar_estado_estudiante(*usuario_ids)
+
+
+def invalidar_estado_por_intent(intent_id):
+    usuario_ids = Pago.objects.filter(stripe_payment_intent_id=intent_id).values_list(
+        'matricula__estudiante__usuario_id', flat=True
+    )
+    invalidar_estado_estudiante(*usuario_ids)
@@ -0,0 +1,215 @@
+"""
+Máquina de estados de matrículas y pagos.
+
+Cada cambio de estado es un ``UPDATE ... WHERE id = ... AND estado = ...`` condicional que
+solo escribe la columna ``estado``, uno por cada estado previo permitido hasta que uno
+cambia la fila: el número de filas actualizadas dice desde qué estado se pasó, sin leer
+antes la fila ni bloquearla. De dos peticiones concurrentes (confirmación del pago y
+verificación del administrador) cada una aplica su transición solo si el estado que
+encuentra la permite, y la otra recibe un conflicto en lugar de sobrescribirla.
+"""
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Subquery
+
+from .estado_estudiante import invalidar_estado_por_matriculas
+from .models import Matricula, NotificacionEmail, Pago
+from .notificaciones import construir_email_aprobacion, encolar_email_aprobacion
+from .resumen import MATRICULA, PAGO, ajustar_resumen, transicion
+
+# Para cada estado, los estados desde los que se puede llegar a él, del más al menos
+# habitual (se prueban en este orden)
+TRANSICIONES_MATRICULA = {
+    'Pagado': ('Pendiente',),
+    # El administrador puede cambiar de decisión o reabrirla
+    'Aprobado': ('Pagado', 'Pendiente', 'Rechazado'),
+    'Rechazado': ('Pagado', 'Pendiente', 'Aprobado'),
+    'Pendiente': ('Aprobado', 'Rechazado'),
+}
+TRANSICIONES_PAGO = {
+    'Completado': ('Pendiente', 'Fallido'),
+    'Fallido': ('Pendiente',),
+}
+# modelo: (tipo en el resumen del panel, campo del monto, transiciones)
+MAQUINAS_DE_ESTADO = {
+    Matricula: (MATRICULA, 'monto', TRANSICIONES_MATRICULA),
+    Pago: (PAGO, 'matricula__monto', TRANSICIONES_PAGO),
+}
+
+# Condiciones que, además del estado previo, comprueba el mismo UPDATE. Una matrícula
+# pagada no vuelve a 'Pendiente' aunque se haya aprobado o rechazado después del pago.
+CONDICIONES_TRANSICION = {
+    (Matricula, 'Pendiente'): lambda: ~Exists(Pago.objects.filter(matricula=OuterRef('pk'), estado='Completado')),
+}
+
+# Estados que puede fijar un administrador con MatriculaViewSet.verificar
+ESTADOS_VERIFICACION = ('Aprobado', 'Rechazado', 'Pendiente')
+
+# Estados desde los que la verificación en lote aprueba o rechaza (solo las no decididas)
+ESTADOS_PREVIOS_VERIFICACION = {
+    'Aprobado': ('Pendiente', 'Pagado'),
+    'Rechazado': ('Pendiente', 'Pagado'),
+}
+
+# Filtros con nombre que acepta la verificación en lote
+FILTROS_VERIFICACION = {
+    'pagadas_pendientes': {'estado': 'Pagado'},
+}
+
+TAMANO_BLOQUE = 1000
+
+
+class TransicionNoPermitida(Exception):
+    """El estado actual no admite el cambio pedido; las vistas responden 409."""
+
+    def __init__(self, actual, nuevo):
+        super().__init__(f"No se puede pasar del estado '{actual}' a '{nuevo}'.")
+        self.actual = actual
+        self.nuevo = nuevo
+
+
+class _CambioIncompleto(Exception):
+    pass
+
+
+def _filas_que_pueden_pasar(modelo, nuevo):
+    condicion = CONDICIONES_TRANSICION.get((modelo, nuevo))
+    return modelo.objects.filter(condicion()) if condicion else modelo.objects.all()
+
+
+def cambiar_estado(modelo, pk, nuevo):
+    """
+    Pasa la fila ``pk`` de ``modelo`` (Matricula o Pago) al estado ``nuevo``.
+
+    Devuelve el estado anterior, o None si ya estaba en ``nuevo``. Lanza
+    TransicionNoPermitida si el estado actual no lo permite y ``modelo.DoesNotExist`` si
+    la fila no existe. Solo cuando no se aplica se lee el estado actual.
+    """
+    tipo, campo_monto, transiciones = MAQUINAS_DE_ESTADO[modelo]
+    filas = _filas_que_pueden_pasar(modelo, nuevo).filter(pk=pk)
+    # El monto se lee en el propio UPDATE de los contadores del resumen
+    monto = Subquery(modelo.objects.filter(pk=pk).values(campo_monto)[:1])
+    with transaction.atomic(savepoint=False):
+        for previo in transiciones[nuevo]:
+            if filas.filter(estado=previo).update(estado=nuevo):
+                ajustar_resumen(transicion(tipo, previo, nuevo, monto))
+                return previo
+
+    actual = modelo.objects.filter(pk=pk).values_list('estado', flat=True).first()
+    if actual is None:
+        raise modelo.DoesNotExist(f'{modelo.__name__} {pk} no existe.')
+    if actual == nuevo:
+        return None
+    raise TransicionNoPermitida(actual, nuevo)
+
+
+def _pasar_grupo(filas, ids, nuevo):
+    """
+    Pasa a ``nuevo`` las filas ``ids`` de ``filas`` (ya filtradas por su estado previo).
+    Devuelve los ids cambiados. Si alguna cambió de estado desde que se leyó, el UPDATE por
+    conjunto se deshace y se repite fila a fila para saber exactamente cuáles pasaron.
+    """
+    try:
+        with transaction.atomic():
+            if filas.filter(id__in=ids).update(estado=nuevo) != len(ids):
+                raise _CambioIncompleto
+        return ids
+    except _CambioIncompleto:
+        return [i for i in ids if filas.filter(pk=i).update(estado=nuevo)]
+
+
+def _cambiar_bloque(modelo, ids, nuevo, permitidos):
+    """
+    Pasa a ``nuevo`` las filas de ``ids`` que están en uno de los estados ``permitidos``.
+    Devuelve ``({id: estado anterior} de las cambiadas, {id: estado leído} de todas)``.
+    """
+    tipo, campo_monto, _ = MAQUINAS_DE_ESTADO[modelo]
+    leidas = {
+        i: (estado, monto)
+        for i, estado, monto in modelo.objects.filter(id__in=ids).values_list('id', 'estado', campo_monto)
+    }
+    filas = _filas_que_pueden_pasar(modelo, nuevo)
+    anteriores = {}
+    with transaction.atomic(savepoint=False):
+        for previo in permitidos:
+            grupo = [i for i in ids if i in leidas and leidas[i][0] == previo]
+            if grupo:
+                anteriores.update(dict.fromkeys(_pasar_grupo(filas.filter(estado=previo), grupo, nuevo), previo))
+        ajustar_resumen([
+            cambio for i, previo in anteriores.items() for cambio in transicion(tipo, previo, nuevo, leidas[i][1])
+        ])
+    return anteriores, {i: estado for i, (estado, _) in leidas.items()}
+
+
+def cambiar_estado_en_lote(modelo, ids, nuevo):
+    """
+    Versión por conjuntos de cambiar_estado para un bloque de filas: pasa a ``nuevo`` las
+    de ``ids`` cuyo estado lo permite, con un UPDATE por estado previo; las demás no se
+    tocan. Devuelve ``{id: estado anterior}`` de las filas cambiadas.
+    """
+    if not ids:
+        return {}
+    return _cambiar_bloque(modelo, ids, nuevo, MAQUINAS_DE_ESTADO[modelo][2][nuevo])[0]
+
+
+def verificar_matricula(matricula, nuevo_estado):
+    """
+    Cambia el estado de una matrícula por decisión del administrador y, si se aprueba,
+    encola el correo en la misma transacción. Devuelve el estado anterior (None si no cambió).
+    """
+    with transaction.atomic():
+        anterior = cambiar_estado(Matricula, matricula.pk, nuevo_estado)
+        if anterior is not None and nuevo_estado == 'Aprobado':
+            encolar_email_aprobacion(matricula)
+    invalidar_estado_por_matriculas([matricula.pk])
+    return anterior
+
+
+def verificar_en_lote(nuevo_estado, ids=None, filtro=None):
+    """
+    Aprueba o rechaza varias matrículas con actualizaciones por conjunto.
+
+    Solo se modifican las filas que están en un estado previo válido; para el resto se
+    informa el motivo. Los correos de aprobación se encolan en la misma transacción.
+    Devuelve una lista de resultados ``{'id', 'resultado', 'estado_anterior'}``.
+    """
+    estados_previos = ESTADOS_PREVIOS_VERIFICACION[nuevo_estado]
+    resultados = []
+    actualizadas = []
+
+    with transaction.atomic():
+        if ids is None:
+            ids = list(
+                Matricula.objects.filter(**FILTROS_VERIFICACION[filtro])
+                .order_by('id').values_list('id', flat=True)
+            )
+        else:
+            ids = list(dict.fromkeys(ids))
+
+        for inicio in range(0, len(ids), TAMANO_BLOQUE):
+            bloque = ids[inicio:inicio + TAMANO_BLOQUE]
+            cambiadas, estados = _cambiar_bloque(Matricula, bloque, nuevo_estado, estados_previos)
+            actualizadas.extend(i for i in bloque if i in cambiadas)
+
+            for matricula_id in bloque:
+                estado_anterior = estados.get(matricula_id)
+                if estado_anterior is None:
+                    resultado = 'no_encontrada'
+                elif matricula_id in cambiadas:
+                    resultado = 'actualizada'
+                else:
+                    resultado = 'estado_invalido'
+                resultados.append({'id': matricula_id, 'resultado': resultado, 'estado_anterior': estado_anterior})
+
+        if nuevo_estado == 'Aprobado' and actualizadas:
+            for inicio in range(0, len(actualizadas), TAMANO_BLOQUE):
+                matriculas = Matricula.objects.filter(
+                    id__in=actualizadas[inicio:inicio + TAMANO_BLOQUE]
+                ).select_related('estudiante__usuario')
+                NotificacionEmail.objects.bulk_create(
+                    [construir_email_aprobacion(m) for m in matriculas], batch_size=TAMANO_BLOQUE
+                )
+
+    for inicio in range(0, len(actualizadas), TAMANO_BLOQUE):
+        invalidar_estado_por_matriculas(actualizadas[inicio:inicio + TAMANO_BLOQUE])
+
+    return resultados
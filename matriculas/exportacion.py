@@ -0,0 +1,89 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .db_router import elegir_replica
+from .models import Matricula
+
+COLUMNAS = {
+    'id': 'id',
+    'curso': 'curso',
+    'monto': 'monto',
+    'estado': 'estado',
+    'estudiante_nombre': 'estudiante__nombre',
+    'estudiante_dni': 'estudiante__dni',
+    'estudiante_email': 'estudiante__usuario__email',
+    'pago_estado': 'pago__estado',
+    'stripe_payment_intent_id': 'pago__stripe_payment_intent_id',
+}
+FILTROS = {
+    'estado': 'estado',
+    'curso': 'curso',
+    'pago_estado': 'pago__estado',
+}
+TAMANO_BLOQUE = 2000
+# Una celda que empieza así la interpretan Excel o LibreOffice como fórmula
+INICIOS_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+
+class _Eco:
+    """Objeto tipo archivo que devuelve lo escrito en lugar de guardarlo (para csv.writer)."""
+
+    def write(self, value):
+        return value
+
+
+def filas_exportacion(params):
+    """
+    Recorre las matrículas por bloques de TAMANO_BLOQUE con paginación por clave (``id``)
+    y devuelve tuplas en el orden de COLUMNAS. Solo se mantiene en memoria un bloque a la
+    vez con cualquier motor: ``iterator()`` no usa un cursor del servidor con mysqlclient,
+    que cargaría todo el resultado en el cliente.
+
+    Cada bloque son dos consultas acotadas: los ids de las siguientes TAMANO_BLOQUE
+    matrículas y después todas las filas de ese rango, para no partir entre dos bloques
+    las filas de una matrícula con varios pagos.
+
+    Se lee de una réplica de forma explícita: la respuesta se genera después de que la
+    vista haya terminado, fuera de cualquier ``lecturas_en_replica()``.
+    """
+    filtros = {campo: params[nombre] for nombre, campo in FILTROS.items() if params.get(nombre)}
+    queryset = Matricula.objects.using(elegir_replica()).filter(**filtros)
+    ultimo = 0
+    while True:
+        ids = list(
+            queryset.filter(id__gt=ultimo).order_by('id').values_list('id', flat=True).distinct()[:TAMANO_BLOQUE]
+        )
+        if not ids:
+            return
+        yield from queryset.filter(id__gte=ids[0], id__lte=ids[-1]).order_by('id', 'pago__id').values_list(
+            *COLUMNAS.values()
+        )
+        ultimo = ids[-1]
+
+
+def celda_csv(valor):
+    """Neutraliza los textos que una hoja de cálculo ejecutaría como fórmula."""
+    if isinstance(valor, str) and valor.startswith(INICIOS_FORMULA):
+        return f"'{valor}"
+    return valor
+
+
+def generar_csv(filas):
+    writer = csv.writer(_Eco())
+    yield writer.writerow(COLUMNAS.keys())
+    for fila in filas:
+        yield writer.writerow([celda_csv(valor) for valor in fila])
+
+
+def generar_ndjson(filas):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    nombres = list(COLUMNAS)
+    for fila in filas:
+        yield encoder.encode(dict(zip(nombres, fila))) + '\n'
+
+
+FORMATOS = {
+    'csv': (generar_csv, 'text/csv; charset=utf-8'),
+    'ndjson': (generar_ndjson, 'application/x-ndjson; charset=utf-8'),
+}
@@ -0,0 +1,141 @@
+"""
+Servidor HTTP local que imita la API de PaymentIntents de Stripe.
+
+Se usa en las pruebas y en los benchmarks para no depender de la API real. Permite
+inyectar latencia y cuenta las llamadas recibidas::
+
+    with ServidorStripeFalso(latencia=0.2) as servidor:
+        stripe.api_base = servidor.url
+"""
+import bisect
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+RUTA_INTENT = re.compile(r'^/v1/payment_intents/(?P<id>[^/]+)$')
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, codigo, datos):
+        cuerpo = json.dumps(datos).encode()
+        self.send_response(codigo)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_GET(self):
+        servidor = self.server.stripe
+        servidor.esperar()
+        ruta = urlparse(self.path)
+        if ruta.path == '/v1/payment_intents':
+            servidor.contar('list')
+            self._responder(200, servidor.listar(parse_qs(ruta.query)))
+            return
+        coincidencia = RUTA_INTENT.match(ruta.path)
+        intent = servidor.intents.get(coincidencia.group('id')) if coincidencia else None
+        servidor.contar('retrieve')
+        if intent is None:
+            self._responder(404, {'error': {'type': 'invalid_request_error', 'code': 'resource_missing',
+                                            'message': 'No such payment_intent'}})
+        else:
+            self._responder(200, intent)
+
+    def do_POST(self):
+        servidor = self.server.stripe
+        servidor.esperar()
+        longitud = int(self.headers.get('Content-Length') or 0)
+        datos = {clave: valores[0] for clave, valores in parse_qs(self.rfile.read(longitud).decode()).items()}
+        if urlparse(self.path).path != '/v1/payment_intents':
+            self._responder(404, {'error': {'type': 'invalid_request_error', 'message': 'Ruta no soportada'}})
+            return
+        servidor.contar('create')
+        self._responder(200, servidor.crear_intent(
+            int(datos.get('amount', 0)), datos.get('currency', 'usd'),
+            {clave[9:-1]: valor for clave, valor in datos.items() if clave.startswith('metadata[')},
+            clave_idempotencia=self.headers.get('Idempotency-Key'),
+        ))
+
+
+class ServidorStripeFalso:
+    def __init__(self, latencia=0.0, host='127.0.0.1', puerto=0):
+        self.latencia = latencia
+        self.intents = {}
+        self.claves_idempotencia = {}
+        self.llamadas = Counter()
+        self._orden = []
+        self._lock = threading.Lock()
+        self._http = ThreadingHTTPServer((host, puerto), _Manejador)
+        self._http.daemon_threads = True
+        self._http.stripe = self
+        self._hilo = None
+
+    @property
+    def url(self):
+        host, puerto = self._http.server_address[:2]
+        return f'http://{host}:{puerto}'
+
+    def esperar(self):
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    def contar(self, operacion):
+        with self._lock:
+            self.llamadas[operacion] += 1
+
+    def crear_intent(self, amount, currency='usd', metadata=None, status='requires_payment_method',
+                     clave_idempotencia=None):
+        with self._lock:
+            # Como Stripe, la misma Idempotency-Key devuelve el intent ya creado
+            if clave_idempotencia in self.claves_idempotencia:
+                return self.intents[self.claves_idempotencia[clave_idempotencia]]
+            intent_id = f'pi_fake_{len(self.intents) + 1:08d}'
+            self.intents[intent_id] = {
+                'id': intent_id,
+                'object': 'payment_intent',
+                'amount': amount,
+                'currency': currency,
+                'status': status,
+                'client_secret': f'{intent_id}_secret_fake',
+                'metadata': metadata or {},
+                'created': int(time.time()),
+            }
+            if clave_idempotencia:
+                self.claves_idempotencia[clave_idempotencia] = intent_id
+            return self.intents[intent_id]
+
+    def listar(self, parametros):
+        limite = int(parametros.get('limit', ['10'])[0])
+        despues = parametros.get('starting_after', [None])[0]
+        with self._lock:
+            # Los intents no se borran: el orden solo cambia si hay intents nuevos
+            if len(self._orden) != len(self.intents):
+                self._orden = sorted(self.intents)
+            ids = self._orden
+        inicio = bisect.bisect_right(ids, despues) if despues in self.intents else 0
+        pagina = [self.intents[i] for i in ids[inicio:inicio + limite]]
+        return {'object': 'list', 'url': '/v1/payment_intents', 'data': pagina, 'has_more': len(ids) > inicio + limite}
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._http.serve_forever, daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self._http.shutdown()
+        self._http.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.detener()
@@ -0,0 +1,134 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+FORMATOS_PERMITIDOS = ('JPEG', 'PNG', 'WEBP', 'GIF')
+DIRECTORIO_VARIANTES = 'fotos_perfil/variantes'
+
+# Miniaturas cuadradas que se generan para cada foto de perfil: nombre -> lado en píxeles
+TAMANOS_VARIANTES = {
+    'miniatura': 96,
+    'mediana': 320,
+}
+
+_pool = None
+
+
+def validar_foto(archivo):
+    """
+    Valida una imagen ya abierta por el ImageField (solo lee la cabecera).
+    Devuelve un mensaje de error o None si la imagen es aceptable.
+    """
+    imagen = getattr(archivo, 'image', None)
+    if imagen is None:
+        return None
+    if imagen.format not in FORMATOS_PERMITIDOS:
+        return f"Formato de imagen no permitido. Use {', '.join(FORMATOS_PERMITIDOS)}."
+    ancho, alto = imagen.size
+    if ancho * alto > settings.FOTO_PERFIL_MAX_PIXELES:
+        return "La imagen tiene demasiados píxeles."
+    return None
+
+
+def generar_variantes(origen, media_root, max_lado):
+    """
+    Limita el tamaño del original y genera las miniaturas en JPEG y WebP.
+
+    Se ejecuta en el pool de procesos, por lo que solo trabaja con rutas del sistema
+    de archivos y Pillow. Devuelve ``{variante: ruta relativa a MEDIA_ROOT}``.
+    """
+    base = os.path.splitext(os.path.basename(origen))[0]
+    directorio = os.path.join(media_root, DIRECTORIO_VARIANTES)
+    os.makedirs(directorio, exist_ok=True)
+    variantes = {}
+
+    with Image.open(origen) as imagen:
+        formato = imagen.format
+        imagen = ImageOps.exif_transpose(imagen)
+        if max(imagen.size) > max_lado:
+            imagen.thumbnail((max_lado, max_lado))
+            imagen.save(origen, format=formato)
+        if imagen.mode not in ('RGB', 'RGBA'):
+            imagen = imagen.convert('RGBA')
+
+        for nombre, lado in TAMANOS_VARIANTES.items():
+            miniatura = ImageOps.fit(imagen, (lado, lado))
+            for extension, formato_salida in (('jpg', 'JPEG'), ('webp', 'WEBP')):
+                ruta = f'{DIRECTORIO_VARIANTES}/{base}_{nombre}.{extension}'
+                salida = miniatura.convert('RGB') if formato_salida == 'JPEG' else miniatura
+                salida.save(os.path.join(media_root, ruta), format=formato_salida, quality=85)
+                clave = nombre if formato_salida == 'JPEG' else f'{nombre}_webp'
+                variantes[clave] = ruta
+
+    return variantes
+
+
+def _obtener_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=settings.FOTOS_PERFIL_PROCESOS)
+    return _pool
+
+
+def _guardar_variantes(perfil_id, nombre_foto, variantes=None, error=None):
+    from .models import PerfilUsuario
+
+    # Solo se actualiza si la foto no se ha vuelto a cambiar mientras se procesaba
+    perfil = PerfilUsuario.objects.filter(pk=perfil_id, foto_perfil=nombre_foto)
+    if error is None:
+        perfil.update(variantes_foto=variantes, estado_foto='Lista')
+    else:
+        logger.warning('Error al procesar la foto de perfil %s: %s', perfil_id, error)
+        perfil.update(estado_foto='Error')
+
+
+def _al_terminar(perfil_id, nombre_foto, future):
+    try:
+        _guardar_variantes(perfil_id, nombre_foto, variantes=future.result())
+    except Exception as e:
+        _guardar_variantes(perfil_id, nombre_foto, error=e)
+    finally:
+        # El callback corre en un hilo del pool: se cierra su conexión a la base de datos
+        connections.close_all()
+
+
+def procesar_foto(perfil_id, nombre_foto):
+    """Procesa la foto en el proceso actual (comando procesar_fotos_perfil y modo síncrono)."""
+    try:
+        variantes = generar_variantes(
+            default_storage.path(nombre_foto), str(settings.MEDIA_ROOT), settings.FOTO_PERFIL_MAX_LADO
+        )
+    except Exception as e:
+        _guardar_variantes(perfil_id, nombre_foto, error=e)
+        return False
+    _guardar_variantes(perfil_id, nombre_foto, variantes=variantes)
+    return True
+
+
+def _enviar_a_procesar(perfil_id, nombre_foto):
+    if not settings.PROCESAR_FOTOS_EN_SEGUNDO_PLANO:
+        procesar_foto(perfil_id, nombre_foto)
+        return
+    future = _obtener_pool().submit(
+        generar_variantes, default_storage.path(nombre_foto), str(settings.MEDIA_ROOT), settings.FOTO_PERFIL_MAX_LADO
+    )
+    future.add_done_callback(partial(_al_terminar, perfil_id, nombre_foto))
+
+
+def programar_procesamiento_foto(perfil):
+    """Marca la foto como pendiente y la envía al pool de procesos cuando se confirme la transacción."""
+    from .models import PerfilUsuario
+
+    if not perfil.foto_perfil:
+        return
+    perfil.variantes_foto, perfil.estado_foto = {}, 'Pendiente'
+    PerfilUsuario.objects.filter(pk=perfil.pk).update(variantes_foto={}, estado_foto='Pendiente')
+    transaction.on_commit(partial(_enviar_a_procesar, perfil.pk, perfil.foto_perfil.name))
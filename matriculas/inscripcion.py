@@ -0,0 +1,205 @@
+"""
+Alta de estudiante y matrícula con su PaymentIntent (CrearEstudianteAPIView y su variante ASGI).
+
+Un cliente que reintenta tras un tiempo agotado no crea filas ni PaymentIntents de más:
+
+- Con la cabecera ``Idempotency-Key`` la respuesta se guarda (ClaveIdempotencia) y un
+  reintento dentro de IDEMPOTENCIA_VENTANA la recibe sin volver a procesar ni llamar a
+  Stripe. La misma clave con otro cuerpo es un 422, y mientras la primera petición sigue
+  en curso, un 409.
+- Estudiante y Matricula se crean en una sola transacción. El PaymentIntent se pide
+  después, fuera de ella, para no retener bloqueos durante la llamada a Stripe.
+- Si el usuario ya tiene una matrícula pendiente se reutiliza su pago abierto. Si quedó
+  sin PaymentIntent (falló Stripe, o el Pago se creó sin intent, como hacía
+  import_enrollments), el intent se pide con una clave de idempotencia de Stripe por
+  matrícula, así que Stripe devuelve el mismo aunque la llamada anterior sí llegara.
+"""
+import hashlib
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .estado_estudiante import ESTADOS_PAGO_PENDIENTE, invalidar_estado_por_matriculas
+from .models import ClaveIdempotencia, Estudiante, Matricula, Pago
+
+# Una reserva sin respuesta más antigua que esto se da por abandonada (proceso caído)
+EN_CURSO_MAX = timedelta(minutes=2)
+
+
+def huella_peticion(data):
+    """SHA-256 del cuerpo; de los archivos se usa el nombre y el tamaño."""
+    huella = hashlib.sha256()
+    for campo in sorted(data):
+        valores = data.getlist(campo) if hasattr(data, 'getlist') else [data[campo]]
+        for valor in valores:
+            if hasattr(valor, 'size'):
+                valor = f'{valor.name}:{valor.size}'
+            huella.update(f'{campo}={valor}\n'.encode())
+    return huella.hexdigest()
+
+
+def reservar_clave(usuario_id, clave, huella):
+    """
+    Reserva la clave para esta petición. Devuelve ``(reserva, None)`` si hay que procesarla
+    o ``(None, (codigo, cuerpo))`` con la respuesta a devolver sin procesarla.
+    """
+    if len(clave) > ClaveIdempotencia._meta.get_field('clave').max_length:
+        return None, (400, {"error": "Idempotency-Key demasiado larga."})
+
+    try:
+        with transaction.atomic():
+            return ClaveIdempotencia.objects.create(usuario_id=usuario_id, clave=clave, huella=huella), None
+    except IntegrityError:
+        pass
+
+    ahora = timezone.now()
+    with transaction.atomic():
+        registro = ClaveIdempotencia.objects.select_for_update().get(usuario_id=usuario_id, clave=clave)
+        vencida = registro.creado_en < ahora - timedelta(seconds=settings.IDEMPOTENCIA_VENTANA)
+        abandonada = registro.codigo_estado is None and registro.creado_en < ahora - EN_CURSO_MAX
+        if vencida or abandonada:
+            registro.huella = huella
+            registro.codigo_estado = None
+            registro.respuesta = None
+            registro.creado_en = ahora
+            registro.save()
+            return registro, None
+
+    if registro.huella != huella:
+        return None, (422, {"error": "La Idempotency-Key ya se usó con otros datos."})
+    if registro.codigo_estado is None:
+        return None, (409, {"error": "Hay una petición con esta Idempotency-Key en curso."})
+    return None, (registro.codigo_estado, registro.respuesta)
+
+
+def guardar_respuesta(reserva, codigo, cuerpo):
+    # Los errores del servidor no se guardan: el reintento debe volver a intentarlo
+    if codigo >= 500:
+        liberar_clave(reserva)
+        return
+    reserva.codigo_estado = codigo
+    reserva.respuesta = cuerpo
+    reserva.save(update_fields=['codigo_estado', 'respuesta'])
+
+
+def liberar_clave(reserva):
+    ClaveIdempotencia.objects.filter(pk=reserva.pk, codigo_estado__isnull=True).delete()
+
+
+def con_idempotencia(request, procesar):
+    """Ejecuta ``procesar()`` -> (codigo, cuerpo) respetando la cabecera Idempotency-Key."""
+    clave = request.headers.get('Idempotency-Key')
+    if not clave:
+        return procesar()
+
+    reserva, guardada = reservar_clave(request.user.id, clave, huella_peticion(request.data))
+    if guardada is not None:
+        return guardada
+    try:
+        codigo, cuerpo = procesar()
+    except BaseException:
+        liberar_clave(reserva)
+        raise
+    guardar_respuesta(reserva, codigo, cuerpo)
+    return codigo, cuerpo
+
+
+async def con_idempotencia_async(request, data, procesar):
+    """Versión asíncrona de con_idempotencia; ``procesar`` es una corrutina."""
+    clave = request.headers.get('Idempotency-Key')
+    if not clave:
+        return await procesar()
+
+    reserva, guardada = await sync_to_async(reservar_clave)(request.user.id, clave, huella_peticion(data))
+    if guardada is not None:
+        return guardada
+    try:
+        codigo, cuerpo = await procesar()
+    except BaseException:
+        await sync_to_async(liberar_clave)(reserva)
+        raise
+    await sync_to_async(guardar_respuesta)(reserva, codigo, cuerpo)
+    return codigo, cuerpo
+
+
+def _inscripcion_existente(usuario_id):
+    """
+    None si el usuario no tiene estudiante; si lo tiene, ``(matricula, pago)`` de su
+    matrícula pendiente (``pago`` es None si no tiene pago, y puede no tener
+    stripe_payment_intent_id), o ``(None, None)``.
+    """
+    matricula = Matricula.objects.filter(
+        estudiante__usuario_id=usuario_id, estado='Pendiente'
+    ).order_by('-id').first()
+    if matricula is None:
+        return (None, None) if Estudiante.objects.filter(usuario_id=usuario_id).exists() else None
+
+    pago = Pago.objects.filter(
+        matricula=matricula, estado__in=ESTADOS_PAGO_PENDIENTE
+    ).only('stripe_payment_intent_id', 'client_secret').order_by('-id').first()
+    return matricula, pago
+
+
+def preparar_inscripcion(serializer, usuario):
+    """
+    Crea (o recupera) la matrícula a pagar. Devuelve ``(matricula, pago, error)``: si
+    falta_intent(pago) hay que pedir el PaymentIntent; ``error`` es un (codigo, cuerpo).
+    """
+    existente = _inscripcion_existente(usuario.id)
+    if existente is None:
+        if not serializer.is_valid():
+            return None, None, (400, serializer.errors)
+        try:
+            with transaction.atomic():
+                estudiante = serializer.save(usuario=usuario)
+                matricula = Matricula.objects.create(estudiante=estudiante, curso="Curso Ejemplo", monto=100.00)
+            return matricula, None, None
+        except IntegrityError:
+            # Otra petición del mismo usuario creó el estudiante a la vez
+            existente = _inscripcion_existente(usuario.id)
+
+    matricula, pago = existente
+    if matricula is None:
+        return None, None, (400, {"error": "El usuario ya tiene una matrícula registrada."})
+    return matricula, pago, None
+
+
+def parametros_intent(matricula):
+    return {
+        'amount': int(matricula.monto * 100),
+        'currency': 'usd',
+        'metadata': {'matricula_id': matricula.id},
+        'idempotency_key': f'matricula-{matricula.id}-intent',
+    }
+
+
+def falta_intent(pago):
+    return pago is None or not pago.stripe_payment_intent_id
+
+
+def guardar_pago(matricula, intent, pago=None):
+    """Guarda el intent en ``pago`` si lo tenía pendiente o, si no hay pago, en uno nuevo."""
+    if pago is not None:
+        asignado = Pago.objects.filter(
+            Q(stripe_payment_intent_id__isnull=True) | Q(stripe_payment_intent_id=''), pk=pago.pk
+        ).update(stripe_payment_intent_id=intent['id'], client_secret=intent['client_secret'])
+        if asignado:
+            # update() no pasa por las señales que invalidan el estado cacheado
+            invalidar_estado_por_matriculas([matricula.id])
+            pago.stripe_payment_intent_id = intent['id']
+            pago.client_secret = intent['client_secret']
+            return pago
+    # Dos peticiones concurrentes para la misma matrícula reciben el mismo intent de Stripe
+    pago, _ = Pago.objects.get_or_create(
+        stripe_payment_intent_id=intent['id'],
+        defaults={'matricula': matricula, 'client_secret': intent['client_secret']},
+    )
+    return pago
+
+
+def respuesta_pago(pago, client_secret):
+    return {'client_secret': client_secret, 'payment_intent_id': pago.stripe_payment_intent_id}
@@ -0,0 +1,41 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from matriculas.notificaciones import enviar_pendientes, metricas_outbox
+
+
+class Command(BaseCommand):
+    help = 'Envía los correos pendientes de la tabla NotificacionEmail en lotes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=100)
+        parser.add_argument('--max-intentos', type=int, default=5)
+        parser.add_argument('--continuo', action='store_true', help='Sigue esperando nuevos correos.')
+        parser.add_argument('--intervalo', type=float, default=5.0, help='Segundos de espera con la cola vacía.')
+
+    def handle(self, *args, **options):
+        while True:
+            resultado = enviar_pendientes(options['lote'], options['max_intentos'])
+            procesados = resultado['enviados'] + resultado['reintentos'] + resultado['fallidos']
+            if procesados:
+                self._reportar(resultado)
+            elif not options['continuo']:
+                break
+            else:
+                time.sleep(options['intervalo'])
+
+        metricas = metricas_outbox()
+        self.stdout.write(
+            f"Cola: {metricas['pendientes']} pendientes, {metricas['fallidos']} fallidos, "
+            f"más antiguo {metricas['antiguedad_max_s']:.0f}s, entrega media {metricas['entrega_media_s']:.1f}s"
+        )
+
+    def _reportar(self, resultado):
+        latencias = resultado['latencias_ms']
+        media = statistics.mean(latencias) if latencias else 0
+        self.stdout.write(
+            f"Enviados: {resultado['enviados']}, reintentos: {resultado['reintentos']}, "
+            f"fallidos: {resultado['fallidos']}, latencia media de envío: {media:.1f} ms"
+        )
@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from matriculas.subidas import expirar_subidas
+
+
+class Command(BaseCommand):
+    help = 'Expira las subidas de certificados abandonadas y borra sus archivos parciales.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horas', type=float, default=settings.SUBIDA_EXPIRACION_HORAS,
+                            help='Horas sin actividad tras las que una subida se considera abandonada.')
+
+    def handle(self, *args, **options):
+        expiradas = expirar_subidas(timezone.now() - timedelta(hours=options['horas']))
+        self.stdout.write(f'Subidas expiradas: {expiradas}')
@@ -0,0 +1,191 @@
+import csv
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, transaction
+
+from matriculas.models import Estudiante, Matricula, PerfilUsuario, normalizar_busqueda
+from matriculas.resumen import MATRICULA, ajustar_resumen, transicion
+
+COLUMNAS_OBLIGATORIAS = ('username', 'email', 'password', 'nombre', 'dni', 'fecha_nacimiento', 'grado', 'direccion')
+# Cada columna se valida con los validadores de su campo (longitud, formato del username
+# y del email, dígitos del monto...) para rechazar la fila antes de insertarla
+CAMPOS_MODELO = {
+    'username': User._meta.get_field('username'),
+    'email': User._meta.get_field('email'),
+    'nombre': Estudiante._meta.get_field('nombre'),
+    'dni': Estudiante._meta.get_field('dni'),
+    'grado': Estudiante._meta.get_field('grado'),
+    'direccion': Estudiante._meta.get_field('direccion'),
+    'curso': Matricula._meta.get_field('curso'),
+    'monto': Matricula._meta.get_field('monto'),
+}
+
+
+def _inicializar_worker():
+    # Con el método de arranque 'spawn' los procesos del pool no heredan Django configurado
+    django.setup()
+
+
+def leer_filas(ruta):
+    """Devuelve un iterador de diccionarios por fila sin cargar el archivo completo."""
+    if ruta.lower().endswith('.xlsx'):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise CommandError('Para importar archivos .xlsx instale openpyxl.')
+        libro = load_workbook(ruta, read_only=True)
+        filas = libro.active.iter_rows(values_only=True)
+        cabecera = [str(c).strip() for c in next(filas)]
+        for fila in filas:
+            yield dict(zip(cabecera, ('' if v is None else v for v in fila)))
+        libro.close()
+    else:
+        with open(ruta, newline='', encoding='utf-8-sig') as archivo:
+            yield from csv.DictReader(archivo)
+
+
+def validar_fila(fila):
+    """Normaliza la fila y devuelve (datos, None) o (None, motivo del rechazo)."""
+    datos = {clave: str(fila.get(clave) or '').strip() for clave in COLUMNAS_OBLIGATORIAS}
+    faltantes = [clave for clave, valor in datos.items() if not valor]
+    if faltantes:
+        return None, f"Faltan columnas: {', '.join(faltantes)}"
+    fecha = fila['fecha_nacimiento']
+    try:
+        datos['fecha_nacimiento'] = fecha if isinstance(fecha, date) else date.fromisoformat(datos['fecha_nacimiento'][:10])
+    except ValueError:
+        return None, 'fecha_nacimiento no válida (use AAAA-MM-DD)'
+    datos['curso'] = str(fila.get('curso') or 'Curso Ejemplo').strip()
+    try:
+        datos['monto'] = Decimal(str(fila.get('monto') or '100.00').strip())
+    except InvalidOperation:
+        return None, 'monto no válido'
+    for clave, campo in CAMPOS_MODELO.items():
+        try:
+            campo.clean(datos[clave], None)
+        except ValidationError as e:
+            return None, f"{clave}: {' '.join(e.messages)}"
+    return datos, None
+
+
+class Command(BaseCommand):
+    help = 'Importa estudiantes con su usuario y matrícula desde un CSV o XLSX (el pago se crea al pagar).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo')
+        parser.add_argument('--lote', type=int, default=1000, help='Filas por transacción.')
+        parser.add_argument('--procesos', type=int, default=None, help='Procesos para el hash de contraseñas.')
+        parser.add_argument('--rechazados', help='CSV donde guardar las filas rechazadas y el motivo.')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        importadas = 0
+        rechazadas = []
+
+        with ProcessPoolExecutor(max_workers=options['procesos'], initializer=_inicializar_worker) as pool:
+            filas = enumerate(leer_filas(options['archivo']), start=2)
+            while True:
+                lote = list(itertools.islice(filas, options['lote']))
+                if not lote:
+                    break
+                validas = self._validar_lote(lote, rechazadas)
+                if validas:
+                    hashes = pool.map(make_password, [d['password'] for _, d in validas], chunksize=50)
+                    for (_, datos), password in zip(validas, hashes):
+                        datos['password'] = password
+                    importadas += self._crear(validas, rechazadas)
+
+                transcurrido = time.perf_counter() - inicio
+                self.stdout.write(f'{importadas} importadas ({importadas / transcurrido:.0f} filas/s), '
+                                  f'{len(rechazadas)} rechazadas')
+
+        if options['rechazados'] and rechazadas:
+            with open(options['rechazados'], 'w', newline='', encoding='utf-8') as archivo:
+                writer = csv.writer(archivo)
+                writer.writerow(['fila', 'username', 'motivo'])
+                writer.writerows(rechazadas)
+
+        transcurrido = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'Importación terminada: {importadas} estudiantes en {transcurrido:.1f}s '
+            f'({importadas / max(transcurrido, 1e-9):.0f} filas/s), {len(rechazadas)} filas rechazadas.'
+        ))
+        for numero, username, motivo in rechazadas[:20]:
+            self.stdout.write(f'  fila {numero} ({username}): {motivo}')
+
+    def _validar_lote(self, lote, rechazadas):
+        validas = []
+        vistos = set()
+        for numero, fila in lote:
+            datos, motivo = validar_fila(fila)
+            if datos and datos['username'] in vistos:
+                datos, motivo = None, 'username repetido en el archivo'
+            if datos is None:
+                rechazadas.append((numero, fila.get('username', ''), motivo))
+                continue
+            vistos.add(datos['username'])
+            validas.append((numero, datos))
+
+        existentes = set(User.objects.filter(username__in=vistos).values_list('username', flat=True))
+        for numero, datos in [v for v in validas if v[1]['username'] in existentes]:
+            rechazadas.append((numero, datos['username'], 'el username ya existe'))
+        return [v for v in validas if v[1]['username'] not in existentes]
+
+    def _crear(self, validas, rechazadas):
+        """
+        Crea el lote en una transacción. Si la base de datos lo rechaza, se repite fila a
+        fila para importar las demás e informar de las que fallan. Devuelve las creadas.
+        """
+        try:
+            self._crear_lote([datos for _, datos in validas])
+            return len(validas)
+        except DatabaseError:
+            creadas = 0
+            for numero, datos in validas:
+                try:
+                    self._crear_lote([datos])
+                    creadas += 1
+                except DatabaseError as e:
+                    rechazadas.append((numero, datos['username'], f'error de base de datos: {e}'))
+            return creadas
+
+    @transaction.atomic
+    def _crear_lote(self, filas):
+        # Los ids se vuelven a consultar porque no todos los motores los devuelven en bulk_create
+        User.objects.bulk_create([
+            User(username=d['username'], email=d['email'], password=d['password']) for d in filas
+        ])
+        usuarios = dict(User.objects.filter(username__in=[d['username'] for d in filas]).values_list('username', 'id'))
+
+        PerfilUsuario.objects.bulk_create([PerfilUsuario(usuario_id=usuarios[d['username']]) for d in filas])
+        Estudiante.objects.bulk_create([
+            Estudiante(
+                usuario_id=usuarios[d['username']], nombre=d['nombre'],
+                nombre_busqueda=normalizar_busqueda(d['nombre']), dni=d['dni'],
+                fecha_nacimiento=d['fecha_nacimiento'], grado=d['grado'], direccion=d['direccion']
+            )
+            for d in filas
+        ])
+        estudiantes = dict(
+            Estudiante.objects.filter(usuario_id__in=usuarios.values()).values_list('usuario_id', 'id')
+        )
+
+        Matricula.objects.bulk_create([
+            Matricula(estudiante_id=estudiantes[usuarios[d['username']]], curso=d['curso'], monto=d['monto'])
+            for d in filas
+        ])
+        # Sin Pago: se crea con su PaymentIntent cuando el estudiante va a pagar
+        # (CrearEstudianteAPIView), no una fila sin intent que no se podría cobrar
+
+        # bulk_create no pasa por Matricula.save: el resumen se ajusta aquí
+        total = sum((d['monto'] for d in filas), Decimal(0))
+        ajustar_resumen(transicion(MATRICULA, None, 'Pendiente', total, cantidad=len(filas)))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from matriculas.models import EventoStripe
+from matriculas.pagos import procesar_evento
+
+
+class Command(BaseCommand):
+    help = 'Procesa los eventos de Stripe recibidos por el webhook que aún no se han aplicado.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limite', type=int, default=500)
+
+    def handle(self, *args, **options):
+        eventos = EventoStripe.objects.filter(procesado_en__isnull=True).order_by('id')[:options['limite']]
+        procesados = fallidos = 0
+        for evento in eventos:
+            if procesar_evento(evento):
+                procesados += 1
+            else:
+                fallidos += 1
+        self.stdout.write(f'Eventos procesados: {procesados}, con error: {fallidos}')
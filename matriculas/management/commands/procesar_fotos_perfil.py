@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from matriculas.imagenes import procesar_foto
+from matriculas.models import PerfilUsuario
+
+
+class Command(BaseCommand):
+    help = 'Genera las miniaturas de las fotos de perfil pendientes o con error (o de todas con --todas).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--todas', action='store_true')
+
+    def handle(self, *args, **options):
+        perfiles = PerfilUsuario.objects.exclude(foto_perfil='').exclude(foto_perfil__isnull=True)
+        if not options['todas']:
+            perfiles = perfiles.exclude(estado_foto='Lista')
+
+        procesados = fallidos = 0
+        for perfil_id, nombre_foto in perfiles.values_list('id', 'foto_perfil').iterator():
+            if procesar_foto(perfil_id, nombre_foto):
+                procesados += 1
+            else:
+                fallidos += 1
+        self.stdout.write(f'Fotos procesadas: {procesados}, con error: {fallidos}')
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from matriculas.conciliacion import MODOS, conciliar
+
+# Intent ids que se muestran como mucho por cada tipo de desviación
+MOSTRAR = 20
+
+
+class Command(BaseCommand):
+    help = 'Concilia los pagos pendientes con sus PaymentIntents de Stripe y corrige los que ya terminaron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modo', choices=MODOS, default='listar',
+                            help='listar: recorre la lista de Stripe; consultar: un retrieve por pago en paralelo.')
+        parser.add_argument('--hilos', type=int, default=16, help='Llamadas simultáneas a Stripe con --modo consultar.')
+        parser.add_argument('--simular', action='store_true', help='Informa de las desviaciones sin corregirlas.')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        informe = conciliar(options['modo'], options['hilos'], options['simular'])
+        segundos = time.perf_counter() - inicio
+
+        prefijo = 'Se corregirían' if options['simular'] else 'Corregidos'
+        self.stdout.write(
+            f"Pagos pendientes revisados: {informe['revisados']} con {informe['llamadas_stripe']} llamadas "
+            f"a Stripe en {segundos:.1f}s"
+        )
+        self.stdout.write(
+            f"{prefijo}: {informe['Completado']} a Completado, {informe['Fallido']} a Fallido; "
+            f"sin cambios: {informe['sin_cambios']}, cambiados mientras tanto: {informe['conflictos']}"
+        )
+        for clave, descripcion in (('no_encontrados', 'No encontrados en Stripe'),
+                                   ('montos_distintos', 'Con importe distinto al de la matrícula')):
+            intent_ids = informe[clave]
+            if intent_ids:
+                resto = f' y {len(intent_ids) - MOSTRAR} más' if len(intent_ids) > MOSTRAR else ''
+                self.stdout.write(f"{descripcion}: {len(intent_ids)} ({', '.join(intent_ids[:MOSTRAR])}{resto})")
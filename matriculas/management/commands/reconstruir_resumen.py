@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from matriculas.resumen import reconstruir_resumen
+
+
+class Command(BaseCommand):
+    help = 'Recalcula la tabla de resumen del panel de administración e informa de las desviaciones encontradas.'
+
+    def handle(self, *args, **options):
+        desviaciones = reconstruir_resumen()
+        for clave, ((cantidad, monto), (cantidad_real, monto_real)) in desviaciones.items():
+            self.stdout.write(f'{clave}: guardado {cantidad} / {monto}, real {cantidad_real} / {monto_real}')
+        self.stdout.write(f'Resumen reconstruido; claves desviadas: {len(desviaciones)}')
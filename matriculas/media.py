@@ -0,0 +1,118 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+
+from .models import Estudiante
+
+RANGO_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+TAMANO_BLOQUE = 64 * 1024
+
+# Prefijos de MEDIA_ROOT que puede ver cualquiera (se usan en etiquetas <img>)
+PREFIJOS_PUBLICOS = ('fotos_perfil/',)
+PREFIJO_CERTIFICADOS = 'certificados/'
+
+
+def puede_ver(user, ruta):
+    """Fotos de perfil: público. Certificados: su estudiante o staff. Resto: solo staff."""
+    if ruta.startswith(PREFIJOS_PUBLICOS):
+        return True
+    if not user or not user.is_authenticated:
+        return False
+    if user.is_staff:
+        return True
+    if ruta.startswith(PREFIJO_CERTIFICADOS):
+        return Estudiante.objects.filter(usuario=user, certificado_estudios=ruta).exists()
+    return False
+
+
+def calcular_etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def no_modificado(request, etag, mtime):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return if_none_match.strip() == '*' or etag in [e.strip() for e in if_none_match.split(',')]
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+def parsear_rango(request, etag, mtime, tamano):
+    """
+    Devuelve ``(inicio, fin)`` inclusivos para una cabecera Range de un solo tramo,
+    None si se debe enviar el archivo completo y ``False`` si el rango no es satisfacible.
+    """
+    cabecera = request.META.get('HTTP_RANGE')
+    if not cabecera:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != int(mtime):
+        return None
+
+    coincidencia = RANGO_RE.match(cabecera.strip())
+    if not coincidencia or coincidencia.groups() == ('', ''):
+        # Rangos múltiples o mal formados: se ignora la cabecera
+        return None
+    inicio, fin = coincidencia.groups()
+    if inicio == '':
+        inicio, fin = max(tamano - int(fin), 0), tamano - 1
+    else:
+        inicio, fin = int(inicio), min(int(fin), tamano - 1) if fin else tamano - 1
+    if inicio >= tamano or inicio > fin:
+        return False
+    return inicio, fin
+
+
+def _leer_tramo(ruta_absoluta, inicio, longitud):
+    with open(ruta_absoluta, 'rb') as archivo:
+        archivo.seek(inicio)
+        while longitud > 0:
+            bloque = archivo.read(min(TAMANO_BLOQUE, longitud))
+            if not bloque:
+                break
+            longitud -= len(bloque)
+            yield bloque
+
+
+def respuesta_archivo(request, ruta, ruta_absoluta):
+    """
+    Respuesta para un archivo de MEDIA_ROOT con ETag/Last-Modified (304), rangos de bytes
+    (206/416) y, si MEDIA_SENDFILE está configurado, delegando el envío al servidor web.
+    """
+    stat = os.stat(ruta_absoluta)
+    etag = calcular_etag(stat)
+    content_type = mimetypes.guess_type(ruta_absoluta)[0] or 'application/octet-stream'
+    cabeceras = {'ETag': etag, 'Last-Modified': http_date(stat.st_mtime), 'Accept-Ranges': 'bytes'}
+
+    if no_modificado(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+    elif settings.MEDIA_SENDFILE:
+        # El servidor web (Apache/nginx) envía el archivo y atiende los rangos
+        response = HttpResponse(content_type=content_type)
+        if settings.MEDIA_SENDFILE == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + ruta
+        else:
+            response['X-Sendfile'] = ruta_absoluta
+    else:
+        rango = parsear_rango(request, etag, stat.st_mtime, stat.st_size)
+        if rango is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+        elif rango:
+            inicio, fin = rango
+            response = StreamingHttpResponse(
+                _leer_tramo(ruta_absoluta, inicio, fin - inicio + 1), status=206, content_type=content_type
+            )
+            response['Content-Range'] = f'bytes {inicio}-{fin}/{stat.st_size}'
+            response['Content-Length'] = str(fin - inicio + 1)
+        else:
+            response = FileResponse(open(ruta_absoluta, 'rb'), content_type=content_type)
+
+    for nombre, valor in cabeceras.items():
+        response[nombre] = valor
+    response['Cache-Control'] = 'public, max-age=3600' if ruta.startswith(PREFIJOS_PUBLICOS) else 'private, no-cache'
+    return response
@@ -0,0 +1,265 @@
+"""
+Métricas de rendimiento por petición en formato de exposición de Prometheus.
+
+MetricasMiddleware abre una Medicion por petición; las consultas SQL (execute_wrapper
+instalado en cada conexión), las llamadas HTTP a Stripe (ClienteHTTPMedido) y la
+serialización (SerializacionMedida) se acumulan en ella a través de un ContextVar, que
+sync_to_async propaga también a los hilos de las vistas asíncronas.
+
+Los histogramas viven en memoria del proceso: con varios workers cada uno expone los
+suyos y Prometheus debe raspar cada worker por separado.
+"""
+import contextvars
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_CONSULTAS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+BUCKETS_LLAMADAS = (0, 1, 2, 5, 10)
+
+# Máximo de sentencias SQL guardadas por petición para el registro de peticiones lentas
+MAX_SQL_REGISTRADAS = 200
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatear(numero):
+    return '+Inf' if numero == float('inf') else repr(float(numero))
+
+
+class Histograma:
+    def __init__(self, nombre, ayuda, etiquetas, buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *valores_etiquetas):
+        with self._lock:
+            serie = self._series.get(valores_etiquetas)
+            if serie is None:
+                serie = self._series[valores_etiquetas] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += valor
+            serie[2] += 1
+
+    def muestras(self, *valores_etiquetas):
+        """Número de observaciones de una serie (0 si no existe)."""
+        serie = self._series.get(valores_etiquetas)
+        return serie[2] if serie else 0
+
+    def limpiar(self):
+        with self._lock:
+            self._series.clear()
+
+    def exponer(self):
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} histogram']
+        with self._lock:
+            series = sorted((clave, [list(s[0]), s[1], s[2]]) for clave, s in self._series.items())
+        for valores, (cuentas, suma, total) in series:
+            etiquetas = ','.join(f'{n}="{_escapar(v)}"' for n, v in zip(self.etiquetas, valores))
+            prefijo = f'{etiquetas},' if etiquetas else ''
+            acumulado = 0
+            for limite, cuenta in zip(self.buckets, cuentas):
+                acumulado += cuenta
+                lineas.append(f'{self.nombre}_bucket{{{prefijo}le="{_formatear(limite)}"}} {acumulado}')
+            sufijo = f'{{{etiquetas}}}' if etiquetas else ''
+            lineas.append(f'{self.nombre}_sum{sufijo} {suma!r}')
+            lineas.append(f'{self.nombre}_count{sufijo} {total}')
+        return '\n'.join(lineas)
+
+
+ETIQUETAS_PETICION = ('vista', 'metodo')
+
+PETICION_SEGUNDOS = Histograma(
+    'matriculas_peticion_segundos', 'Latencia total de la petición.', ETIQUETAS_PETICION
+)
+PETICION_CONSULTAS_DB = Histograma(
+    'matriculas_peticion_consultas_db', 'Consultas SQL por petición.', ETIQUETAS_PETICION, BUCKETS_CONSULTAS
+)
+PETICION_DB_SEGUNDOS = Histograma(
+    'matriculas_peticion_db_segundos', 'Tiempo en la base de datos por petición.', ETIQUETAS_PETICION
+)
+PETICION_LLAMADAS_STRIPE = Histograma(
+    'matriculas_peticion_llamadas_stripe', 'Llamadas a Stripe por petición.', ETIQUETAS_PETICION, BUCKETS_LLAMADAS
+)
+PETICION_STRIPE_SEGUNDOS = Histograma(
+    'matriculas_peticion_stripe_segundos', 'Tiempo esperando a Stripe por petición.', ETIQUETAS_PETICION
+)
+PETICION_SERIALIZACION_SEGUNDOS = Histograma(
+    'matriculas_peticion_serializacion_segundos', 'Tiempo en serializadores por petición.', ETIQUETAS_PETICION
+)
+STRIPE_LLAMADA_SEGUNDOS = Histograma(
+    'matriculas_stripe_llamada_segundos', 'Duración de cada llamada HTTP a Stripe.', ('operacion',)
+)
+
+HISTOGRAMAS = [
+    PETICION_SEGUNDOS, PETICION_CONSULTAS_DB, PETICION_DB_SEGUNDOS, PETICION_LLAMADAS_STRIPE,
+    PETICION_STRIPE_SEGUNDOS, PETICION_SERIALIZACION_SEGUNDOS, STRIPE_LLAMADA_SEGUNDOS,
+]
+
+
+def exponer_gauge(nombre, ayuda, valor):
+    return f'# HELP {nombre} {ayuda}\n# TYPE {nombre} gauge\n{nombre} {_formatear(valor)}'
+
+
+def exponer():
+    return '\n'.join(h.exponer() for h in HISTOGRAMAS) + '\n'
+
+
+class Medicion:
+    __slots__ = ('consultas', 'tiempo_db', 'llamadas_stripe', 'tiempo_stripe', 'serializacion',
+                 'sql', '_profundidad_serializacion')
+
+    def __init__(self, guardar_sql=False):
+        self.consultas = 0
+        self.tiempo_db = 0.0
+        self.llamadas_stripe = 0
+        self.tiempo_stripe = 0.0
+        self.serializacion = 0.0
+        self.sql = [] if guardar_sql else None
+        self._profundidad_serializacion = 0
+
+
+_medicion = contextvars.ContextVar('medicion', default=None)
+
+
+def iniciar_medicion(guardar_sql=False):
+    medicion = Medicion(guardar_sql)
+    return medicion, _medicion.set(medicion)
+
+
+def terminar_medicion(token):
+    _medicion.reset(token)
+
+
+def medicion_actual():
+    return _medicion.get()
+
+
+def registrar_consulta(execute, sql, params, many, context):
+    """execute_wrapper de las conexiones; sin medición en curso no hace nada."""
+    medicion = _medicion.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duracion = time.perf_counter() - inicio
+        medicion.consultas += 1
+        medicion.tiempo_db += duracion
+        if medicion.sql is not None and len(medicion.sql) < MAX_SQL_REGISTRADAS:
+            medicion.sql.append((round(duracion * 1000, 3), sql))
+
+
+def instrumentar_conexion(sender, connection, **kwargs):
+    """Receptor de connection_created."""
+    if registrar_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.append(registrar_consulta)
+
+
+# /v1/payment_intents/pi_123/capture -> /v1/payment_intents/:id/capture
+_ID_STRIPE = re.compile(r'/(?=[^/]*_)(?=[^/]*\d)\w+')
+
+
+def operacion_stripe(metodo, url):
+    ruta = re.sub(r'^https?://[^/]+', '', url).split('?', 1)[0]
+    return f'{metodo.upper()} {_ID_STRIPE.sub("/:id", ruta)}'
+
+
+@contextmanager
+def medir_stripe(metodo, url):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        STRIPE_LLAMADA_SEGUNDOS.observar(duracion, operacion_stripe(metodo, url))
+        medicion = _medicion.get()
+        if medicion is not None:
+            medicion.llamadas_stripe += 1
+            medicion.tiempo_stripe += duracion
+
+
+class ClienteHTTPMedido:
+    """Envuelve el cliente HTTP de stripe para cronometrar cada llamada."""
+
+    def __init__(self, cliente):
+        self._cliente = cliente
+
+    def __getattr__(self, nombre):
+        return getattr(self._cliente, nombre)
+
+    def request_with_retries(self, method, url, *args, **kwargs):
+        with medir_stripe(method, url):
+            return self._cliente.request_with_retries(method, url, *args, **kwargs)
+
+    def request_stream_with_retries(self, method, url, *args, **kwargs):
+        with medir_stripe(method, url):
+            return self._cliente.request_stream_with_retries(method, url, *args, **kwargs)
+
+    async def request_with_retries_async(self, method, url, *args, **kwargs):
+        with medir_stripe(method, url):
+            return await self._cliente.request_with_retries_async(method, url, *args, **kwargs)
+
+    async def request_stream_with_retries_async(self, method, url, *args, **kwargs):
+        with medir_stripe(method, url):
+            return await self._cliente.request_stream_with_retries_async(method, url, *args, **kwargs)
+
+
+@contextmanager
+def medir_serializacion():
+    """Suma a la medición el tiempo del bloque; los bloques anidados no se cuentan dos veces."""
+    medicion = _medicion.get()
+    if medicion is None or medicion._profundidad_serializacion:
+        yield
+        return
+
+    medicion._profundidad_serializacion += 1
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        medicion.serializacion += time.perf_counter() - inicio
+        medicion._profundidad_serializacion -= 1
+
+
+class SerializacionMedida:
+    """
+    Mixin para serializadores de DRF: suma a la medición el tiempo de to_representation.
+    Los serializadores anidados no se cuentan dos veces.
+    """
+
+    def to_representation(self, instance):
+        # Sin medir_serializacion() para no crear un generador por objeto serializado
+        medicion = _medicion.get()
+        if medicion is None or medicion._profundidad_serializacion:
+            return super().to_representation(instance)
+
+        medicion._profundidad_serializacion += 1
+        inicio = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            medicion.serializacion += time.perf_counter() - inicio
+            medicion._profundidad_serializacion -= 1
+
+
+def registrar_peticion(vista, metodo, duracion, medicion):
+    PETICION_SEGUNDOS.observar(duracion, vista, metodo)
+    PETICION_CONSULTAS_DB.observar(medicion.consultas, vista, metodo)
+    PETICION_DB_SEGUNDOS.observar(medicion.tiempo_db, vista, metodo)
+    PETICION_LLAMADAS_STRIPE.observar(medicion.llamadas_stripe, vista, metodo)
+    PETICION_STRIPE_SEGUNDOS.observar(medicion.tiempo_stripe, vista, metodo)
+    PETICION_SERIALIZACION_SEGUNDOS.observar(medicion.serializacion, vista, metodo)
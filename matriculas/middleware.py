@@ -0,0 +1,62 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .metricas import iniciar_medicion, registrar_peticion, terminar_medicion
+
+logger = logging.getLogger('matriculas.peticiones_lentas')
+
+
+class MetricasMiddleware:
+    """
+    Mide cada petición (latencia, consultas SQL, llamadas a Stripe y serialización) y la
+    registra por nombre de URL y método. Con PETICION_LENTA_MS > 0 las peticiones más
+    lentas se escriben en el logger ``matriculas.peticiones_lentas`` con el SQL emitido.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.umbral_lenta = settings.PETICION_LENTA_MS / 1000
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        medicion, token = iniciar_medicion(guardar_sql=self.umbral_lenta > 0)
+        inicio = time.perf_counter()
+        try:
+            return self.get_response(request)
+        finally:
+            self.registrar(request, time.perf_counter() - inicio, medicion)
+            terminar_medicion(token)
+
+    async def __acall__(self, request):
+        medicion, token = iniciar_medicion(guardar_sql=self.umbral_lenta > 0)
+        inicio = time.perf_counter()
+        try:
+            return await self.get_response(request)
+        finally:
+            self.registrar(request, time.perf_counter() - inicio, medicion)
+            terminar_medicion(token)
+
+    def registrar(self, request, duracion, medicion):
+        # Las rutas sin nombre se agrupan para no crear una serie por URL
+        match = request.resolver_match
+        vista = (match.view_name or match.route) if match else 'sin_ruta'
+        registrar_peticion(vista, request.method, duracion, medicion)
+
+        if self.umbral_lenta and duracion >= self.umbral_lenta:
+            logger.warning(
+                'Petición lenta %s %s (%s): %.1f ms, %d consultas (%.1f ms), %d llamadas a Stripe (%.1f ms), '
+                'serialización %.1f ms\n%s',
+                request.method, request.path, vista, duracion * 1000, medicion.consultas,
+                medicion.tiempo_db * 1000, medicion.llamadas_stripe, medicion.tiempo_stripe * 1000,
+                medicion.serializacion * 1000,
+                '\n'.join(f'  [{ms} ms] {sql}' for ms, sql in medicion.sql),
+            )
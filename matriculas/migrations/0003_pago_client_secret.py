@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 07:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matriculas', '0002_perfilusuario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pago',
+            name='client_secret',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
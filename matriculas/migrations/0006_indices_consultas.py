@@ -0,0 +1,63 @@
+# Generated by Django 5.1.3 on 2026-10-18 07:16
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def preparar_intent_unico(apps, schema_editor):
+    """
+    Deja ``stripe_payment_intent_id`` listo para el índice único: los vacíos pasan a NULL
+    (no repiten valor) y, si un mismo PaymentIntent está en varios pagos, la migración se
+    detiene con la lista, porque solo uno de ellos lo cobró y hay que decidir cuál a mano.
+    """
+    Pago = apps.get_model('matriculas', 'Pago')
+    Pago.objects.filter(stripe_payment_intent_id='').update(stripe_payment_intent_id=None)
+
+    repetidos = list(
+        Pago.objects.filter(stripe_payment_intent_id__isnull=False).values('stripe_payment_intent_id')
+        .annotate(cantidad=Count('id')).filter(cantidad__gt=1).order_by('stripe_payment_intent_id')
+        .values_list('stripe_payment_intent_id', flat=True)
+    )
+    if repetidos:
+        detalle = '; '.join(
+            f"{intent_id}: pagos {', '.join(str(pk) for pk in Pago.objects.filter(stripe_payment_intent_id=intent_id).order_by('id').values_list('id', flat=True))}"
+            for intent_id in repetidos[:20]
+        )
+        resto = f' y {len(repetidos) - 20} más' if len(repetidos) > 20 else ''
+        raise RuntimeError(
+            f'Hay {len(repetidos)} PaymentIntents en más de un pago ({detalle}{resto}). Deje el '
+            'intent solo en el pago que corresponde (los demás a NULL) y vuelva a migrar.'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matriculas', '0005_notificacionemail'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='estudiante',
+            name='dni',
+            field=models.CharField(db_index=True, max_length=8),
+        ),
+        migrations.RunPython(preparar_intent_unico, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='pago',
+            name='stripe_payment_intent_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='matricula',
+            index=models.Index(fields=['estudiante', 'estado'], name='matriculas__estudia_9c3d2c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='matricula',
+            index=models.Index(fields=['estado'], name='matriculas__estado_e1f32e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pago',
+            index=models.Index(fields=['matricula', 'estado'], name='matriculas__matricu_c4c089_idx'),
+        ),
+    ]
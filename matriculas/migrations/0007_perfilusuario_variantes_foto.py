@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-18 07:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matriculas', '0006_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perfilusuario',
+            name='estado_foto',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='perfilusuario',
+            name='variantes_foto',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.3 on 2026-10-18 07:50
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def normalizar_busqueda(texto):
+    """
+    Copia de matriculas.models.normalizar_busqueda tal como era al crear esta migración:
+    la migración no debe depender del código actual de los modelos.
+    """
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    sin_tildes = ''.join(c for c in descompuesto if not unicodedata.combining(c))
+    return ' '.join(sin_tildes.lower().split())
+
+
+def rellenar_nombre_busqueda(apps, schema_editor):
+    Estudiante = apps.get_model('matriculas', 'Estudiante')
+    ultimo_id = 0
+    while True:
+        lote = list(Estudiante.objects.filter(id__gt=ultimo_id).order_by('id').only('id', 'nombre')[:5000])
+        if not lote:
+            break
+        for estudiante in lote:
+            estudiante.nombre_busqueda = normalizar_busqueda(estudiante.nombre)
+        Estudiante.objects.bulk_update(lote, ['nombre_busqueda'])
+        ultimo_id = lote[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matriculas', '0008_subidas_certificados'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estudiante',
+            name='nombre_busqueda',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.RunPython(rellenar_nombre_busqueda, migrations.RunPython.noop),
+    ]
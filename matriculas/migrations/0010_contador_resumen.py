@@ -0,0 +1,45 @@
+# Generated by Django 5.1.3 on 2026-10-18 07:56
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def calcular_resumen_inicial(apps, schema_editor):
+    Matricula = apps.get_model('matriculas', 'Matricula')
+    Pago = apps.get_model('matriculas', 'Pago')
+    ContadorResumen = apps.get_model('matriculas', 'ContadorResumen')
+
+    contadores = [
+        ContadorResumen(clave=f"matricula:{fila['estado']}", cantidad=fila['cantidad'], monto=fila['total'] or 0)
+        for fila in Matricula.objects.values('estado').annotate(cantidad=Count('id'), total=Sum('monto')).order_by()
+    ] + [
+        ContadorResumen(clave=f"pago:{fila['estado']}", cantidad=fila['cantidad'], monto=fila['total'] or 0)
+        for fila in Pago.objects.values('estado').annotate(
+            cantidad=Count('id'), total=Sum('matricula__monto')
+        ).order_by()
+    ]
+    ContadorResumen.objects.bulk_create(contadores)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matriculas', '0009_estudiante_nombre_busqueda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorResumen',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=50)),
+                ('fragmento', models.PositiveSmallIntegerField(default=0)),
+                ('cantidad', models.BigIntegerField(default=0)),
+                ('monto', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('clave', 'fragmento'), name='contador_resumen_unico')],
+            },
+        ),
+        migrations.RunPython(calcular_resumen_inicial, migrations.RunPython.noop),
+    ]
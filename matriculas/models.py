@@ -1,38 +1,193 @@
-from django.db import models
+import unicodedata
+import uuid
+
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+class ArchivoCertificado(models.Model):
+    """Certificado guardado una sola vez por contenido (direccionado por su SHA-256)."""
+    sha256 = models.CharField(max_length=64, unique=True)
+    archivo = models.FileField(upload_to='certificados/sha256/')
+    tamano = models.BigIntegerField()
+    creado_en = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
+def normalizar_busqueda(texto):
+    """Minúsculas, sin tildes ni espacios repetidos: 'José  PÉREZ' -> 'jose perez'."""
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    sin_tildes = ''.join(c for c in descompuesto if not unicodedata.combining(c))
+    return ' '.join(sin_tildes.lower().split())
 
 class Estudiante(models.Model):
     usuario = models.OneToOneField(User, on_delete=models.CASCADE)
     nombre = models.CharField(max_length=100)
-    dni = models.CharField(max_length=8) 
+    # nombre normalizado para la búsqueda por prefijo; se recalcula en save()
+    # (bulk_create y update() deben rellenarlo con normalizar_busqueda)
+    nombre_busqueda = models.CharField(max_length=100, db_index=True, editable=False, default='')
+    dni = models.CharField(max_length=8, db_index=True)
     fecha_nacimiento = models.DateField()
     grado = models.CharField(max_length=50) 
     direccion = models.TextField()
     certificado_estudios = models.FileField(upload_to='certificados/', null=True, blank=True) 
+    certificado_archivo = models.ForeignKey(ArchivoCertificado, on_delete=models.SET_NULL, null=True, blank=True)
+
+    def save(self, *args, **kwargs):
+        self.nombre_busqueda = normalizar_busqueda(self.nombre)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'nombre' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'nombre_busqueda'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.nombre
 
+class MatriculaQuerySet(models.QuerySet):
+    def con_detalle(self):
+        """Carga estudiante y pagos en un número fijo de consultas para los listados."""
+        return self.select_related('estudiante').prefetch_related(
+            models.Prefetch('pago_set', queryset=Pago.objects.order_by('id'))
+        )
+
 class Matricula(models.Model):
     estudiante = models.ForeignKey(Estudiante, on_delete=models.CASCADE)
     curso = models.CharField(max_length=100)
     monto = models.DecimalField(max_digits=10, decimal_places=2, default=100.00)
     estado = models.CharField(max_length=20, default='Pendiente') 
 
+    objects = MatriculaQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['estudiante', 'estado']),
+            models.Index(fields=['estado']),
+        ]
+
+    def save(self, *args, **kwargs):
+        # El resumen del panel se ajusta en la misma transacción que el cambio (ver resumen.py)
+        from .resumen import ajustar_resumen, cambios_al_guardar_matricula
+
+        with transaction.atomic():
+            cambios = cambios_al_guardar_matricula(self, kwargs.get('update_fields'))
+            super().save(*args, **kwargs)
+            ajustar_resumen(cambios)
+
     def __str__(self):
         return self.curso  # Devuelve el nombre del curso
     
 class Pago(models.Model):
     matricula = models.ForeignKey(Matricula, on_delete=models.CASCADE)
-    stripe_payment_intent_id = models.CharField(max_length=255, blank=True, null=True)
+    stripe_payment_intent_id = models.CharField(max_length=255, blank=True, null=True, unique=True)
+    client_secret = models.CharField(max_length=255, blank=True, null=True)
     estado = models.CharField(max_length=20, default='Pendiente')
 
+    class Meta:
+        indexes = [models.Index(fields=['matricula', 'estado'])]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Se guarda el estado leído para detectar cambios al guardar (ver signals.py)
+        instance._estado_original = instance.__dict__.get('estado')
+        return instance
+
+    def save(self, *args, **kwargs):
+        from .resumen import ajustar_resumen, cambios_al_guardar_pago
+
+        with transaction.atomic():
+            cambios = cambios_al_guardar_pago(self, kwargs.get('update_fields'))
+            super().save(*args, **kwargs)
+            ajustar_resumen(cambios)
+
     def __str__(self):
         return f'Pago pendiente para {self.matricula.curso}'  # Devuelve una representación más legible
     
+class SubidaCertificado(models.Model):
+    """Subida por partes (reanudable) de un certificado; ``recibido`` es el offset confirmado."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE)
+    nombre = models.CharField(max_length=255)
+    tamano = models.BigIntegerField()
+    recibido = models.BigIntegerField(default=0)
+    estado = models.CharField(max_length=20, default='En curso')
+    archivo = models.ForeignKey(ArchivoCertificado, on_delete=models.SET_NULL, null=True, blank=True)
+    creado_en = models.DateTimeField(auto_now_add=True)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.nombre} ({self.recibido}/{self.tamano})'
+
+class EventoStripe(models.Model):
+    stripe_id = models.CharField(max_length=255, unique=True)
+    tipo = models.CharField(max_length=100)
+    payload = models.JSONField()
+    recibido_en = models.DateTimeField(auto_now_add=True)
+    procesado_en = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return f'{self.tipo} ({self.stripe_id})'
+
+class NotificacionEmail(models.Model):
+    """Correo pendiente de envío (outbox). Lo envía el comando enviar_notificaciones."""
+    destinatario = models.EmailField()
+    asunto = models.CharField(max_length=255)
+    mensaje = models.TextField()
+    estado = models.CharField(max_length=20, default='Pendiente')
+    intentos = models.PositiveIntegerField(default=0)
+    proximo_intento = models.DateTimeField(default=timezone.now)
+    ultimo_error = models.TextField(blank=True, default='')
+    creado_en = models.DateTimeField(auto_now_add=True)
+    enviado_en = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['estado', 'proximo_intento'])]
+
+    def __str__(self):
+        return f'{self.asunto} -> {self.destinatario}'
+
+class ClaveIdempotencia(models.Model):
+    """Respuesta guardada de una petición con cabecera Idempotency-Key (ver inscripcion.py)."""
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE)
+    clave = models.CharField(max_length=255)
+    # SHA-256 del cuerpo: la misma clave con otro cuerpo se rechaza
+    huella = models.CharField(max_length=64)
+    # Vacíos mientras la primera petición está en curso
+    codigo_estado = models.PositiveSmallIntegerField(null=True, blank=True)
+    respuesta = models.JSONField(null=True, blank=True)
+    creado_en = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['usuario', 'clave'], name='clave_idempotencia_unica')]
+
+    def __str__(self):
+        return f'{self.clave} ({self.codigo_estado or "en curso"})'
+
+class ContadorResumen(models.Model):
+    """
+    Contadores del panel de administración por ``clave`` ('matricula:Pagado', 'pago:Completado'...).
+    Cada clave se reparte en varios fragmentos para que las transacciones concurrentes no
+    esperen todas por la misma fila; el valor es la suma de sus fragmentos.
+    """
+    clave = models.CharField(max_length=50)
+    fragmento = models.PositiveSmallIntegerField(default=0)
+    cantidad = models.BigIntegerField(default=0)
+    monto = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['clave', 'fragmento'], name='contador_resumen_unico')]
+
+    def __str__(self):
+        return f'{self.clave}[{self.fragmento}]'
+
 class PerfilUsuario(models.Model):
     usuario = models.OneToOneField(User, on_delete=models.CASCADE, related_name="perfil")
     foto_perfil = models.ImageField(upload_to="fotos_perfil/", null=True, blank=True)
+    # Rutas de las miniaturas generadas en segundo plano (ver imagenes.py)
+    variantes_foto = models.JSONField(default=dict, blank=True)
+    estado_foto = models.CharField(max_length=20, blank=True, default='')
 
     def __str__(self):
         return f"Perfil de {self.usuario.username}"
\ No newline at end of file
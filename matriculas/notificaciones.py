@@ -0,0 +1,150 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import DatabaseError, transaction
+from django.db.models import Avg, Count, F, Min, Q
+from django.utils import timezone
+
+from .metricas import exponer_gauge
+from .models import NotificacionEmail
+
+logger = logging.getLogger(__name__)
+
+# Tiempo que un worker reserva los correos que está enviando para que otro no los tome
+RESERVA_ENVIO = timedelta(minutes=5)
+ESPERA_BASE_REINTENTO = timedelta(seconds=30)
+
+
+def construir_email_aprobacion(matricula):
+    """Construye (sin guardar) el correo que recibe el usuario cuando su matrícula es aprobada."""
+    user_email = matricula.estudiante.usuario.email
+    student_name = matricula.estudiante.usuario.get_full_name()
+
+    subject = "¡Tu matrícula ha sido aprobada!"
+    message = (
+        f"Hola {student_name},\n\n"
+        f"Te informamos que tu matrícula para el curso '{matricula.curso}' ha sido aprobada. "
+        "Si tienes alguna consulta, no dudes en contactarnos.\n\n"
+        "Saludos,\nEl equipo de gestión de matrículas."
+    )
+    return NotificacionEmail(destinatario=user_email, asunto=subject, mensaje=message)
+
+
+def encolar_email_aprobacion(matricula):
+    """Encola el correo de aprobación. Debe llamarse dentro de la transacción que cambia el estado."""
+    notificacion = construir_email_aprobacion(matricula)
+    notificacion.save()
+    return notificacion
+
+
+def _reservar_lote(tamano):
+    ahora = timezone.now()
+    with transaction.atomic():
+        lote = list(
+            NotificacionEmail.objects.select_for_update(skip_locked=True)
+            .filter(estado='Pendiente', proximo_intento__lte=ahora)
+            .order_by('proximo_intento', 'id')[:tamano]
+        )
+        if lote:
+            NotificacionEmail.objects.filter(id__in=[n.id for n in lote]).update(
+                proximo_intento=ahora + RESERVA_ENVIO
+            )
+    return lote
+
+
+def enviar_pendientes(tamano_lote=100, max_intentos=5):
+    """
+    Envía un lote de correos pendientes usando una única conexión SMTP.
+
+    Los envíos fallidos se reprograman con espera exponencial y pasan a 'Fallido'
+    tras ``max_intentos``. Devuelve un diccionario con el resultado y las latencias (ms).
+    """
+    resultado = {'enviados': 0, 'reintentos': 0, 'fallidos': 0, 'latencias_ms': []}
+    lote = _reservar_lote(tamano_lote)
+    if not lote:
+        return resultado
+
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        # No se pudo abrir la conexión: no se envió nada y se reprograma todo el lote
+        for notificacion in lote:
+            _registrar_fallo(notificacion, e, max_intentos, resultado)
+        return resultado
+
+    try:
+        for notificacion in lote:
+            inicio = time.perf_counter()
+            try:
+                EmailMessage(
+                    notificacion.asunto, notificacion.mensaje, settings.DEFAULT_FROM_EMAIL,
+                    [notificacion.destinatario], connection=connection
+                ).send()
+            except Exception as e:
+                error = e
+            else:
+                error = None
+                resultado['latencias_ms'].append((time.perf_counter() - inicio) * 1000)
+                resultado['enviados'] += 1
+
+            # Un error al guardar el resultado de un correo no afecta a los demás del lote;
+            # este queda reservado y se reintenta cuando caduque la reserva
+            try:
+                if error is None:
+                    NotificacionEmail.objects.filter(pk=notificacion.pk).update(
+                        estado='Enviado', enviado_en=timezone.now(), intentos=F('intentos') + 1, ultimo_error=''
+                    )
+                else:
+                    _registrar_fallo(notificacion, error, max_intentos, resultado)
+            except DatabaseError:
+                logger.exception('No se pudo guardar el resultado del correo %s', notificacion.pk)
+    finally:
+        connection.close()
+
+    return resultado
+
+
+def _registrar_fallo(notificacion, error, max_intentos, resultado):
+    intentos = notificacion.intentos + 1
+    logger.warning('Error al enviar el correo %s (intento %s): %s', notificacion.pk, intentos, error)
+    cambios = {'intentos': intentos, 'ultimo_error': str(error)}
+    if intentos >= max_intentos:
+        cambios['estado'] = 'Fallido'
+        resultado['fallidos'] += 1
+    else:
+        cambios['proximo_intento'] = timezone.now() + ESPERA_BASE_REINTENTO * (2 ** (intentos - 1))
+        resultado['reintentos'] += 1
+    NotificacionEmail.objects.filter(pk=notificacion.pk).update(**cambios)
+
+
+def metricas_outbox():
+    """Profundidad de la cola, antigüedad del correo pendiente más viejo y latencia media de entrega."""
+    ahora = timezone.now()
+    datos = NotificacionEmail.objects.aggregate(
+        pendientes=Count('id', filter=Q(estado='Pendiente')),
+        fallidos=Count('id', filter=Q(estado='Fallido')),
+        pendiente_mas_antiguo=Min('creado_en', filter=Q(estado='Pendiente')),
+        entrega_media=Avg(F('enviado_en') - F('creado_en'), filter=Q(estado='Enviado')),
+    )
+    mas_antiguo = datos.pop('pendiente_mas_antiguo')
+    entrega_media = datos.pop('entrega_media')
+    datos['antiguedad_max_s'] = (ahora - mas_antiguo).total_seconds() if mas_antiguo else 0
+    datos['entrega_media_s'] = entrega_media.total_seconds() if entrega_media else 0
+    return datos
+
+
+def exponer_metricas_outbox():
+    """metricas_outbox() como gauges de Prometheus para /metrics."""
+    datos = metricas_outbox()
+    return '\n'.join([
+        exponer_gauge('matriculas_outbox_pendientes', 'Correos pendientes de enviar.', datos['pendientes']),
+        exponer_gauge('matriculas_outbox_fallidos', 'Correos que agotaron los reintentos.', datos['fallidos']),
+        exponer_gauge('matriculas_outbox_antiguedad_max_segundos', 'Antigüedad del correo pendiente más viejo.',
+                      datos['antiguedad_max_s']),
+        exponer_gauge('matriculas_outbox_entrega_media_segundos', 'Tiempo medio desde que se encola hasta que se envía.',
+                      datos['entrega_media_s']),
+    ]) + '\n'
@@ -0,0 +1,31 @@
+from rest_framework.pagination import CursorPagination
+
+
+class MatriculaCursorPagination(CursorPagination):
+    """
+    Paginación por cursor (keyset) sobre el id de la matrícula.
+
+    Solo se activa cuando el cliente envía ``cursor`` o ``page_size``, de modo que
+    los clientes que esperan la lista completa siguen funcionando igual.
+    """
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class BusquedaCursorPagination(CursorPagination):
+    """
+    Paginación por cursor sobre la columna anotada ``orden`` de busqueda.buscar_matriculas.
+    El desempate por estudiante sigue el orden del propio índice (que incluye la clave primaria).
+    """
+    ordering = ('orden', 'estudiante_id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
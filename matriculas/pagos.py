@@ -0,0 +1,80 @@
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import EventoStripe, Matricula, Pago
+from .estado_estudiante import invalidar_estado_por_intent
+from .estados import TransicionNoPermitida, cambiar_estado
+from .stripe_client import invalidar_payment_intent
+
+EVENTOS_MANEJADOS = ('payment_intent.succeeded', 'payment_intent.payment_failed')
+
+
+def confirmar_pago(intent_id):
+    """
+    Marca el pago como Completado y su matrícula, si sigue Pendiente, como Pagado en una
+    sola transacción, con actualizaciones condicionales (ver estados.cambiar_estado).
+
+    Repetir la confirmación (reintentos de Stripe o del cliente) no vuelve a modificar las
+    filas, y una matrícula ya aprobada o rechazada no vuelve a 'Pagado'.
+    Devuelve True si esta llamada fue la que aplicó el cambio.
+    """
+    pago = Pago.objects.filter(stripe_payment_intent_id=intent_id).values_list('id', 'matricula_id').first()
+    aplicado = False
+    if pago:
+        pago_id, matricula_id = pago
+        with transaction.atomic():
+            aplicado = _transicion_sin_conflicto(Pago, pago_id, 'Completado')
+            if aplicado:
+                _transicion_sin_conflicto(Matricula, matricula_id, 'Pagado')
+    invalidar_payment_intent(intent_id)
+    invalidar_estado_por_intent(intent_id)
+    return aplicado
+
+
+def registrar_fallo_pago(intent_id):
+    """Marca el pago como Fallido si seguía Pendiente (un fallo tardío no deshace un cobro)."""
+    pago_id = Pago.objects.filter(stripe_payment_intent_id=intent_id).values_list('id', flat=True).first()
+    aplicado = bool(pago_id) and _transicion_sin_conflicto(Pago, pago_id, 'Fallido')
+    invalidar_payment_intent(intent_id)
+    invalidar_estado_por_intent(intent_id)
+    return aplicado
+
+
+def _transicion_sin_conflicto(modelo, pk, nuevo):
+    # Los eventos de Stripe llegan repetidos o desordenados: un estado que no admite el
+    # cambio no es un error, simplemente no se aplica
+    try:
+        return cambiar_estado(modelo, pk, nuevo) is not None
+    except TransicionNoPermitida:
+        return False
+
+
+def registrar_evento(event):
+    """Guarda el evento crudo de Stripe. Devuelve (evento, creado); los duplicados no se guardan."""
+    try:
+        with transaction.atomic():
+            evento = EventoStripe.objects.create(
+                stripe_id=event['id'], tipo=event['type'], payload=event
+            )
+        return evento, True
+    except IntegrityError:
+        return EventoStripe.objects.get(stripe_id=event['id']), False
+
+
+def procesar_evento(evento):
+    """Aplica un evento guardado. Si falla queda sin procesar para el comando procesar_eventos_stripe."""
+    try:
+        with transaction.atomic():
+            if evento.tipo in EVENTOS_MANEJADOS:
+                intent_id = evento.payload['data']['object']['id']
+                if evento.tipo == 'payment_intent.succeeded':
+                    confirmar_pago(intent_id)
+                else:
+                    registrar_fallo_pago(intent_id)
+            evento.procesado_en = timezone.now()
+            evento.error = ''
+            evento.save(update_fields=['procesado_en', 'error'])
+    except Exception as e:
+        EventoStripe.objects.filter(pk=evento.pk).update(error=str(e))
+        return False
+    return True
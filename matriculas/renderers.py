@@ -0,0 +1,41 @@
+import json
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional
+    orjson = None
+
+# Mismas opciones que JSONRenderer con la configuración por defecto de DRF
+_codificador = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+
+
+class JSONRapidoRenderer(JSONRenderer):
+    """
+    JSONRenderer con la misma salida byte a byte, pensado para listados grandes: con orjson
+    instalado codifica en un solo paso a bytes y, si no, reutiliza un codificador ya
+    construido. Los datos con tipos que no son JSON básicos (Decimal, fechas...), la
+    indentación pedida por el cliente o una configuración JSON distinta de la de por
+    defecto pasan al JSONRenderer de DRF. (A diferencia de DRF, orjson escribe NaN como
+    null; los listados en los que se usa no tienen números en coma flotante.)
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            data is None
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+            or not (api_settings.UNICODE_JSON and api_settings.COMPACT_JSON and api_settings.STRICT_JSON)
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            if orjson is not None:
+                contenido = orjson.dumps(data)
+                # Como DRF, se escapan los separadores de línea de JavaScript
+                return contenido.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+            texto = _codificador.encode(data)
+        except (TypeError, ValueError):
+            return super().render(data, accepted_media_type, renderer_context)
+        return texto.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
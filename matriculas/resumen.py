@@ -0,0 +1,225 @@
+"""
+Resumen de matrículas y pagos para el panel de administración (tabla ContadorResumen).
+
+Cada alta, baja o cambio de estado o de monto ajusta los contadores en la misma
+transacción que lo produce: Matricula.save/Pago.save, las actualizaciones por conjunto de
+pagos.py y estados.py, la importación masiva y los borrados (signals.py). Así el panel
+se sirve con una consulta sobre unas pocas filas. Si la tabla se desviara (cambios
+hechos a mano en la base de datos), el comando reconstruir_resumen la recalcula.
+"""
+import random
+import threading
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .estado_estudiante import ESTADOS_PAGO_PENDIENTE
+from .models import ContadorResumen, Matricula, Pago
+
+FRAGMENTOS = 8
+MATRICULA = 'matricula'
+PAGO = 'pago'
+
+
+def clave(tipo, estado):
+    return f'{tipo}:{estado}'
+
+
+def _decimal(monto):
+    if hasattr(monto, 'resolve_expression'):
+        return monto
+    return monto if isinstance(monto, Decimal) else Decimal(str(monto or 0))
+
+
+def transicion(tipo, anterior, nuevo, monto, cantidad=1, monto_nuevo=None):
+    """
+    Cambios (clave, cantidad, monto) de pasar ``cantidad`` filas del estado ``anterior`` al
+    ``nuevo``. ``anterior=None`` es un alta y ``nuevo=None`` una baja. ``monto`` puede ser
+    una expresión (una subconsulta) que se evalúa en el UPDATE de los contadores.
+    """
+    monto = _decimal(monto)
+    monto_nuevo = monto if monto_nuevo is None else _decimal(monto_nuevo)
+    cambios = []
+    if anterior is not None:
+        cambios.append((clave(tipo, anterior), -cantidad, -monto))
+    if nuevo is not None:
+        cambios.append((clave(tipo, nuevo), cantidad, monto_nuevo))
+    return cambios
+
+
+def ajustar_resumen(cambios):
+    """Aplica los cambios. Debe llamarse dentro de la transacción que hizo el cambio."""
+    agrupados = defaultdict(lambda: [0, Decimal(0)])
+    for nombre, cantidad, monto in cambios:
+        agrupados[nombre][0] += cantidad
+        agrupados[nombre][1] += _decimal(monto)
+
+    fragmento = random.randrange(FRAGMENTOS)
+    # Siempre en el mismo orden para que dos transacciones no se bloqueen mutuamente
+    for nombre in sorted(agrupados):
+        cantidad, monto = agrupados[nombre]
+        if not cantidad and not monto:
+            continue
+        filas = ContadorResumen.objects.filter(clave=nombre, fragmento=fragmento)
+        valores = {'cantidad': F('cantidad') + cantidad, 'monto': F('monto') + monto}
+        if not filas.update(**valores):
+            ContadorResumen.objects.bulk_create(
+                [ContadorResumen(clave=nombre, fragmento=fragmento)], ignore_conflicts=True
+            )
+            filas.update(**valores)
+
+
+def _se_guarda(instancia, campo, update_fields):
+    if campo in instancia.get_deferred_fields():
+        return False
+    return update_fields is None or campo in update_fields
+
+
+def cambios_al_guardar_matricula(matricula, update_fields=None):
+    """Compara con la fila bloqueada en la base de datos, no con lo que se leyó antes."""
+    if not (_se_guarda(matricula, 'estado', update_fields) or _se_guarda(matricula, 'monto', update_fields)):
+        return []
+
+    actual = None
+    if not matricula._state.adding:
+        actual = Matricula.objects.select_for_update().filter(pk=matricula.pk).values('estado', 'monto').first()
+    if actual is None:
+        return transicion(MATRICULA, None, matricula.estado, matricula.monto)
+
+    estado = matricula.estado if _se_guarda(matricula, 'estado', update_fields) else actual['estado']
+    monto = _decimal(matricula.monto if _se_guarda(matricula, 'monto', update_fields) else actual['monto'])
+    cambios = transicion(MATRICULA, actual['estado'], estado, actual['monto'], monto_nuevo=monto)
+
+    diferencia = monto - actual['monto']
+    if diferencia:
+        for estado_pago in Pago.objects.filter(matricula_id=matricula.pk).values_list('estado', flat=True):
+            cambios.append((clave(PAGO, estado_pago), 0, diferencia))
+    return cambios
+
+
+def _monto_de_matricula(matricula_id):
+    return Matricula.objects.filter(pk=matricula_id).values_list('monto', flat=True).first() or 0
+
+
+def cambios_al_guardar_pago(pago, update_fields=None):
+    if not (_se_guarda(pago, 'estado', update_fields) or _se_guarda(pago, 'matricula', update_fields)):
+        return []
+
+    actual = None
+    if not pago._state.adding:
+        actual = Pago.objects.select_for_update().filter(pk=pago.pk).values(
+            'estado', 'matricula_id', 'matricula__monto'
+        ).first()
+
+    if Pago.matricula.is_cached(pago) and pago.matricula is not None:
+        monto = pago.matricula.monto
+    else:
+        monto = _monto_de_matricula(pago.matricula_id)
+
+    if actual is None:
+        return transicion(PAGO, None, pago.estado, monto)
+    estado = pago.estado if _se_guarda(pago, 'estado', update_fields) else actual['estado']
+    if not _se_guarda(pago, 'matricula', update_fields):
+        monto = actual['matricula__monto']
+    return transicion(PAGO, actual['estado'], estado, actual['matricula__monto'], monto_nuevo=monto)
+
+
+# Borrados: el Collector de Django envía todos los pre_delete antes de borrar nada y los
+# post_delete dentro de su transacción. Se anotan en pre_delete y el primer post_delete los
+# aplica en un único ajuste, en lugar de una consulta por fila en los borrados en cascada.
+_borrados = threading.local()
+
+
+def _bloque_actual(using):
+    bloques = transaction.get_connection(using).atomic_blocks
+    return bloques[-1] if bloques else None
+
+
+def anotar_borrado(instancia, using):
+    pendientes = getattr(_borrados, 'pendientes', None)
+    bloque = _bloque_actual(using)
+    # Lo anotado en un borrado que falló antes de llegar a post_delete se descarta
+    if pendientes is None or pendientes[0] is not bloque:
+        pendientes = _borrados.pendientes = (bloque, [])
+    pendientes[1].append(instancia)
+
+
+def aplicar_borrados(using):
+    pendientes = getattr(_borrados, 'pendientes', None)
+    _borrados.pendientes = None
+    if pendientes is None or pendientes[0] is not _bloque_actual(using):
+        return
+
+    instancias = pendientes[1]
+    montos = {i.pk: i.monto for i in instancias if isinstance(i, Matricula)}
+    faltan = {i.matricula_id for i in instancias if isinstance(i, Pago)} - montos.keys()
+    if faltan:
+        montos.update(Matricula.objects.filter(pk__in=faltan).values_list('id', 'monto'))
+
+    cambios = []
+    for instancia in instancias:
+        if isinstance(instancia, Matricula):
+            cambios += transicion(MATRICULA, instancia.estado, None, instancia.monto)
+        else:
+            cambios += transicion(PAGO, instancia.estado, None, montos.get(instancia.matricula_id, 0))
+    ajustar_resumen(cambios)
+
+
+def totales_guardados():
+    """{clave: (cantidad, monto)} sumando los fragmentos, en una sola consulta."""
+    totales = defaultdict(lambda: [0, Decimal(0)])
+    for nombre, cantidad, monto in ContadorResumen.objects.values_list('clave', 'cantidad', 'monto'):
+        totales[nombre][0] += cantidad
+        totales[nombre][1] += monto
+    return {nombre: tuple(valores) for nombre, valores in totales.items() if any(valores)}
+
+
+def totales_reales():
+    """{clave: (cantidad, monto)} calculado sobre las tablas de matrículas y pagos."""
+    totales = {}
+    for fila in Matricula.objects.values('estado').annotate(cantidad=Count('id'), total=Sum('monto')).order_by():
+        totales[clave(MATRICULA, fila['estado'])] = (fila['cantidad'], fila['total'] or Decimal(0))
+    for fila in Pago.objects.values('estado').annotate(cantidad=Count('id'), total=Sum('matricula__monto')).order_by():
+        totales[clave(PAGO, fila['estado'])] = (fila['cantidad'], fila['total'] or Decimal(0))
+    return totales
+
+
+def reconstruir_resumen():
+    """Recalcula la tabla. Devuelve las claves desviadas: {clave: (guardado, real)}."""
+    with transaction.atomic():
+        guardados = totales_guardados()
+        reales = totales_reales()
+        ContadorResumen.objects.all().delete()
+        ContadorResumen.objects.bulk_create([
+            ContadorResumen(clave=nombre, fragmento=0, cantidad=cantidad, monto=monto)
+            for nombre, (cantidad, monto) in reales.items()
+        ])
+
+    vacio = (0, Decimal(0))
+    return {
+        nombre: (guardados.get(nombre, vacio), reales.get(nombre, vacio))
+        for nombre in sorted(set(guardados) | set(reales))
+        if guardados.get(nombre, vacio) != reales.get(nombre, vacio)
+    }
+
+
+def obtener_resumen():
+    """Datos del panel de administración."""
+    matriculas = {}
+    pagos = {}
+    for nombre, valores in totales_guardados().items():
+        tipo, estado = nombre.split(':', 1)
+        (matriculas if tipo == MATRICULA else pagos)[estado] = valores
+
+    total_pagos = sum(cantidad for cantidad, _ in pagos.values())
+    completados, monto_pagado = pagos.get('Completado', (0, Decimal(0)))
+    return {
+        'matriculas_por_estado': {estado: cantidad for estado, (cantidad, _) in sorted(matriculas.items())},
+        'total_matriculas': sum(cantidad for cantidad, _ in matriculas.values()),
+        'pagos_por_estado': {estado: cantidad for estado, (cantidad, _) in sorted(pagos.items())},
+        'monto_pagado': monto_pagado,
+        'monto_pendiente': sum((pagos.get(e, (0, Decimal(0)))[1] for e in ESTADOS_PAGO_PENDIENTE), Decimal(0)),
+        'tasa_conversion': round(completados / total_pagos, 4) if total_pagos else 0.0,
+    }
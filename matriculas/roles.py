@@ -0,0 +1,55 @@
+"""
+Rol y datos de perfil del usuario firmados como claims en los JWT.
+
+El frontend puede leer ``rol``, ``username`` y ``avatar`` del access token en lugar de
+llamar a /role/ y /perfil/ en cada navegación. Los claims se recalculan al obtener y al
+refrescar el token, así que un cambio de rol o de foto tarda como máximo la vida del
+access token en reflejarse. Los permisos y /role/ usan request.user, que
+CachedJWTAuthentication ya sirve sin consultas y se invalida al guardar el User.
+"""
+from django.core.files.storage import default_storage
+
+from .models import PerfilUsuario
+
+ROL_STAFF = 'is_staff'
+ROL_ADMIN = 'is_admin'
+ROL_AUTENTICADO = 'authenticated'
+
+
+def rol_de_usuario(user):
+    if user.is_staff:
+        return ROL_STAFF
+    if user.is_superuser:
+        return ROL_ADMIN
+    return ROL_AUTENTICADO
+
+
+def url_avatar(perfil):
+    """Miniatura de la foto de perfil si ya está generada; si no, la foto original."""
+    if perfil is None:
+        return None
+    miniatura = (perfil.variantes_foto or {}).get('miniatura')
+    if miniatura:
+        return default_storage.url(miniatura)
+    return perfil.foto_perfil.url if perfil.foto_perfil else None
+
+
+def agregar_claims(token, user):
+    perfil = PerfilUsuario.objects.filter(usuario_id=user.pk).only('foto_perfil', 'variantes_foto').first()
+    token['username'] = user.get_username()
+    token['rol'] = rol_de_usuario(user)
+    token['is_staff'] = user.is_staff
+    token['is_superuser'] = user.is_superuser
+    token['avatar'] = url_avatar(perfil)
+    return token
+
+
+def rol_de_peticion(request):
+    """
+    Rol leído de los claims del token, sin consultas. Los tokens sin claims usan
+    request.user. Puede estar desactualizado hasta la vida del token: no sirve para permisos.
+    """
+    token = request.auth
+    rol = token.get('rol') if token is not None else None
+    return rol or rol_de_usuario(request.user)
+
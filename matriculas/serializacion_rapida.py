@@ -0,0 +1,151 @@
+"""
+Serialización de solo lectura para los listados grandes de matrículas.
+
+Da exactamente los mismos datos que MatriculaSerializer (mismas claves, en el mismo orden,
+y mismos valores), pero a partir de filas ``.values()`` y sin instanciar modelos ni
+recorrer los campos de DRF por cada objeto. Los conversores se obtienen una sola vez de
+los campos de los propios serializers, así que un campo nuevo en MatriculaSerializer,
+EstudianteSerializer o PagoSerializer aparece también aquí; los tipos que no se conocen
+usan el to_representation del campo.
+
+Como en DRF, las URL de los archivos son absolutas solo si se pasa la request.
+"""
+from functools import cache
+from operator import itemgetter
+
+from rest_framework import serializers
+
+from .metricas import medir_serializacion
+from .models import Pago
+from .serializers import MatriculaSerializer, PagoSerializer
+
+# Campos cuyo to_representation no cambia el valor leído de la base de datos
+CAMPOS_SIN_CONVERSION = (serializers.CharField, serializers.IntegerField, serializers.BooleanField)
+
+
+def _leer_con(columna, conversor):
+    def leer(fila):
+        valor = fila[columna]
+        return None if valor is None else conversor(valor)
+    return leer
+
+
+def _leer_archivo(columna, campo, modelo, request):
+    storage = modelo._meta.get_field(campo.source).storage
+    if not getattr(campo, 'use_url', True):
+        return lambda fila: fila[columna] or None
+
+    def leer(fila):
+        nombre = fila[columna]
+        if not nombre:
+            return None
+        url = storage.url(nombre)
+        return request.build_absolute_uri(url) if request is not None else url
+    return leer
+
+
+def _leer_anidado(columna, subserializador):
+    def leer(fila):
+        return None if fila[columna] is None else subserializador(fila)
+    return leer
+
+
+@cache
+def _campos_legibles(serializer_class):
+    # Instanciar los campos de DRF es lo caro: se hace una vez por serializer
+    return [(nombre, campo) for nombre, campo in serializer_class().fields.items() if not campo.write_only]
+
+
+class SerializadorRapido:
+    """
+    Versión compilada de un ModelSerializer: convierte las filas de
+    ``queryset.values(*columnas)`` en el dict que daría ``serializer.data`` con
+    ``context={'request': request}``.
+
+    Los SerializerMethodField no se pueden compilar; ``metodos`` da para cada uno una
+    función que recibe la fila.
+    """
+
+    def __init__(self, serializer_class, prefijo='', metodos=None, request=None):
+        metodos = metodos or {}
+        modelo = serializer_class.Meta.model
+        self.columnas = []
+        self._lectores = []
+
+        for nombre, campo in _campos_legibles(serializer_class):
+            if nombre in metodos:
+                self._lectores.append((nombre, metodos[nombre]))
+                continue
+
+            columna = f'{prefijo}{campo.source}'
+            self.columnas.append(columna)
+            if isinstance(campo, serializers.BaseSerializer):
+                anidado = SerializadorRapido(type(campo), f'{columna}__', request=request)
+                self.columnas += anidado.columnas
+                lector = _leer_anidado(columna, anidado)
+            elif isinstance(campo, serializers.FileField):
+                lector = _leer_archivo(columna, campo, modelo, request)
+            elif isinstance(campo, CAMPOS_SIN_CONVERSION) or (
+                isinstance(campo, serializers.PrimaryKeyRelatedField) and campo.pk_field is None
+            ):
+                lector = itemgetter(columna)
+            elif isinstance(campo, serializers.SerializerMethodField):
+                raise TypeError(f'{serializer_class.__name__}.{nombre}: falta su función en ``metodos``.')
+            else:
+                lector = _leer_con(columna, campo.to_representation)
+            self._lectores.append((nombre, lector))
+
+    def __call__(self, fila):
+        return {nombre: lector(fila) for nombre, lector in self._lectores}
+
+
+@cache
+def _serializador_pago():
+    # get_pago serializa el pago sin contexto
+    return SerializadorRapido(PagoSerializer)
+
+
+@cache
+def _columnas_matricula():
+    return _serializador_matricula().columnas
+
+
+def _serializador_matricula(request=None):
+    # El pago lo añade serializar_matriculas a cada fila, ya serializado
+    return SerializadorRapido(MatriculaSerializer, metodos={'pago': itemgetter('pago')}, request=request)
+
+
+def filas_matriculas(queryset):
+    """El queryset de Matricula como filas .values() para serializar_matriculas()."""
+    return queryset.values(*_columnas_matricula())
+
+
+def primeros_pagos(matricula_ids):
+    """{matricula_id: fila del pago} con el primer pago (por id) de cada matrícula."""
+    pagos = {}
+    if matricula_ids:
+        consulta = Pago.objects.filter(matricula_id__in=matricula_ids).order_by('id')
+        for fila in consulta.values(*_serializador_pago().columnas):
+            pagos.setdefault(fila['matricula'], fila)
+    return pagos
+
+
+def serializar_filas(filas, pagos, request=None):
+    serializar = _serializador_matricula(request)
+    serializar_pago = _serializador_pago()
+    with medir_serializacion():
+        resultado = []
+        for fila in filas:
+            pago = pagos.get(fila['id'])
+            fila['pago'] = serializar_pago(pago) if pago else None
+            resultado.append(serializar(fila))
+        return resultado
+
+
+def serializar_matriculas(filas, request=None):
+    """
+    Lo mismo que ``MatriculaSerializer(matriculas, many=True, context={'request': request}).data``
+    a partir de las filas de filas_matriculas(), con una consulta más para los pagos.
+    """
+    filas = list(filas)
+    return serializar_filas(filas, primeros_pagos([fila['id'] for fila in filas]), request)
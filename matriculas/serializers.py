@@ -1,8 +1,16 @@
 from rest_framework import serializers
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from django.core.files.storage import default_storage
 from django.contrib.auth.models import User
-from .models import Estudiante, Matricula, Pago, PerfilUsuario
+from .models import Estudiante, Matricula, Pago, PerfilUsuario, SubidaCertificado
+from .estados import ESTADOS_PREVIOS_VERIFICACION, FILTROS_VERIFICACION
+from .imagenes import programar_procesamiento_foto, validar_foto
+from .metricas import SerializacionMedida
+from .roles import agregar_claims
 
-class RegisterSerializer(serializers.ModelSerializer):
+class RegisterSerializer(SerializacionMedida, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     foto_perfil = serializers.ImageField(write_only=True, required=False)
 
@@ -10,24 +18,48 @@ class RegisterSerializer(serializers.ModelSerializer):
         model = User
         fields = ['username', 'email', 'password', 'foto_perfil', 'id']
 
+    def validate_foto_perfil(self, value):
+        error = validar_foto(value)
+        if error:
+            raise serializers.ValidationError(error)
+        return value
+
     def create(self, validated_data):
         foto_perfil = validated_data.pop('foto_perfil', None)
         user = User(username=validated_data['username'], email=validated_data['email'])
         user.set_password(validated_data['password'])
         user.save()
 
-        PerfilUsuario.objects.create(usuario=user, foto_perfil=foto_perfil)
+        perfil = PerfilUsuario.objects.create(usuario=user, foto_perfil=foto_perfil)
+        programar_procesamiento_foto(perfil)
         
         return user
 
-class EstudianteSerializer(serializers.ModelSerializer):
+class EstudianteSerializer(SerializacionMedida, serializers.ModelSerializer):
     usuario = serializers.PrimaryKeyRelatedField(read_only=True) 
+    # Id de una subida por partes ya finalizada (alternativa a enviar certificado_estudios)
+    certificado_subida = serializers.UUIDField(write_only=True, required=False)
 
     class Meta:
         model = Estudiante
-        fields = ['usuario', 'nombre', 'dni', 'fecha_nacimiento', 'grado', 'direccion', 'certificado_estudios']
+        fields = ['usuario', 'nombre', 'dni', 'fecha_nacimiento', 'grado', 'direccion', 'certificado_estudios', 'certificado_subida']
+
+    def validate_certificado_subida(self, value):
+        subida = SubidaCertificado.objects.filter(
+            id=value, usuario=self.context['request'].user, estado='Completada'
+        ).select_related('archivo').first()
+        if subida is None or subida.archivo is None:
+            raise serializers.ValidationError("La subida no existe o no está finalizada.")
+        return subida
+
+    def create(self, validated_data):
+        subida = validated_data.pop('certificado_subida', None)
+        if subida:
+            validated_data['certificado_archivo'] = subida.archivo
+            validated_data['certificado_estudios'] = subida.archivo.archivo.name
+        return super().create(validated_data)
 
-class MatriculaSerializer(serializers.ModelSerializer):
+class MatriculaSerializer(SerializacionMedida, serializers.ModelSerializer):
     estudiante = EstudianteSerializer(read_only=True)  
     pago = serializers.SerializerMethodField()  
 
@@ -36,22 +68,98 @@ class MatriculaSerializer(serializers.ModelSerializer):
         fields = ['id', 'curso', 'monto', 'estado', 'estudiante', 'pago']
 
     def get_pago(self, obj):
-        pago = Pago.objects.filter(matricula=obj).first()
+        # Usa los pagos precargados por Matricula.objects.con_detalle() para evitar una consulta por fila
+        pago = min(obj.pago_set.all(), key=lambda p: p.id, default=None)
         return PagoSerializer(pago).data if pago else None
 
-class PagoSerializer(serializers.ModelSerializer):
+class PagoSerializer(SerializacionMedida, serializers.ModelSerializer):
     class Meta:
         model = Pago
         fields = '__all__'
         
-class PerfilUsuarioSerializer(serializers.ModelSerializer):
+class PerfilUsuarioSerializer(SerializacionMedida, serializers.ModelSerializer):
+    variantes = serializers.SerializerMethodField()
+
     class Meta:
         model = PerfilUsuario
-        fields = ['foto_perfil']
+        fields = ['foto_perfil', 'variantes']
+
+    def validate_foto_perfil(self, value):
+        error = validar_foto(value)
+        if error:
+            raise serializers.ValidationError(error)
+        return value
+
+    def save(self, **kwargs):
+        perfil = super().save(**kwargs)
+        if self.validated_data.get('foto_perfil'):
+            programar_procesamiento_foto(perfil)
+        return perfil
+
+    def get_variantes(self, obj):
+        return {nombre: self._url(ruta) for nombre, ruta in (obj.variantes_foto or {}).items()}
+
+    def _url(self, ruta):
+        url = default_storage.url(ruta)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+class PerfilUsuarioResumenSerializer(PerfilUsuarioSerializer):
+    """Perfil para mostrar el avatar: ``foto_perfil`` es la miniatura cuando ya está generada."""
+    foto_perfil = serializers.SerializerMethodField()
+    foto_original = serializers.ImageField(source='foto_perfil', read_only=True)
+
+    class Meta(PerfilUsuarioSerializer.Meta):
+        fields = ['foto_perfil', 'foto_original', 'variantes']
 
-class UsuarioSerializer(serializers.ModelSerializer):
-    perfil = PerfilUsuarioSerializer(read_only=True)
+    def get_foto_perfil(self, obj):
+        miniatura = (obj.variantes_foto or {}).get('miniatura')
+        if miniatura:
+            return self._url(miniatura)
+        return self.fields['foto_original'].to_representation(obj.foto_perfil) if obj.foto_perfil else None
+
+class UsuarioSerializer(SerializacionMedida, serializers.ModelSerializer):
+    perfil = PerfilUsuarioResumenSerializer(read_only=True)
 
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'perfil']
\ No newline at end of file
+        fields = ['id', 'username', 'email', 'perfil']
+
+class SubidaCertificadoSerializer(SerializacionMedida, serializers.ModelSerializer):
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$', write_only=True, required=False)
+    certificado = serializers.FileField(source='archivo.archivo', read_only=True, default=None)
+
+    class Meta:
+        model = SubidaCertificado
+        fields = ['id', 'nombre', 'tamano', 'recibido', 'estado', 'sha256', 'certificado']
+        read_only_fields = ['recibido', 'estado']
+
+class VerificacionLoteSerializer(serializers.Serializer):
+    estado = serializers.ChoiceField(choices=list(ESTADOS_PREVIOS_VERIFICACION))
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    filtro = serializers.ChoiceField(choices=list(FILTROS_VERIFICACION), required=False)
+
+    def validate(self, data):
+        if ('ids' in data) == ('filtro' in data):
+            raise serializers.ValidationError("Debe indicar 'ids' o 'filtro', pero no ambos.")
+        return data
+
+class TokenConClaimsSerializer(TokenObtainPairSerializer):
+    """Incluye rol, username y avatar en los tokens (ver roles.py)."""
+
+    @classmethod
+    def get_token(cls, user):
+        return agregar_claims(super().get_token(user), user)
+
+class TokenRefreshConClaimsSerializer(TokenRefreshSerializer):
+    """Firma el nuevo access token con los claims actuales del usuario."""
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        refresh = self.token_class(attrs['refresh'])
+        user = User.objects.filter(pk=refresh[jwt_settings.USER_ID_CLAIM], is_active=True).first()
+        if user is None:
+            raise AuthenticationFailed("Usuario no encontrado o inactivo.")
+
+        data['access'] = str(agregar_claims(refresh.access_token, user))
+        return data
@@ -0,0 +1,60 @@
+from django.contrib.auth.models import User
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .authentication import invalidar_usuario
+from .estado_estudiante import invalidar_estado_estudiante
+from .metricas import instrumentar_conexion
+from .resumen import anotar_borrado, aplicar_borrados
+from .models import Estudiante, Matricula, Pago
+from .stripe_client import invalidar_payment_intent
+
+
+@receiver(post_save, sender=Pago)
+def invalidar_intent_al_cambiar_estado(sender, instance, created, **kwargs):
+    estado_original = getattr(instance, '_estado_original', None)
+    if not created and estado_original != instance.estado:
+        invalidar_payment_intent(instance.stripe_payment_intent_id)
+    instance._estado_original = instance.estado
+
+
+@receiver([post_save, post_delete], sender=Estudiante)
+def invalidar_estado_por_estudiante(sender, instance, **kwargs):
+    invalidar_estado_estudiante(instance.usuario_id)
+
+
+@receiver([post_save, post_delete], sender=Matricula)
+def invalidar_estado_por_matricula(sender, instance, **kwargs):
+    usuario_id = Estudiante.objects.filter(pk=instance.estudiante_id).values_list('usuario_id', flat=True).first()
+    invalidar_estado_estudiante(usuario_id)
+
+
+@receiver([post_save, post_delete], sender=Pago)
+def invalidar_estado_por_pago(sender, instance, **kwargs):
+    usuario_id = Matricula.objects.filter(pk=instance.matricula_id).values_list(
+        'estudiante__usuario_id', flat=True
+    ).first()
+    invalidar_estado_estudiante(usuario_id)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidar_usuario_autenticado(sender, instance, **kwargs):
+    # También cubre el cambio de contraseña (set_password + save)
+    invalidar_usuario(instance.pk)
+
+
+@receiver(pre_delete, sender=Matricula)
+@receiver(pre_delete, sender=Pago)
+def resumen_anotar_borrado(sender, instance, using, **kwargs):
+    anotar_borrado(instance, using)
+
+
+@receiver(post_delete, sender=Matricula)
+@receiver(post_delete, sender=Pago)
+def resumen_aplicar_borrados(sender, instance, using, **kwargs):
+    aplicar_borrados(using)
+
+
+# Cuenta y cronometra las consultas de cada conexión para las métricas por petición
+connection_created.connect(instrumentar_conexion, dispatch_uid='matriculas_metricas_sql')
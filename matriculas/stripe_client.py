@@ -0,0 +1,151 @@
+import asyncio
+import contextvars
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .metricas import ClienteHTTPMedido
+from .models import Pago
+
+stripe.api_key = settings.STRIPE_SECRET_KEY
+
+# Las llamadas *_async de stripe necesitan httpx o aiohttp; sin ellos se usa el cliente
+# síncrono en un pool de hilos propio para no bloquear el event loop.
+STRIPE_ASYNC_NATIVO = bool(importlib.util.find_spec('httpx') or importlib.util.find_spec('aiohttp'))
+_executor = None
+_clientes = {}
+
+CACHE_PREFIX = 'stripe:payment_intent:'
+CAMPOS_CACHEADOS = ('id', 'status', 'client_secret', 'amount', 'currency')
+
+
+def _cliente_http():
+    """El cliente HTTP que crearía stripe por defecto, cronometrado para las métricas."""
+    opciones = {'verify_ssl_certs': stripe.verify_ssl_certs, 'proxy': stripe.proxy}
+    asincrono = None
+    if importlib.util.find_spec('httpx'):
+        asincrono = stripe.HTTPXClient(**opciones)
+    elif importlib.util.find_spec('aiohttp'):
+        asincrono = stripe.AIOHTTPClient(**opciones)
+    return ClienteHTTPMedido(stripe.new_default_http_client(async_fallback_client=asincrono, **opciones))
+
+
+def cliente_stripe():
+    """
+    StripeClient con el que la aplicación llama a Stripe. Lleva su propio cliente HTTP
+    medido en lugar de sustituir stripe.default_http_client para todo el proceso. Se crea
+    uno por clave y URL base (stripe.api_key y stripe.api_base, que cambian las pruebas y
+    los benchmarks).
+    """
+    clave = (stripe.api_key, stripe.api_base)
+    cliente = _clientes.get(clave)
+    if cliente is None:
+        cliente = _clientes[clave] = stripe.StripeClient(
+            stripe.api_key, base_addresses={'api': stripe.api_base}, http_client=_cliente_http(),
+            max_network_retries=stripe.max_network_retries,
+        )
+    return cliente
+
+
+def _cache_key(intent_id):
+    return f'{CACHE_PREFIX}{intent_id}'
+
+
+def obtener_payment_intent(intent_id, usar_cache=True):
+    """
+    Devuelve los datos del PaymentIntent como diccionario.
+
+    Con ``usar_cache`` solo se consulta a Stripe cuando la entrada no está en caché
+    o ha expirado; sin él se consulta siempre y se refresca la caché.
+    """
+    key = _cache_key(intent_id)
+    if usar_cache:
+        datos = cache.get(key)
+        if datos is not None:
+            return datos
+
+    intent = cliente_stripe().payment_intents.retrieve(intent_id)
+    datos = {campo: intent.get(campo) for campo in CAMPOS_CACHEADOS}
+    cache.set(key, datos, settings.STRIPE_INTENT_CACHE_TTL)
+    return datos
+
+
+def _obtener_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.STRIPE_ASYNC_HILOS, thread_name_prefix='stripe')
+    return _executor
+
+
+async def llamar_stripe_async(metodo, *args, **kwargs):
+    """
+    Espera una llamada a Stripe con el límite STRIPE_TIMEOUT (lanza TimeoutError).
+    ``metodo`` es el método síncrono, p. ej. ``cliente_stripe().payment_intents.retrieve``.
+    """
+    if STRIPE_ASYNC_NATIVO:
+        metodo_async = getattr(metodo.__self__, f'{metodo.__name__}_async')
+        llamada = metodo_async(*args, **kwargs)
+    else:
+        loop = asyncio.get_running_loop()
+        # run_in_executor no copia el contexto; se copia para que la llamada cuente en las métricas
+        contexto = contextvars.copy_context()
+        llamada = loop.run_in_executor(_obtener_executor(), lambda: contexto.run(metodo, *args, **kwargs))
+    return await asyncio.wait_for(llamada, settings.STRIPE_TIMEOUT)
+
+
+async def obtener_payment_intent_async(intent_id, usar_cache=True):
+    """Versión asíncrona de obtener_payment_intent."""
+    key = _cache_key(intent_id)
+    if usar_cache:
+        datos = await cache.aget(key)
+        if datos is not None:
+            return datos
+
+    intent = await llamar_stripe_async(cliente_stripe().payment_intents.retrieve, intent_id)
+    datos = {campo: intent.get(campo) for campo in CAMPOS_CACHEADOS}
+    await cache.aset(key, datos, settings.STRIPE_INTENT_CACHE_TTL)
+    return datos
+
+
+def invalidar_payment_intent(intent_id):
+    invalidar_payment_intents([intent_id])
+
+
+def invalidar_payment_intents(intent_ids):
+    claves = [_cache_key(intent_id) for intent_id in intent_ids if intent_id]
+    if claves:
+        # Como el estado del estudiante, se invalida cuando se confirma el cambio del Pago
+        transaction.on_commit(lambda: cache.delete_many(claves))
+
+
+def obtener_client_secret(pago):
+    """
+    Devuelve el client_secret del pago. Se lee del propio Pago cuando ya está guardado;
+    los pagos antiguos lo obtienen una vez de Stripe (o de la caché) y lo guardan.
+    """
+    if pago.client_secret:
+        return pago.client_secret
+    if not pago.stripe_payment_intent_id:
+        return None
+
+    client_secret = obtener_payment_intent(pago.stripe_payment_intent_id)['client_secret']
+    Pago.objects.filter(pk=pago.pk).update(client_secret=client_secret)
+    pago.client_secret = client_secret
+    return client_secret
+
+
+async def obtener_client_secret_async(pago):
+    """Versión asíncrona de obtener_client_secret."""
+    if pago.client_secret:
+        return pago.client_secret
+    if not pago.stripe_payment_intent_id:
+        return None
+
+    client_secret = (await obtener_payment_intent_async(pago.stripe_payment_intent_id))['client_secret']
+    await Pago.objects.filter(pk=pago.pk).aupdate(client_secret=client_secret)
+    pago.client_secret = client_secret
+    return client_secret
@@ -0,0 +1,205 @@
+import hashlib
+import os
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import ArchivoCertificado, SubidaCertificado
+
+DIRECTORIO_PARCIALES = 'subidas_pendientes'
+DIRECTORIO_BLOBS = 'certificados/sha256'
+EXTENSIONES_PERMITIDAS = ('.pdf', '.jpg', '.jpeg', '.png')
+TAMANO_BLOQUE = 64 * 1024
+# Estados en los que la subida tiene (o puede tener) un archivo parcial en disco
+ESTADOS_ACTIVOS = ('En curso', 'Finalizando')
+
+
+class ErrorSubida(Exception):
+    """Error de protocolo de la subida por partes; ``status`` es el código HTTP a devolver."""
+
+    def __init__(self, mensaje, status=400):
+        super().__init__(mensaje)
+        self.status = status
+
+
+def ruta_parcial(subida):
+    return _ruta_parcial(subida.id)
+
+
+def _ruta_parcial(subida_id):
+    return default_storage.path(f'{DIRECTORIO_PARCIALES}/{subida_id}.part')
+
+
+def iniciar_subida(usuario, nombre, tamano, sha256=None):
+    """
+    Crea la sesión de subida. Si el cliente envía el SHA-256 de un contenido que él mismo
+    ya subió, la subida queda completada al instante sin transferir ningún byte.
+
+    Con contenido de otros usuarios no: conocer el hash no prueba tener el archivo, y
+    enlazarlo daría acceso al certificado ajeno (y la respuesta revelaría que existe). Esas
+    subidas envían los bytes y se deduplican al finalizar.
+    """
+    extension = os.path.splitext(nombre)[1].lower()
+    if extension not in EXTENSIONES_PERMITIDAS:
+        raise ErrorSubida(f"Extensión no permitida. Use {', '.join(EXTENSIONES_PERMITIDAS)}.")
+    if tamano <= 0 or tamano > settings.CERTIFICADO_MAX_BYTES:
+        raise ErrorSubida("Tamaño de archivo no válido.")
+
+    existente = ArchivoCertificado.objects.filter(
+        sha256=sha256, subidacertificado__usuario=usuario, subidacertificado__estado='Completada'
+    ).first() if sha256 else None
+    if existente:
+        return SubidaCertificado.objects.create(
+            usuario=usuario, nombre=nombre, tamano=tamano, recibido=tamano, estado='Completada', archivo=existente
+        )
+    return SubidaCertificado.objects.create(usuario=usuario, nombre=nombre, tamano=tamano)
+
+
+def recibir_parte(subida, inicio, stream, longitud, sha256_esperado=None):
+    """
+    Escribe en disco una parte que empieza en ``inicio`` leyendo el cuerpo por bloques y
+    calculando su SHA-256 al vuelo. Solo se acepta la parte que continúa el offset confirmado.
+    Devuelve el SHA-256 de la parte.
+    """
+    if subida.estado != 'En curso':
+        raise ErrorSubida(f"La subida ya no admite partes (estado '{subida.estado}').", status=409)
+    if inicio != subida.recibido:
+        raise ErrorSubida(f"Se esperaba el offset {subida.recibido}.", status=409)
+    if longitud <= 0 or inicio + longitud > subida.tamano:
+        raise ErrorSubida("La parte excede el tamaño declarado.")
+
+    ruta = ruta_parcial(subida)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    sha = hashlib.sha256()
+    escritos = 0
+    descriptor = os.open(ruta, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        # Escritura posicional: reintentar la misma parte reescribe los mismos bytes
+        while escritos < longitud:
+            bloque = stream.read(min(TAMANO_BLOQUE, longitud - escritos))
+            if not bloque:
+                break
+            os.pwrite(descriptor, bloque, inicio + escritos)
+            sha.update(bloque)
+            escritos += len(bloque)
+    finally:
+        os.close(descriptor)
+
+    if escritos != longitud:
+        raise ErrorSubida("La parte llegó incompleta.")
+    if sha256_esperado and sha256_esperado.lower() != sha.hexdigest():
+        raise ErrorSubida("El SHA-256 de la parte no coincide.")
+
+    # Solo avanza si nadie confirmó esta parte ni finalizó la subida mientras se escribía
+    avanzado = SubidaCertificado.objects.filter(pk=subida.pk, recibido=inicio, estado='En curso').update(
+        recibido=inicio + longitud, actualizado_en=timezone.now()
+    )
+    if not avanzado:
+        raise ErrorSubida("La parte ya fue recibida por otra petición.", status=409)
+    subida.recibido = inicio + longitud
+    return sha.hexdigest()
+
+
+def _sha256_archivo(ruta):
+    sha = hashlib.sha256()
+    with open(ruta, 'rb') as archivo:
+        for bloque in iter(lambda: archivo.read(TAMANO_BLOQUE * 16), b''):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+def finalizar_subida(subida):
+    """
+    Calcula el SHA-256 completo leyendo el archivo por bloques y lo mueve a su ruta
+    direccionada por contenido. Si ese contenido ya existe se reutiliza y se borra la copia.
+
+    La subida se reserva antes con un UPDATE condicional ('En curso' -> 'Finalizando'):
+    de dos finalizaciones simultáneas solo una mueve el archivo y la otra recibe 409.
+    """
+    if subida.estado == 'Completada':
+        return subida.archivo
+    if subida.recibido != subida.tamano:
+        raise ErrorSubida(f"Faltan bytes: recibidos {subida.recibido} de {subida.tamano}.", status=409)
+
+    reservada = SubidaCertificado.objects.filter(pk=subida.pk, estado='En curso', recibido=subida.tamano).update(
+        estado='Finalizando', actualizado_en=timezone.now()
+    )
+    if not reservada:
+        subida.refresh_from_db()
+        if subida.estado == 'Completada':
+            return subida.archivo
+        raise ErrorSubida(f"La subida no se puede finalizar (estado '{subida.estado}').", status=409)
+
+    try:
+        archivo = _guardar_contenido(subida)
+    except Exception:
+        SubidaCertificado.objects.filter(pk=subida.pk, estado='Finalizando').update(estado='En curso')
+        raise
+
+    SubidaCertificado.objects.filter(pk=subida.pk).update(
+        estado='Completada', archivo=archivo, actualizado_en=timezone.now()
+    )
+    subida.estado, subida.archivo = 'Completada', archivo
+    return archivo
+
+
+def _guardar_contenido(subida):
+    ruta = ruta_parcial(subida)
+    sha256 = _sha256_archivo(ruta)
+    archivo = ArchivoCertificado.objects.filter(sha256=sha256).first()
+    if archivo is not None:
+        os.remove(ruta)
+        return archivo
+
+    extension = os.path.splitext(subida.nombre)[1].lower()
+    nombre = f'{DIRECTORIO_BLOBS}/{sha256[:2]}/{sha256}{extension}'
+    destino = default_storage.path(nombre)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    os.replace(ruta, destino)
+    try:
+        with transaction.atomic():
+            return ArchivoCertificado.objects.create(sha256=sha256, archivo=nombre, tamano=subida.tamano)
+    except IntegrityError:
+        # Otra subida con el mismo contenido terminó a la vez y ya movió el mismo archivo
+        return ArchivoCertificado.objects.get(sha256=sha256)
+
+
+def expirar_subidas(antes_de):
+    """
+    Pasa a 'Expirada' las subidas sin actividad desde ``antes_de`` y borra sus archivos
+    parciales, y también los parciales de subidas que ya no existen. Devuelve cuántas
+    subidas expiraron.
+    """
+    inactivas = SubidaCertificado.objects.filter(estado__in=ESTADOS_ACTIVOS, actualizado_en__lt=antes_de)
+    expiradas = 0
+    for subida_id in list(inactivas.values_list('id', flat=True)):
+        # Condicionado otra vez: si llega una parte mientras tanto, la subida sigue viva
+        if inactivas.filter(pk=subida_id).update(estado='Expirada', actualizado_en=timezone.now()):
+            _borrar_si_existe(_ruta_parcial(subida_id))
+            expiradas += 1
+
+    directorio = default_storage.path(DIRECTORIO_PARCIALES)
+    parciales = {}
+    for nombre in os.listdir(directorio) if os.path.isdir(directorio) else ():
+        try:
+            parciales[uuid.UUID(nombre.removesuffix('.part'))] = os.path.join(directorio, nombre)
+        except ValueError:
+            continue
+    vivas = set(
+        SubidaCertificado.objects.filter(id__in=list(parciales), estado__in=ESTADOS_ACTIVOS).values_list('id', flat=True)
+    )
+    limite = antes_de.timestamp()
+    for subida_id, ruta in parciales.items():
+        if subida_id not in vivas and os.path.getmtime(ruta) < limite:
+            _borrar_si_existe(ruta)
+    return expiradas
+
+
+def _borrar_si_existe(ruta):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
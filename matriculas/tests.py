@@ -1,9 +1,19 @@
 
 import pytest
+import stripe
+from collections import Counter
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from matriculas.models import Estudiante, Matricula, Pago, PerfilUsuario
 from rest_framework.test import APIClient
 
+@pytest.fixture(autouse=True)
+def limpiar_cache():
+    from matriculas.authentication import cache_usuarios
+
+    cache.clear()
+    cache_usuarios.limpiar()
+
 # PRUEBAS UNITARIAS
 
 @pytest.mark.django_db
@@ -101,3 +111,1554 @@ def test_end_to_end_student_creation_and_payment():
     status_response = client.get('/api/matriculas/check-student/')
     assert status_response.status_code == 200
     assert status_response.data["has_student"] is True
+
+# PRUEBAS DE RENDIMIENTO
+
+class FakeStripe:
+    """Sustituto local de stripe.PaymentIntentService que cuenta las llamadas realizadas."""
+
+    def __init__(self):
+        self.llamadas = Counter()
+        self.intents = {}
+
+    def create(self, params, options=None):
+        amount, currency, metadata = params["amount"], params["currency"], params.get("metadata")
+        self.llamadas['create'] += 1
+        intent_id = f"pi_fake_{len(self.intents) + 1}"
+        self.intents[intent_id] = {
+            "id": intent_id,
+            "object": "payment_intent",
+            "amount": amount,
+            "currency": currency,
+            "status": "requires_payment_method",
+            "client_secret": f"{intent_id}_secret",
+            "metadata": metadata or {},
+        }
+        return stripe.PaymentIntent.construct_from(self.intents[intent_id], "sk_test")
+
+    def retrieve(self, intent_id, params=None, options=None):
+        self.llamadas['retrieve'] += 1
+        datos = self.intents.setdefault(intent_id, {
+            "id": intent_id,
+            "object": "payment_intent",
+            "amount": 10000,
+            "currency": "usd",
+            "status": "requires_payment_method",
+            "client_secret": f"{intent_id}_secret",
+            "metadata": {},
+        })
+        return stripe.PaymentIntent.construct_from(datos, "sk_test")
+
+@pytest.fixture
+def fake_stripe(monkeypatch):
+    fake = FakeStripe()
+    monkeypatch.setattr(stripe, "api_key", "sk_test_fake")
+    monkeypatch.setattr(stripe.PaymentIntentService, "create", fake.create)
+    monkeypatch.setattr(stripe.PaymentIntentService, "retrieve", fake.retrieve)
+    return fake
+
+def crear_matriculas(cantidad, inicio=0):
+    for i in range(inicio, inicio + cantidad):
+        user = User.objects.create(username=f"alumno{i}", email=f"alumno{i}@example.com")
+        estudiante = Estudiante.objects.create(
+            usuario=user,
+            nombre=f"Alumno {i}",
+            dni=f"{i:08d}",
+            fecha_nacimiento="2000-01-01",
+            grado="5to Primaria",
+            direccion="Calle 123"
+        )
+        matricula = Matricula.objects.create(estudiante=estudiante, curso="Matemáticas")
+        Pago.objects.create(matricula=matricula, stripe_payment_intent_id=f"pi_{i}")
+
+def contar_consultas_listado(client, url):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as ctx:
+        response = client.get(url)
+    assert response.status_code == 200
+    return len(ctx.captured_queries), response
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("url", ['/api/matriculas/', '/api/matriculas/?page_size=50'])
+def test_listado_matriculas_consultas_constantes(url):
+    admin = User.objects.create_user(username="admin", password="adminpass", is_staff=True)
+    client = APIClient()
+    client.force_authenticate(user=admin)
+
+    crear_matriculas(3)
+    consultas_pocas, _ = contar_consultas_listado(client, url)
+    crear_matriculas(30, inicio=3)
+    consultas_muchas, response = contar_consultas_listado(client, url)
+
+    assert consultas_pocas == consultas_muchas
+    filas = response.data["results"] if "results" in response.data else response.data
+    assert len(filas) == 33
+    assert filas[0]["pago"]["stripe_payment_intent_id"] == "pi_0"
+    assert filas[0]["estudiante"]["nombre"] == "Alumno 0"
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("url", ['/api/matriculas/', '/api/matriculas/?page_size=2'])
+def test_serializacion_rapida_igual_byte_a_byte(url, monkeypatch):
+    from rest_framework.test import APIRequestFactory, force_authenticate
+    from matriculas.serializers import MatriculaSerializer
+    from matriculas.serializacion_rapida import filas_matriculas, serializar_matriculas
+    from matriculas.views import MatriculaListAPIView, MatriculaViewSet
+
+    crear_matriculas(3)
+    estudiante = Estudiante.objects.get(dni="00000001")
+    estudiante.nombre = "Iñaki Ñúñez \u2028 \"Pérez\""
+    estudiante.certificado_estudios = "certificados/notas 1.pdf"
+    estudiante.save()
+    Matricula.objects.filter(estudiante=estudiante).update(monto="99.5")
+    Pago.objects.create(matricula=Matricula.objects.get(estudiante=estudiante), estado="Fallido")
+    Pago.objects.filter(stripe_payment_intent_id="pi_2").delete()
+
+    admin = User.objects.create(username="admin", is_staff=True)
+    client = cliente_con_token(admin)
+    # El listado del ViewSet queda tapado en las urls por MatriculaListAPIView
+    peticion = APIRequestFactory().get(url)
+    force_authenticate(peticion, user=admin)
+    listado_viewset = MatriculaViewSet.as_view({"get": "list"})
+
+    respuestas = []
+    for rapida in (True, False):
+        monkeypatch.setattr(MatriculaListAPIView, "serializacion_rapida", rapida)
+        monkeypatch.setattr(MatriculaViewSet, "serializacion_rapida", rapida)
+        respuestas.append((client.get(url).content, listado_viewset(peticion).render().content))
+    assert respuestas[0] == respuestas[1]
+
+    matriculas = Matricula.objects.con_detalle().order_by('id')
+    datos = serializar_matriculas(filas_matriculas(matriculas))
+    assert datos == MatriculaSerializer(matriculas, many=True).data
+
+    # Sin orjson instalado la salida es la misma
+    from rest_framework.renderers import JSONRenderer
+    from matriculas import renderers
+    monkeypatch.setattr(renderers, "orjson", None)
+    assert renderers.JSONRapidoRenderer().render(datos) == JSONRenderer().render(datos)
+
+@pytest.mark.django_db
+def test_listado_matriculas_paginacion_cursor():
+    admin = User.objects.create_user(username="admin", password="adminpass", is_staff=True)
+    client = APIClient()
+    client.force_authenticate(user=admin)
+    crear_matriculas(5)
+
+    response = client.get('/api/matriculas/?page_size=2')
+    assert [m["estudiante"]["nombre"] for m in response.data["results"]] == ["Alumno 0", "Alumno 1"]
+
+    response = client.get(response.data["next"])
+    assert [m["estudiante"]["nombre"] for m in response.data["results"]] == ["Alumno 2", "Alumno 3"]
+
+@pytest.mark.django_db
+def test_consultas_de_estado_no_llaman_a_stripe(fake_stripe):
+    user = User.objects.create(username="testuser")
+    client = APIClient()
+    client.force_authenticate(user=user)
+
+    response = client.post('/api/matriculas/estudiante/crear/', {
+        "nombre": "Juan Perez",
+        "dni": "12345678",
+        "fecha_nacimiento": "2000-01-01",
+        "grado": "5to Primaria",
+        "direccion": "Calle 123"
+    })
+    client_secret = response.data["client_secret"]
+
+    for _ in range(5):
+        assert client.get('/api/matriculas/check-student/').data["client_secret"] == client_secret
+        assert client.get('/api/matriculas/estudiante/verificar/').data["client_secret"] == client_secret
+
+    assert fake_stripe.llamadas == Counter(create=1)
+
+@pytest.mark.django_db(transaction=True)
+def test_estudiante_importado_sin_intent_puede_pagar(fake_stripe, settings, tmp_path):
+    import csv
+    from django.core.management import call_command
+
+    settings.PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+    archivo = tmp_path / "alumnos.csv"
+    with open(archivo, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["username", "email", "password", "nombre", "dni", "fecha_nacimiento", "grado", "direccion"])
+        writer.writerow(["ana", "ana@example.com", "clave1", "Ana", "11111111", "2001-02-03", "5to", "Calle 1"])
+    call_command("import_enrollments", str(archivo), "--procesos", "1")
+
+    client = APIClient()
+    client.force_authenticate(user=User.objects.get(username="ana"))
+    assert client.get('/api/matriculas/check-student/').data["client_secret"] is None
+
+    for _ in range(2):
+        response = client.post('/api/matriculas/estudiante/crear/', {})
+        assert response.status_code == 200
+        assert response.data == {"client_secret": "pi_fake_1_secret", "payment_intent_id": "pi_fake_1"}
+    assert fake_stripe.llamadas == Counter(create=1)
+    assert list(Pago.objects.values_list("stripe_payment_intent_id", "client_secret")) == [("pi_fake_1", "pi_fake_1_secret")]
+    assert client.get('/api/matriculas/check-student/').data["client_secret"] == "pi_fake_1_secret"
+
+@pytest.mark.django_db
+def test_crear_estudiante_idempotente_sin_intents_ni_filas_de_mas(fake_stripe, monkeypatch):
+    from matriculas.models import ClaveIdempotencia
+
+    user = User.objects.create(username="testuser")
+    client = APIClient()
+    client.force_authenticate(user=user)
+    datos = {
+        "nombre": "Juan Perez", "dni": "12345678", "fecha_nacimiento": "2000-01-01",
+        "grado": "5to Primaria", "direccion": "Calle 123"
+    }
+
+    # Stripe no responde: la matrícula queda creada y la clave libre para el reintento
+    def stripe_caido(servicio, params, options=None):
+        raise stripe.error.APIConnectionError("Tiempo de espera agotado")
+
+    crear = fake_stripe.create
+    monkeypatch.setattr(stripe.PaymentIntentService, "create", stripe_caido)
+    with pytest.raises(stripe.error.APIConnectionError):
+        client.post('/api/matriculas/estudiante/crear/', datos, HTTP_IDEMPOTENCY_KEY="clave-1")
+    assert (Matricula.objects.count(), Pago.objects.count(), ClaveIdempotencia.objects.count()) == (1, 0, 0)
+
+    monkeypatch.setattr(stripe.PaymentIntentService, "create", crear)
+    response = client.post('/api/matriculas/estudiante/crear/', datos, HTTP_IDEMPOTENCY_KEY="clave-1")
+    assert response.status_code == 200
+    assert fake_stripe.llamadas == Counter(create=1)
+
+    # Reintentos: respuesta guardada o pago abierto reutilizado, sin llamar a Stripe
+    assert client.post('/api/matriculas/estudiante/crear/', datos, HTTP_IDEMPOTENCY_KEY="clave-1").data == response.data
+    assert client.post('/api/matriculas/estudiante/crear/', datos).data == response.data
+    assert client.post('/api/matriculas/estudiante/crear/', datos, HTTP_IDEMPOTENCY_KEY="clave-2").data == response.data
+    assert fake_stripe.llamadas == Counter(create=1)
+    assert (Estudiante.objects.count(), Matricula.objects.count(), Pago.objects.count()) == (1, 1, 1)
+
+    otros_datos = {**datos, "nombre": "Otro Nombre"}
+    response = client.post('/api/matriculas/estudiante/crear/', otros_datos, HTTP_IDEMPOTENCY_KEY="clave-1")
+    assert response.status_code == 422
+
+    Matricula.objects.update(estado="Pagado")
+    response = client.post('/api/matriculas/estudiante/crear/', datos)
+    assert response.status_code == 400
+
+@pytest.mark.django_db
+def test_client_secret_de_pagos_antiguos_se_consulta_una_vez(fake_stripe):
+    crear_matriculas(1)
+    client = APIClient()
+    client.force_authenticate(user=User.objects.get(username="alumno0"))
+
+    for _ in range(3):
+        response = client.get('/api/matriculas/check-student/')
+        assert response.data["client_secret"] == "pi_0_secret"
+
+    assert fake_stripe.llamadas["retrieve"] == 1
+    assert Pago.objects.get().client_secret == "pi_0_secret"
+
+@pytest.mark.django_db(transaction=True)
+def test_cache_payment_intent_se_invalida_al_cambiar_estado_del_pago(fake_stripe):
+    from matriculas.stripe_client import obtener_payment_intent
+
+    crear_matriculas(1)
+    obtener_payment_intent("pi_0")
+    obtener_payment_intent("pi_0")
+    assert fake_stripe.llamadas["retrieve"] == 1
+
+    pago = Pago.objects.get()
+    pago.save()
+    obtener_payment_intent("pi_0")
+    assert fake_stripe.llamadas["retrieve"] == 1
+
+    pago.estado = "Completado"
+    pago.save()
+    obtener_payment_intent("pi_0")
+    assert fake_stripe.llamadas["retrieve"] == 2
+
+def firmar_evento_stripe(payload, secreto):
+    import hashlib
+    import hmac
+    import time
+
+    timestamp = int(time.time())
+    firma = hmac.new(secreto.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={firma}"
+
+def enviar_evento_stripe(client, tipo, intent_id, evento_id="evt_1", secreto="whsec_test"):
+    import json
+
+    payload = json.dumps({
+        "id": evento_id,
+        "object": "event",
+        "type": tipo,
+        "data": {"object": {"id": intent_id, "object": "payment_intent"}},
+    })
+    return client.post(
+        '/api/matriculas/pago/webhook/', payload, content_type="application/json",
+        HTTP_STRIPE_SIGNATURE=firmar_evento_stripe(payload, secreto)
+    )
+
+@pytest.mark.django_db
+def test_webhook_confirma_pago_una_sola_vez(settings, fake_stripe):
+    from matriculas.models import EventoStripe
+
+    settings.STRIPE_WEBHOOK_SECRET = "whsec_test"
+    crear_matriculas(1)
+    client = APIClient()
+
+    for _ in range(3):
+        response = enviar_evento_stripe(client, "payment_intent.succeeded", "pi_0")
+        assert response.status_code == 200
+
+    assert EventoStripe.objects.count() == 1
+    assert EventoStripe.objects.get().procesado_en is not None
+    assert Pago.objects.get().estado == "Completado"
+    assert Matricula.objects.get().estado == "Pagado"
+
+    # La confirmación del cliente ya no necesita consultar a Stripe
+    client.force_authenticate(user=User.objects.get(username="alumno0"))
+    response = client.post('/api/matriculas/pago/confirmar/pi_0/')
+    assert response.status_code == 200
+    assert fake_stripe.llamadas["retrieve"] == 0
+
+@pytest.mark.django_db
+def test_webhook_pago_fallido_y_firma_invalida(settings):
+    settings.STRIPE_WEBHOOK_SECRET = "whsec_test"
+    crear_matriculas(1)
+    client = APIClient()
+
+    response = enviar_evento_stripe(client, "payment_intent.succeeded", "pi_0", secreto="whsec_otro")
+    assert response.status_code == 400
+    assert Pago.objects.get().estado == "Pendiente"
+
+    response = enviar_evento_stripe(client, "payment_intent.payment_failed", "pi_0", evento_id="evt_2")
+    assert response.status_code == 200
+    assert Pago.objects.get().estado == "Fallido"
+    assert Matricula.objects.get().estado == "Pendiente"
+
+@pytest.mark.django_db
+def test_aprobacion_encola_correo_y_worker_lo_envia():
+    from django.core import mail
+    from django.core.management import call_command
+    from matriculas.models import NotificacionEmail
+
+    admin = User.objects.create(username="admin", is_staff=True)
+    client = APIClient()
+    client.force_authenticate(user=admin)
+    crear_matriculas(2)
+
+    for matricula in Matricula.objects.all():
+        response = client.patch(f'/api/matriculas/{matricula.id}/verificar/', {"estado": "Aprobado"})
+        assert response.status_code == 200
+
+    assert len(mail.outbox) == 0
+    assert NotificacionEmail.objects.filter(estado="Pendiente").count() == 2
+
+    call_command('enviar_notificaciones', '--lote', '1')
+    assert sorted(m.to[0] for m in mail.outbox) == ["alumno0@example.com", "alumno1@example.com"]
+    assert NotificacionEmail.objects.filter(estado="Enviado").count() == 2
+
+@pytest.mark.django_db
+def test_outbox_reintenta_con_espera_y_marca_fallido(monkeypatch):
+    from django.core.mail.backends.locmem import EmailBackend
+    from django.utils import timezone
+    from matriculas.models import NotificacionEmail
+    from matriculas.notificaciones import enviar_pendientes, metricas_outbox
+
+    def fallar(self, messages):
+        raise ConnectionError("SMTP no disponible")
+
+    monkeypatch.setattr(EmailBackend, "send_messages", fallar)
+    notificacion = NotificacionEmail.objects.create(destinatario="a@example.com", asunto="Hola", mensaje="...")
+
+    resultado = enviar_pendientes(max_intentos=2)
+    notificacion.refresh_from_db()
+    assert resultado["reintentos"] == 1
+    assert notificacion.intentos == 1
+    assert notificacion.proximo_intento > timezone.now()
+    assert enviar_pendientes(max_intentos=2)["reintentos"] == 0
+
+    NotificacionEmail.objects.update(proximo_intento=timezone.now())
+    assert enviar_pendientes(max_intentos=2)["fallidos"] == 1
+    assert metricas_outbox()["fallidos"] == 1
+    texto = APIClient().get('/metrics').content.decode()
+    assert 'matriculas_outbox_fallidos 1.0' in texto and 'matriculas_outbox_pendientes 0.0' in texto
+
+@pytest.mark.django_db
+def test_outbox_un_error_al_guardar_no_reenvia_el_lote(monkeypatch):
+    from django.core import mail
+    from django.db import DatabaseError
+    from django.db.models import QuerySet
+    from matriculas.models import NotificacionEmail
+    from matriculas.notificaciones import enviar_pendientes
+
+    notificaciones = [
+        NotificacionEmail.objects.create(destinatario=f"{i}@example.com", asunto="Hola", mensaje="...") for i in range(3)
+    ]
+    actualizar = QuerySet.update
+
+    def fallar_con_el_segundo(self, **cambios):
+        if cambios.get('estado') == 'Enviado' and self.filter(pk=notificaciones[1].pk).exists():
+            raise DatabaseError("conexión perdida")
+        return actualizar(self, **cambios)
+
+    monkeypatch.setattr(QuerySet, "update", fallar_con_el_segundo)
+    resultado = enviar_pendientes()
+    assert (resultado["enviados"], resultado["reintentos"], resultado["fallidos"]) == (3, 0, 0)
+    assert len(mail.outbox) == 3
+    estados = dict(NotificacionEmail.objects.values_list('destinatario', 'estado'))
+    assert estados == {"0@example.com": "Enviado", "1@example.com": "Pendiente", "2@example.com": "Enviado"}
+    assert NotificacionEmail.objects.get(pk=notificaciones[1].pk).intentos == 0
+
+@pytest.mark.django_db
+def test_verificacion_en_lote_por_ids():
+    from matriculas.models import NotificacionEmail
+
+    admin = User.objects.create(username="admin", is_staff=True)
+    client = APIClient()
+    client.force_authenticate(user=admin)
+    crear_matriculas(3)
+    primera, segunda, tercera = Matricula.objects.order_by('id')
+    Matricula.objects.filter(id=tercera.id).update(estado="Rechazado")
+
+    response = client.post('/api/matriculas/verificar-lote/', {
+        "estado": "Aprobado",
+        "ids": [primera.id, segunda.id, tercera.id, 999999]
+    }, format="json")
+
+    assert response.status_code == 200
+    assert response.data["actualizadas"] == 2
+    assert [r["resultado"] for r in response.data["resultados"]] == [
+        "actualizada", "actualizada", "estado_invalido", "no_encontrada"
+    ]
+    assert list(Matricula.objects.order_by('id').values_list('estado', flat=True)) == ["Aprobado", "Aprobado", "Rechazado"]
+    assert NotificacionEmail.objects.count() == 2
+
+@pytest.mark.django_db
+def test_verificacion_en_lote_por_filtro():
+    admin = User.objects.create(username="admin", is_staff=True)
+    client = APIClient()
+    client.force_authenticate(user=admin)
+    crear_matriculas(3)
+    Matricula.objects.exclude(id=Matricula.objects.order_by('id').first().id).update(estado="Pagado")
+
+    response = client.post('/api/matriculas/verificar-lote/', {
+        "estado": "Rechazado", "filtro": "pagadas_pendientes"
+    }, format="json")
+    assert response.data["actualizadas"] == 2
+    assert Matricula.objects.filter(estado="Rechazado").count() == 2
+
+    response = client.post('/api/matriculas/verificar-lote/', {"estado": "Aprobado"}, format="json")
+    assert response.status_code == 400
+
+@pytest.mark.django_db
+def test_estado_estudiante_una_consulta_y_luego_cache(django_assert_num_queries, fake_stripe):
+    from matriculas.estado_estudiante import obtener_estado_estudiante
+
+    crear_matriculas(1)
+    Pago.objects.update(client_secret="pi_0_secret")
+    usuario_id = User.objects.get(username="alumno0").id
+
+    with django_assert_num_queries(1):
+        estado = obtener_estado_estudiante(usuario_id)
+    with django_assert_num_queries(0):
+        assert obtener_estado_estudiante(usuario_id) == estado
+
+    assert estado["estudiante"]["nombre"] == "Alumno 0"
+    assert estado["matricula_estado"] == "Pendiente"
+    assert estado["client_secret"] == "pi_0_secret"
+
+@pytest.mark.django_db(transaction=True)
+def test_cache_de_estado_se_invalida_al_confirmar_la_transaccion(fake_stripe):
+    from django.db import transaction
+    from matriculas.pagos import confirmar_pago
+    from matriculas.stripe_client import obtener_payment_intent
+
+    crear_matriculas(1)
+    client = APIClient()
+    client.force_authenticate(user=User.objects.get(username="alumno0"))
+    url = '/api/matriculas/check-student/'
+    assert client.get(url).data["payment_completed"] is False
+    obtener_payment_intent("pi_0")
+
+    with transaction.atomic():
+        confirmar_pago("pi_0")
+        # Antes del commit la caché no se toca: una consulta no guarda de nuevo el estado viejo
+        assert client.get(url).data["payment_completed"] is False
+        assert cache.get("stripe:payment_intent:pi_0") is not None
+    assert cache.get("stripe:payment_intent:pi_0") is None
+    assert client.get(url).data["payment_completed"] is True
+
+    with transaction.atomic():
+        Matricula.objects.get().delete()
+        transaction.set_rollback(True)
+    # Si la transacción se deshace, la caché sigue siendo válida
+    assert client.get(url).data["payment_completed"] is True
+
+@pytest.mark.django_db(transaction=True)
+def test_estado_estudiante_se_invalida_al_cambiar_matricula_o_pago(settings, fake_stripe):
+    settings.STRIPE_WEBHOOK_SECRET = "whsec_test"
+    crear_matriculas(1)
+    client = APIClient()
+    client.force_authenticate(user=User.objects.get(username="alumno0"))
+
+    assert client.get('/api/matriculas/check-student/').data["payment_completed"] is False
+
+    enviar_evento_stripe(APIClient(), "payment_intent.succeeded", "pi_0")
+    assert client.get('/api/matriculas/check-student/').data["payment_completed"] is True
+
+    matricula = Matricula.objects.get()
+    matricula.estado = "Rechazado"
+    matricula.save()
+    assert client.get('/api/matriculas/check-student/').data["matricula_rechazada"] is True
+
+def crear_matriculas_en_bloque(cantidad, lote=10000):
+    """Inserta usuarios, estudiantes, matrículas y pagos con bulk_create e ids explícitos."""
+    for inicio in range(1, cantidad + 1, lote):
+        ids = range(inicio, min(inicio + lote, cantidad + 1))
+        User.objects.bulk_create([User(id=i, username=f"alumno{i}", email=f"alumno{i}@example.com") for i in ids])
+        Estudiante.objects.bulk_create([
+            Estudiante(id=i, usuario_id=i, nombre=f"Alumno {i}", dni=f"{i:08d}", fecha_nacimiento="2000-01-01",
+                       grado="5to Primaria", direccion="Calle 123")
+            for i in ids
+        ])
+        Matricula.objects.bulk_create([
+            Matricula(id=i, estudiante_id=i, curso="Matemáticas" if i % 2 else "Historia") for i in ids
+        ])
+        Pago.objects.bulk_create([
+            Pago(id=i, matricula_id=i, stripe_payment_intent_id=f"pi_{i}", estado="Completado" if i % 3 else "Pendiente")
+            for i in ids
+        ])
+
+def memoria_maxima_exportacion(client, url):
+    import tracemalloc
+
+    tracemalloc.start()
+    response = client.get(url)
+    filas = sum(1 for _ in response.streaming_content)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return filas, pico
+
+@pytest.mark.django_db
+def test_exportacion_csv_y_ndjson_con_filtros():
+    import csv
+    import io
+    import json
+
+    admin = User.objects.create(id=100000, username="admin", is_staff=True)
+    client = APIClient()
+    client.force_authenticate(user=admin)
+    crear_matriculas_en_bloque(6)
+
+    response = client.get('/api/matriculas/exportar/?curso=Historia')
+    assert response["Content-Type"].startswith("text/csv")
+    filas = list(csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode())))
+    assert [f["id"] for f in filas] == ["2", "4", "6"]
+    assert filas[0]["estudiante_email"] == "alumno2@example.com"
+
+    response = client.get('/api/matriculas/exportar/?formato=ndjson&pago_estado=Pendiente')
+    filas = [json.loads(linea) for linea in b"".join(response.streaming_content).decode().splitlines()]
+    assert [f["id"] for f in filas] == [3, 6]
+    assert filas[0]["monto"] == "100.00"
+
+    assert client.get('/api/matriculas/exportar/?formato=xml').status_code == 400
+
+@pytest.mark.django_db
+def test_exportacion_por_bloques_de_clave_y_sin_formulas(monkeypatch):
+    import csv
+    import io
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from matriculas import exportacion
+
+    monkeypatch.setattr(exportacion, "TAMANO_BLOQUE", 2)
+    client = APIClient()
+    client.force_authenticate(user=User.objects.create(id=100, username="admin", is_staff=True))
+    crear_matriculas_en_bloque(5)
+    # La matrícula 2 tiene dos pagos y es la última del primer bloque
+    Pago.objects.create(id=100, matricula_id=2, stripe_payment_intent_id="pi_extra")
+    Estudiante.objects.filter(id=1).update(nombre='=HYPERLINK("http://x","y")')
+    Estudiante.objects.filter(id=3).update(nombre="-2+3")
+
+    with CaptureQueriesContext(connection) as consultas:
+        response = client.get('/api/matriculas/exportar/')
+        filas = list(csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode())))
+    assert [(f["id"], f["stripe_payment_intent_id"]) for f in filas] == [
+        ("1", "pi_1"), ("2", "pi_2"), ("2", "pi_extra"), ("3", "pi_3"), ("4", "pi_4"), ("5", "pi_5")
+    ]
+    assert [f["estudiante_nombre"] for f in filas[:4]] == ["'=HYPERLINK(\"http://x\",\"y\")", "Alumno 2", "Alumno 2", "'-2+3"]
+    # Tres bloques (ids y filas) y la consulta que comprueba que no quedan más
+    selects = [c["sql"] for c in consultas.captured_queries if "matriculas_matricula" in c["sql"]]
+    assert len(selects) == 7
+    assert sum("LIMIT 2" in sql for sql in selects) == 4
+
+@pytest.mark.django_db
+def test_exportacion_memoria_constante():
+    # Para la comprobación a escala real: EXPORTACION_FILAS_PRUEBA=500000 pytest -k exportacion
+    import os
+
+    total = int(os.environ.get("EXPORTACION_FILAS_PRUEBA", 20000))
+    admin = User.objects.create(id=total + 1, username="admin", is_staff=True)
+    client = APIClient()
+    client.force_authenticate(user=admin)
+
+    crear_matriculas_en_bloque(total // 4)
+    memoria_maxima_exportacion(client, '/api/matriculas/exportar/?formato=ndjson')
+    filas_pocas, pico_pocas = memoria_maxima_exportacion(client, '/api/matriculas/exportar/?formato=ndjson')
+    User.objects.exclude(id=admin.id).delete()
+    crear_matriculas_en_bloque(total)
+    filas_muchas, pico_muchas = memoria_maxima_exportacion(client, '/api/matriculas/exportar/?formato=ndjson')
+
+    assert (filas_pocas, filas_muchas) == (total // 4, total)
+    # Con cuatro veces más filas el pico de memoria debe mantenerse
+    assert pico_muchas < pico_pocas * 1.5
+
+def imagen_subida(nombre="foto.png", tamano=(3000, 2000), formato="PNG"):
+    import io
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", tamano, (200, 30, 30)).save(buffer, format=formato)
+    return SimpleUploadedFile(nombre, buffer.getvalue(), content_type=f"image/{formato.lower()}")
+
+@pytest.mark.django_db
+def test_foto_perfil_genera_miniaturas(settings, tmp_path, django_capture_on_commit_callbacks):
+    from PIL import Image
+
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.PROCESAR_FOTOS_EN_SEGUNDO_PLANO = False
+    client = APIClient()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post('/api/matriculas/registro/', {
+            "username": "testuser", "email": "test@example.com", "password": "testpass",
+            "foto_perfil": imagen_subida()
+        })
+    assert response.status_code == 201
+
+    perfil = PerfilUsuario.objects.get()
+    assert perfil.estado_foto == "Lista"
+    with Image.open(perfil.foto_perfil.path) as original:
+        assert max(original.size) == settings.FOTO_PERFIL_MAX_LADO
+    with Image.open(tmp_path / perfil.variantes_foto["miniatura_webp"]) as miniatura:
+        assert (miniatura.format, miniatura.size) == ("WEBP", (96, 96))
+
+    client.force_authenticate(user=perfil.usuario)
+    datos = client.get('/api/matriculas/perfil/').data["perfil"]
+    assert datos["foto_perfil"].endswith("_miniatura.jpg")
+    assert datos["foto_original"] == perfil.foto_perfil.url
+    assert set(datos["variantes"]) == {"miniatura", "miniatura_webp", "mediana", "mediana_webp"}
+
+@pytest.mark.django_db
+def test_foto_perfil_rechaza_formato_no_permitido(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    user = User.objects.create(username="testuser")
+    client = APIClient()
+    client.force_authenticate(user=user)
+
+    response = client.put('/api/matriculas/perfil/', {"foto_perfil": imagen_subida("foto.tiff", (50, 50), "TIFF")})
+    assert response.status_code == 400
+
+def test_variantes_se_generan_en_el_pool_de_procesos(settings, tmp_path):
+    from matriculas.imagenes import _obtener_pool, generar_variantes
+
+    origen = tmp_path / "foto.png"
+    origen.write_bytes(imagen_subida(tamano=(400, 300)).read())
+    variantes = _obtener_pool().submit(generar_variantes, str(origen), str(tmp_path), 2048).result(timeout=60)
+    assert (tmp_path / variantes["mediana"]).exists()
+
+@pytest.fixture
+def certificado(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    (tmp_path / "certificados").mkdir()
+    (tmp_path / "certificados" / "cert.pdf").write_bytes(bytes(range(256)) * 40)
+    crear_matriculas(2)
+    Estudiante.objects.filter(usuario__username="alumno0").update(certificado_estudios="certificados/cert.pdf")
+    return "/media/certificados/cert.pdf"
+
+@pytest.mark.django_db
+def test_media_certificado_solo_para_su_estudiante_o_staff(certificado):
+    client = APIClient()
+    assert client.get(certificado).status_code == 403
+
+    client.force_authenticate(user=User.objects.get(username="alumno1"))
+    assert client.get(certificado).status_code == 403
+
+    client.force_authenticate(user=User.objects.get(username="alumno0"))
+    response = client.get(certificado)
+    assert response.status_code == 200
+    assert b"".join(response.streaming_content) == bytes(range(256)) * 40
+
+    client.force_authenticate(user=User.objects.create(username="admin", is_staff=True))
+    assert client.get(certificado).status_code == 200
+    assert client.get('/media/../manage.py').status_code == 404
+
+@pytest.mark.django_db
+def test_media_no_se_salta_permisos_con_rutas_relativas(certificado, settings, tmp_path):
+    (tmp_path / "fotos_perfil").mkdir()
+    client = APIClient()
+    for ruta in ('/media/fotos_perfil/../certificados/cert.pdf', '/media/fotos_perfil/%2e%2e/certificados/cert.pdf',
+                 '/media/fotos_perfil/./../certificados/cert.pdf'):
+        assert client.get(ruta).status_code == 403
+
+    client.force_authenticate(user=User.objects.get(username="alumno1"))
+    assert client.get('/media/fotos_perfil/../certificados/cert.pdf').status_code == 403
+    client.force_authenticate(user=User.objects.get(username="alumno0"))
+    assert client.get('/media/fotos_perfil/../certificados/cert.pdf').status_code == 200
+
+@pytest.mark.django_db
+def test_media_get_condicional_y_rangos(certificado):
+    client = APIClient()
+    client.force_authenticate(user=User.objects.get(username="alumno0"))
+    etag = client.get(certificado)["ETag"]
+
+    assert client.get(certificado, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    response = client.get(certificado, HTTP_RANGE="bytes=10-19")
+    assert response.status_code == 206
+    assert response["Content-Range"] == "bytes 10-19/10240"
+    assert b"".join(response.streaming_content) == bytes(range(10, 20))
+
+    response = client.get(certificado, HTTP_RANGE="bytes=-4")
+    assert b"".join(response.streaming_content) == bytes(range(252, 256))
+    assert client.get(certificado, HTTP_RANGE="bytes=20000-").status_code == 416
+
+@pytest.mark.django_db
+def test_media_delegada_al_servidor_web(certificado, settings):
+    settings.MEDIA_SENDFILE = "x-accel-redirect"
+    client = APIClient()
+    client.force_authenticate(user=User.objects.get(username="alumno0"))
+
+    response = client.get(certificado)
+    assert response["X-Accel-Redirect"] == "/protected-media/certificados/cert.pdf"
+    assert response.content == b""
+
+def subir_por_partes(client, contenido, tamano_parte, tamano_total=None):
+    response = client.post('/api/matriculas/certificados/subidas/', {
+        "nombre": "cert.pdf", "tamano": tamano_total or len(contenido)
+    })
+    assert response.status_code == 201
+    url = f'/api/matriculas/certificados/subidas/{response.data["id"]}/'
+    for inicio in range(0, len(contenido), tamano_parte):
+        parte = contenido[inicio:inicio + tamano_parte]
+        response = client.generic('PATCH', url, parte, content_type="application/offset+octet-stream",
+                                  HTTP_UPLOAD_OFFSET=str(inicio))
+        assert response.status_code == 200
+    return url
+
+@pytest.mark.django_db
+def test_finalizar_subida_dos_veces_a_la_vez_y_expirar_abandonadas(settings, tmp_path):
+    import os
+    import uuid
+    from datetime import timedelta
+    from django.core.management import call_command
+    from django.utils import timezone
+    from matriculas.models import SubidaCertificado
+    from matriculas.subidas import ErrorSubida, finalizar_subida, ruta_parcial
+
+    settings.MEDIA_ROOT = str(tmp_path)
+    client = APIClient()
+    client.force_authenticate(user=User.objects.create(username="testuser"))
+    url = subir_por_partes(client, b"x" * 1000, 400)
+    subida_id = url.rstrip('/').rsplit('/', 1)[1]
+
+    # Dos peticiones leyeron la subida 'En curso'; solo la primera mueve el archivo
+    primera, segunda = SubidaCertificado.objects.get(pk=subida_id), SubidaCertificado.objects.get(pk=subida_id)
+    SubidaCertificado.objects.filter(pk=subida_id).update(estado='Finalizando')
+    with pytest.raises(ErrorSubida) as error:
+        finalizar_subida(segunda)
+    assert error.value.status == 409
+    assert client.post(f'{url}finalizar/').status_code == 409
+    SubidaCertificado.objects.filter(pk=subida_id).update(estado='En curso')
+    archivo = finalizar_subida(primera)
+    assert finalizar_subida(segunda) == archivo
+    assert client.post(f'{url}finalizar/').status_code == 200
+
+    # Subidas abandonadas: se expiran y se borran sus partes, también las huérfanas
+    abandonada = subir_por_partes(client, b"y" * 100, 100, tamano_total=1000).rstrip('/').rsplit('/', 1)[1]
+    reciente = subir_por_partes(client, b"z" * 100, 100, tamano_total=1000).rstrip('/').rsplit('/', 1)[1]
+    hace_dos_dias = timezone.now() - timedelta(days=2)
+    SubidaCertificado.objects.filter(pk=abandonada).update(actualizado_en=hace_dos_dias)
+    huerfana = ruta_parcial(SubidaCertificado(id=uuid.uuid4()))
+    open(huerfana, "wb").close()
+    os.utime(huerfana, (hace_dos_dias.timestamp(),) * 2)
+
+    call_command("expirar_subidas")
+    assert SubidaCertificado.objects.get(pk=abandonada).estado == 'Expirada'
+    assert SubidaCertificado.objects.get(pk=reciente).estado == 'En curso'
+    assert sorted(os.listdir(os.path.dirname(huerfana))) == [f"{reciente}.part"]
+    response = client.generic('PATCH', f'/api/matriculas/certificados/subidas/{abandonada}/', b"y", HTTP_UPLOAD_OFFSET="100")
+    assert response.status_code == 409
+
+@pytest.mark.django_db
+def test_subida_por_partes_reanudable_y_deduplicada(settings, tmp_path, fake_stripe):
+    import hashlib
+    from matriculas.models import ArchivoCertificado
+
+    settings.MEDIA_ROOT = str(tmp_path)
+    contenido = bytes(range(256)) * 1000
+    user = User.objects.create(username="testuser")
+    client = APIClient()
+    client.force_authenticate(user=user)
+
+    url = subir_por_partes(client, contenido[:100000], 30000, tamano_total=len(contenido))
+    # Reintentar una parte ya confirmada devuelve el offset desde el que reanudar
+    response = client.generic('PATCH', url, contenido[:10], HTTP_UPLOAD_OFFSET="0")
+    assert (response.status_code, response.data["recibido"]) == (409, 100000)
+    assert client.get(url).data["recibido"] == 100000
+    assert client.post(f'{url}finalizar/').status_code == 409
+
+    response = client.generic('PATCH', url, contenido[100000:], HTTP_UPLOAD_OFFSET="100000")
+    assert response.data["sha256_parte"] == hashlib.sha256(contenido[100000:]).hexdigest()
+    response = client.post(f'{url}finalizar/')
+    sha256 = hashlib.sha256(contenido).hexdigest()
+    assert response.data["sha256"] == sha256
+    archivo = ArchivoCertificado.objects.get()
+    assert open(archivo.archivo.path, "rb").read() == contenido
+
+    # Misma subida conociendo el hash: queda completada sin enviar bytes
+    response = client.post('/api/matriculas/certificados/subidas/', {
+        "nombre": "otro.pdf", "tamano": len(contenido), "sha256": sha256
+    })
+    assert (response.status_code, response.data["estado"]) == (200, "Completada")
+
+    # Otro usuario que solo conoce el hash tiene que enviar los bytes
+    otro = APIClient()
+    otro.force_authenticate(user=User.objects.create(username="otro"))
+    ajena = otro.post('/api/matriculas/certificados/subidas/', {
+        "nombre": "ajeno.pdf", "tamano": len(contenido), "sha256": sha256
+    })
+    assert (ajena.status_code, ajena.data["estado"]) == (201, "En curso")
+    assert otro.post(f'/api/matriculas/certificados/subidas/{ajena.data["id"]}/finalizar/').status_code == 409
+
+    # Mismo contenido subido de nuevo por partes: se reutiliza el archivo existente
+    url = subir_por_partes(client, contenido, 50000)
+    client.post(f'{url}finalizar/')
+    assert ArchivoCertificado.objects.count() == 1
+
+    response = client.post('/api/matriculas/estudiante/crear/', {
+        "nombre": "Juan Perez", "dni": "12345678", "fecha_nacimiento": "2000-01-01",
+        "grado": "5to Primaria", "direccion": "Calle 123", "certificado_subida": response.data["id"]
+    })
+    assert response.status_code == 200
+    estudiante = Estudiante.objects.get()
+    assert estudiante.certificado_archivo == archivo
+    assert estudiante.certificado_estudios.name == archivo.archivo.name
+
+def cliente_con_token(user):
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+    return client
+
+@pytest.mark.django_db(transaction=True)
+def test_autenticacion_jwt_sin_consultas_con_cache(django_assert_num_queries):
+    user = User.objects.create_user(username="testuser", password="testpass")
+    client = cliente_con_token(user)
+
+    with django_assert_num_queries(1):
+        assert client.get('/api/matriculas/role/').data == {"role": "authenticated"}
+    with django_assert_num_queries(0):
+        assert client.get('/api/matriculas/role/').data == {"role": "authenticated"}
+
+    user.is_staff = True
+    user.save()
+    assert client.get('/api/matriculas/role/').data == {"role": "is_staff"}
+
+    user.is_active = False
+    user.save()
+    assert client.get('/api/matriculas/role/').status_code == 401
+
+@pytest.mark.django_db(transaction=True)
+def test_usuario_de_cache_se_guarda_sin_perder_la_contrasena():
+    user = User.objects.create_user(username="testuser", password="testpass")
+    client = cliente_con_token(user)
+    client.get('/api/matriculas/role/')
+
+    response = client.put('/api/matriculas/perfil/', {"username": "nuevo"})
+    assert response.status_code == 200
+    user.refresh_from_db()
+    assert user.username == "nuevo"
+    assert user.check_password("testpass")
+
+    from django.db import transaction
+    from matriculas.authentication import cache_usuarios
+
+    with transaction.atomic():
+        user.set_password("otra")
+        user.save()
+        # Una petición concurrente que lee antes del commit guarda la fila anterior
+        client.get('/api/matriculas/role/')
+        assert cache_usuarios.obtener(user.id) is not None
+    assert cache_usuarios.obtener(user.id) is None
+
+@pytest.mark.django_db
+def test_import_enrollments_crea_filas_y_reporta_rechazadas(settings, tmp_path):
+    import csv
+    from django.core.management import call_command
+
+    settings.PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+    User.objects.create(username="existente")
+    archivo = tmp_path / "alumnos.csv"
+    with open(archivo, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["username", "email", "password", "nombre", "dni", "fecha_nacimiento", "grado", "direccion", "curso"])
+        writer.writerow(["ana", "ana@example.com", "clave1", "Ana", "11111111", "2001-02-03", "5to", "Calle 1", "Historia"])
+        writer.writerow(["beto", "beto@example.com", "clave2", "Beto", "22222222", "2002-03-04", "5to", "Calle 2", ""])
+        writer.writerow(["carla", "carla@example.com", "clave3", "Carla", "33333333", "03/04/2002", "5to", "Calle 3", ""])
+        writer.writerow(["existente", "e@example.com", "clave4", "E", "44444444", "2002-03-04", "5to", "Calle 4", ""])
+        writer.writerow(["ana", "ana2@example.com", "clave5", "Ana", "55555555", "2002-03-04", "5to", "Calle 5", ""])
+
+    rechazados = tmp_path / "rechazados.csv"
+    call_command("import_enrollments", str(archivo), "--lote", "2", "--procesos", "2", "--rechazados", str(rechazados))
+
+    assert User.objects.get(username="ana").check_password("clave1")
+    assert Estudiante.objects.count() == 2
+    assert Matricula.objects.get(estudiante__usuario__username="ana").curso == "Historia"
+    assert Matricula.objects.get(estudiante__usuario__username="beto").estado == "Pendiente"
+    # El pago se crea con su PaymentIntent al pagar (ver test_estudiante_importado_sin_intent_puede_pagar)
+    assert not Pago.objects.exists()
+    assert PerfilUsuario.objects.count() == 2
+    filas = [(fila["fila"], fila["username"]) for fila in csv.DictReader(open(rechazados))]
+    assert filas == [("4", "carla"), ("5", "existente"), ("6", "ana")]
+
+@pytest.mark.django_db
+def test_import_enrollments_valida_con_los_campos_del_modelo(settings, tmp_path):
+    import csv
+    from django.core.management import call_command
+    from matriculas.resumen import totales_guardados, totales_reales
+
+    settings.PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+    archivo = tmp_path / "alumnos.csv"
+    base = {"username": "ok", "email": "ok@example.com", "password": "clave", "nombre": "Ana", "dni": "11111111",
+            "fecha_nacimiento": "2001-02-03", "grado": "5to", "direccion": "Calle 1", "curso": "", "monto": ""}
+    malas = [
+        {"username": "u" * 151}, {"username": "ana maria!"}, {"email": "no-es-email"}, {"nombre": "n" * 101},
+        {"grado": "g" * 51}, {"curso": "c" * 101}, {"monto": "123456789012.50"}, {"dni": "123456789"},
+    ]
+    with open(archivo, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(base))
+        writer.writeheader()
+        for i, cambios in enumerate(malas):
+            writer.writerow({**base, "username": f"malo{i}", **cambios})
+        writer.writerow(base)
+
+    rechazados = tmp_path / "rechazados.csv"
+    call_command("import_enrollments", str(archivo), "--procesos", "1", "--rechazados", str(rechazados))
+
+    assert list(User.objects.values_list("username", flat=True)) == ["ok"]
+    motivos = [fila["motivo"] for fila in csv.DictReader(open(rechazados))]
+    assert [motivo.split(":")[0] for motivo in motivos] == [
+        "username", "username", "email", "nombre", "grado", "curso", "monto", "dni"
+    ]
+    assert totales_guardados() == totales_reales()
+
+@pytest.mark.django_db
+def test_import_enrollments_aisla_las_filas_que_rechaza_la_base_de_datos(settings, tmp_path, monkeypatch):
+    import csv
+    from django.core.management import call_command
+    from django.db import IntegrityError
+    from matriculas.management.commands import import_enrollments
+
+    settings.PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+    crear_lote = import_enrollments.Command._crear_lote
+
+    def crear_lote_con_fallo(self, filas):
+        # Como si otro proceso hubiera creado 'beto' después de la validación
+        if any(d["username"] == "beto" for d in filas):
+            raise IntegrityError("UNIQUE constraint failed: auth_user.username")
+        return crear_lote(self, filas)
+
+    monkeypatch.setattr(import_enrollments.Command, "_crear_lote", crear_lote_con_fallo)
+    archivo = tmp_path / "alumnos.csv"
+    with open(archivo, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["username", "email", "password", "nombre", "dni", "fecha_nacimiento", "grado", "direccion"])
+        for i, username in enumerate(["ana", "beto", "carla"]):
+            writer.writerow([username, f"{username}@example.com", "clave", username, f"{i:08d}", "2001-02-03", "5to", "Calle"])
+
+    rechazados = tmp_path / "rechazados.csv"
+    call_command("import_enrollments", str(archivo), "--procesos", "1", "--rechazados", str(rechazados))
+    assert sorted(User.objects.values_list("username", flat=True)) == ["ana", "carla"]
+    assert [(fila["fila"], fila["username"]) for fila in csv.DictReader(open(rechazados))] == [("3", "beto")]
+
+@pytest.fixture
+def servidor_stripe(monkeypatch):
+    from matriculas.fake_stripe import ServidorStripeFalso
+
+    with ServidorStripeFalso() as servidor:
+        monkeypatch.setattr(stripe, "api_base", servidor.url)
+        monkeypatch.setattr(stripe, "api_key", "sk_test_fake")
+        yield servidor
+
+def ejecutar_peticiones_async(*peticiones):
+    import asyncio
+
+    async def todas():
+        return await asyncio.gather(*peticiones)
+
+    return asyncio.run(todas())
+
+@pytest.mark.django_db(transaction=True)
+def test_vistas_async_atienden_peticiones_concurrentes(servidor_stripe):
+    import time
+    from django.test import AsyncClient
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    servidor_stripe.latencia = 0.3
+    crear_matriculas(40)
+    for pago in Pago.objects.all():
+        pago.stripe_payment_intent_id = servidor_stripe.crear_intent(10000)["id"]
+        pago.save()
+
+    client = AsyncClient()
+    peticiones = [
+        client.post(
+            f'/api/matriculas/async/pago/confirmar/{pago.stripe_payment_intent_id}/',
+            headers={"Authorization": f"Bearer {AccessToken.for_user(pago.matricula.estudiante.usuario)}"}
+        )
+        for pago in Pago.objects.select_related('matricula__estudiante__usuario')
+    ]
+
+    inicio = time.perf_counter()
+    respuestas = ejecutar_peticiones_async(*peticiones)
+    transcurrido = time.perf_counter() - inicio
+
+    assert [r.status_code for r in respuestas] == [400] * 40
+    assert servidor_stripe.llamadas["retrieve"] == 40
+    # En serie serían 40 * 0.3 s = 12 s
+    assert transcurrido < 3
+
+@pytest.mark.django_db(transaction=True)
+def test_vistas_async_crear_estudiante_y_timeout(servidor_stripe, settings):
+    from django.test import AsyncClient
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    user = User.objects.create(username="testuser")
+    client = AsyncClient()
+    auth = {"Authorization": f"Bearer {AccessToken.for_user(user)}"}
+
+    response, = ejecutar_peticiones_async(client.post('/api/matriculas/async/estudiante/crear/', {
+        "nombre": "Juan Perez", "dni": "12345678", "fecha_nacimiento": "2000-01-01",
+        "grado": "5to Primaria", "direccion": "Calle 123"
+    }, headers=auth))
+    assert response.status_code == 200
+    assert response.json()["client_secret"].startswith(response.json()["payment_intent_id"])
+    assert Pago.objects.get().client_secret == response.json()["client_secret"]
+
+    for _ in range(2):
+        reintento, = ejecutar_peticiones_async(client.post('/api/matriculas/async/estudiante/crear/', {
+            "nombre": "Juan Perez", "dni": "12345678", "fecha_nacimiento": "2000-01-01",
+            "grado": "5to Primaria", "direccion": "Calle 123"
+        }, headers={**auth, "Idempotency-Key": "clave-1"}))
+        assert reintento.json() == response.json()
+    assert servidor_stripe.llamadas["create"] == 1
+
+    response, = ejecutar_peticiones_async(client.get('/api/matriculas/async/check-student/', headers=auth))
+    assert response.json()["has_student"] is True
+
+    settings.STRIPE_TIMEOUT = 0.1
+    servidor_stripe.latencia = 0.5
+    intent_id = Pago.objects.get().stripe_payment_intent_id
+    response, = ejecutar_peticiones_async(client.post(f'/api/matriculas/async/pago/confirmar/{intent_id}/', headers=auth))
+    assert response.status_code == 504
+
+    assert ejecutar_peticiones_async(AsyncClient().get('/api/matriculas/async/check-student/'))[0].status_code == 401
+
+@pytest.mark.django_db
+def test_limite_token_bucket_por_ip_usuario_y_alcance(settings, tmp_path, monkeypatch):
+    from matriculas import throttling
+
+    # Caché en archivos, como la que compartirían varios workers en una máquina
+    settings.CACHES = {**settings.CACHES, "limites": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": str(tmp_path)
+    }}
+    settings.LIMITES_CACHE = "limites"
+    settings.LIMITES_PETICIONES = {"token": (2, 0.5), "estado": (3, 1)}
+    ahora = [1000.0]
+    monkeypatch.setattr(throttling.time, "time", lambda: ahora[0])
+
+    User.objects.create_user(username="testuser", password="testpass")
+    client = APIClient()
+    credenciales = {"username": "testuser", "password": "incorrecta"}
+    assert [client.post('/api/token/', credenciales).status_code for _ in range(3)] == [401, 401, 429]
+    response = client.post('/api/token/', credenciales)
+    assert response["Retry-After"] == "2"
+    # Otra IP tiene su propio cubo
+    assert client.post('/api/token/', credenciales, REMOTE_ADDR="10.0.0.2").status_code == 401
+
+    ahora[0] += 2
+    assert client.post('/api/token/', {**credenciales, "password": "testpass"}).status_code == 200
+    assert client.post('/api/token/', credenciales).status_code == 429
+
+    from django.test import AsyncClient
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    user = User.objects.get(username="testuser")
+    client = cliente_con_token(user)
+    auth = {"Authorization": f"Bearer {AccessToken.for_user(user)}"}
+    # Las vistas del alcance 'estado', síncronas o asíncronas, comparten el cubo del usuario
+    assert [client.get('/api/matriculas/check-student/').status_code for _ in range(2)] == [200, 200]
+    assert ejecutar_peticiones_async(AsyncClient().get('/api/matriculas/async/check-student/', headers=auth))[0].status_code == 200
+    assert client.get('/api/matriculas/estudiante/verificar/').status_code == 429
+    respuesta, = ejecutar_peticiones_async(AsyncClient().get('/api/matriculas/async/estudiante/verificar/', headers=auth))
+    assert (respuesta.status_code, respuesta["Retry-After"]) == (429, "1")
+    ahora[0] += 1
+    assert client.get('/api/matriculas/estudiante/verificar/').status_code == 200
+    # Sin alcance configurado no se limita
+    assert client.post('/api/matriculas/registro/', {}).status_code == 400
+
+@pytest.fixture
+def metricas():
+    from matriculas import metricas
+
+    for histograma in metricas.HISTOGRAMAS:
+        histograma.limpiar()
+    return metricas
+
+@pytest.mark.django_db
+def test_metricas_por_vista_con_consultas_y_stripe(metricas, servidor_stripe):
+    from matriculas.metricas import ClienteHTTPMedido
+
+    crear_matriculas(30)
+    client = cliente_con_token(User.objects.create(username="admin", is_staff=True))
+    assert client.get('/api/matriculas/').status_code == 200
+
+    intent = servidor_stripe.crear_intent(10000, status='succeeded')
+    Pago.objects.filter(pk=Pago.objects.first().pk).update(stripe_payment_intent_id=intent['id'])
+    assert client.post(f"/api/matriculas/pago/confirmar/{intent['id']}/").status_code == 200
+
+    texto = APIClient().get('/metrics').content.decode()
+    assert 'matriculas_peticion_segundos_count{vista="matricula_list",metodo="GET"} 1' in texto
+    # El listado no depende del número de filas (sin N+1)
+    consultas = metricas.PETICION_CONSULTAS_DB._series[('matricula_list', 'GET')][1]
+    assert consultas <= 4
+    assert metricas.PETICION_SERIALIZACION_SEGUNDOS._series[('matricula_list', 'GET')][1] > 0
+    assert 'matriculas_peticion_llamadas_stripe_sum{vista="confirmar_pago",metodo="POST"} 1.0' in texto
+    assert metricas.STRIPE_LLAMADA_SEGUNDOS.muestras('GET /v1/payment_intents/:id') == 1
+    # Se mide con el cliente HTTP propio; el global de stripe queda como estaba
+    assert not isinstance(stripe.default_http_client, ClienteHTTPMedido)
+    assert APIClient().get('/metrics/').status_code == 200
+
+@pytest.mark.django_db
+def test_metricas_token_y_peticiones_lentas(metricas, settings, caplog):
+    settings.METRICAS_TOKEN = 'secreto'
+    assert APIClient().get('/metrics').status_code == 401
+    assert APIClient().get('/metrics', HTTP_AUTHORIZATION='Bearer secreto').status_code == 200
+
+    settings.PETICION_LENTA_MS = 0.001
+    client = cliente_con_token(User.objects.create(username="admin", is_staff=True))
+    with caplog.at_level('WARNING', logger='matriculas.peticiones_lentas'):
+        client.get('/api/matriculas/')
+    assert 'Petición lenta GET /api/matriculas/ (matricula_list)' in caplog.text
+    assert 'SELECT' in caplog.text
+
+@pytest.mark.django_db
+def test_token_incluye_rol_y_avatar_y_se_actualiza_al_refrescar(django_assert_num_queries, django_capture_on_commit_callbacks):
+    from rest_framework_simplejwt.tokens import AccessToken
+    from matriculas.models import PerfilUsuario
+    from matriculas.roles import rol_de_peticion
+
+    user = User.objects.create_user(username="alumno", password="clave-segura")
+    PerfilUsuario.objects.create(usuario=user, foto_perfil="fotos_perfil/a.png")
+    tokens = APIClient().post('/api/token/', {"username": "alumno", "password": "clave-segura"}).data
+    claims = AccessToken(tokens["access"])
+    assert (claims["username"], claims["rol"], claims["is_staff"]) == ("alumno", "authenticated", False)
+    assert claims["avatar"] == "/media/fotos_perfil/a.png"
+
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens["access"]}')
+    client.get('/api/matriculas/role/')
+    with django_assert_num_queries(0):
+        assert client.get('/api/matriculas/role/').data == {"role": "authenticated"}
+
+    User.objects.filter(pk=user.pk).update(is_staff=True)
+    PerfilUsuario.objects.filter(usuario=user).update(variantes_foto={"miniatura": "fotos_perfil/a_min.webp"})
+    access = APIClient().post('/api/token/refresh/', {"refresh": tokens["refresh"]}).data["access"]
+    claims = AccessToken(access)
+    assert (claims["rol"], claims["is_staff"], claims["avatar"]) == ("is_staff", True, "/media/fotos_perfil/a_min.webp")
+
+    request = type("Peticion", (), {"auth": claims, "user": user})()
+    assert rol_de_peticion(request) == "is_staff"
+
+    # /role/ no se fía de los claims: quitar el rol se refleja aunque el token diga 'is_staff'
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+    with django_capture_on_commit_callbacks(execute=True):
+        user.refresh_from_db()
+        user.is_staff = False
+        user.save()
+    assert client.get('/api/matriculas/role/').data == {"role": "authenticated"}
+
+    User.objects.filter(pk=user.pk).update(is_active=False)
+    assert APIClient().post('/api/token/refresh/', {"refresh": tokens["refresh"]}).status_code == 401
+
+@pytest.fixture
+def replica(settings, tmp_path):
+    """Segunda base SQLite que hace de réplica, con el esquema creado a mano (no se migra)."""
+    from django.db import connections
+    from matriculas.models import ArchivoCertificado, Estudiante
+
+    alias = 'replica'
+    configuracion = {**connections['default'].settings_dict, 'NAME': str(tmp_path / 'replica.sqlite3')}
+    connections.settings[alias] = configuracion
+    settings.DATABASES = {**settings.DATABASES, alias: configuracion}
+    settings.DATABASE_REPLICAS = [alias]
+    # La clase de pruebas solo deja abrir conexiones a los alias que conocía al empezar
+    connections[alias].connect()
+    with connections[alias].schema_editor() as editor:
+        for modelo in (User, ArchivoCertificado, Estudiante, Matricula, Pago):
+            editor.create_model(modelo)
+    yield alias
+    connections[alias].close()
+    del connections[alias]
+    del connections.settings[alias]
+
+@pytest.mark.django_db
+def test_listados_de_admin_leen_de_la_replica(replica):
+    from matriculas.db_router import lecturas_en_replica
+
+    crear_matriculas(2)
+    user = User.objects.using(replica).create(id=50, username="solo_en_replica")
+    estudiante = Estudiante.objects.using(replica).create(
+        usuario=user, nombre="Réplica", dni="99999999", fecha_nacimiento="2000-01-01", grado="5to", direccion="-"
+    )
+    Matricula.objects.using(replica).create(estudiante=estudiante, curso="Curso Réplica")
+
+    client = cliente_con_token(User.objects.create(username="admin", is_staff=True))
+    for url in ['/api/matriculas/', '/api/matriculas/?page_size=10']:
+        datos = client.get(url).json()
+        filas = datos['results'] if 'results' in datos else datos
+        assert [m['estudiante']['nombre'] for m in filas] == ["Réplica"]
+    exportado = b''.join(client.get('/api/matriculas/exportar/?formato=ndjson').streaming_content)
+    assert exportado.count(b'\n') == 1 and "Réplica".encode() in exportado
+
+    # El resto del tráfico y las lecturas tras una escritura van al primario
+    assert Matricula.objects.count() == 2
+    with lecturas_en_replica():
+        assert Matricula.objects.count() == 1
+        Matricula.objects.filter(pk=1).update(estado='Aprobado')
+        assert Matricula.objects.count() == 2
+    with lecturas_en_replica():
+        assert Matricula.objects.select_for_update().filter(estado='Aprobado').count() == 1
+        assert Matricula.objects.count() == 2
+
+@pytest.mark.django_db
+def test_busqueda_por_nombre_sin_tildes_y_por_dni_con_cursor():
+    crear_matriculas(3)
+    nombres = ["José Pérez", "JOSEFINA Núñez", "María José"]
+    for estudiante, nombre in zip(Estudiante.objects.order_by('id'), nombres):
+        estudiante.nombre = nombre
+        estudiante.save(update_fields=['nombre'])
+    assert Estudiante.objects.get(nombre="JOSEFINA Núñez").nombre_busqueda == "josefina nunez"
+    Matricula.objects.filter(estudiante__nombre="José Pérez").update(estado='Aprobado')
+
+    client = cliente_con_token(User.objects.create(username="admin", is_staff=True))
+
+    def buscar(**params):
+        datos = client.get('/api/matriculas/buscar/', params).json()
+        return [m['estudiante']['nombre'] for m in datos['results']], datos['next']
+
+    assert buscar(q="JOSE")[0] == ["José Pérez", "JOSEFINA Núñez"]
+    assert buscar(q="jose", estado="Aprobado")[0] == ["José Pérez"]
+    assert buscar(q="maria  jo")[0] == ["María José"]
+
+    dni = Estudiante.objects.get(nombre="María José").dni
+    assert buscar(q=dni)[0] == ["María José"]
+
+    primera, siguiente = buscar(q="jose", page_size=1)
+    assert primera == ["José Pérez"] and siguiente
+    datos = client.get(siguiente).json()
+    assert [m['estudiante']['nombre'] for m in datos['results']] == ["JOSEFINA Núñez"]
+
+    assert cliente_con_token(User.objects.create(username="alumno")).get('/api/matriculas/buscar/').status_code == 403
+
+@pytest.mark.django_db
+def test_busqueda_por_prefijos_que_terminan_en_z_o_9():
+    from matriculas.busqueda import buscar_matriculas
+
+    crear_matriculas(3)
+    for estudiante, (nombre, dni) in zip(Estudiante.objects.order_by('id'), [
+        ("Pérez Díaz", "45670891"), ("Perfecto López", "45670900"), ("Diaz", "45670899"),
+    ]):
+        estudiante.nombre, estudiante.dni = nombre, dni
+        estudiante.save(update_fields=['nombre', 'dni'])
+
+    def nombres(q):
+        return [m.estudiante.nombre for m in buscar_matriculas({'q': q}).order_by('orden')]
+
+    assert nombres("perez") == ["Pérez Díaz"]
+    assert nombres("DÍAZ") == ["Diaz"]
+    assert nombres("4567089") == ["Pérez Díaz", "Diaz"]
+    assert nombres("45670899") == ["Diaz"]
+    # Solo LIKE 'prefijo%' sobre la columna indexada, sin un límite superior calculado
+    sql = str(buscar_matriculas({'q': "perez"}).query)
+    assert "LIKE" in sql and " < " not in sql
+
+@pytest.mark.django_db
+def test_resumen_del_panel_se_mantiene_en_cada_cambio(django_assert_num_queries):
+    from decimal import Decimal
+    from io import StringIO
+    from django.core.management import call_command
+    from matriculas.estados import verificar_en_lote
+    from matriculas.pagos import confirmar_pago, registrar_fallo_pago
+    from matriculas.resumen import obtener_resumen, totales_guardados, totales_reales
+
+    crear_matriculas(5)
+    matriculas = list(Matricula.objects.order_by('id'))
+    confirmar_pago("pi_0")
+    confirmar_pago("pi_0")
+    registrar_fallo_pago("pi_1")
+    verificar_en_lote('Rechazado', ids=[matriculas[0].id])
+
+    client = cliente_con_token(User.objects.create(username="admin", is_staff=True))
+    client.patch(f'/api/matriculas/{matriculas[2].id}/verificar/', {"estado": "Aprobado"}, format='json')
+    matriculas[3].monto = Decimal("250.00")
+    matriculas[3].save()
+    matriculas[4].delete()
+
+    assert totales_guardados() == totales_reales()
+    with django_assert_num_queries(1):
+        resumen = obtener_resumen()
+    assert resumen == {
+        "matriculas_por_estado": {"Aprobado": 1, "Pendiente": 2, "Rechazado": 1},
+        "total_matriculas": 4,
+        "pagos_por_estado": {"Completado": 1, "Fallido": 1, "Pendiente": 2},
+        "monto_pagado": Decimal("100.00"),
+        "monto_pendiente": Decimal("450.00"),
+        "tasa_conversion": 0.25,
+    }
+    assert client.get('/api/matriculas/resumen/').json()["total_matriculas"] == 4
+
+    # Un cambio hecho por fuera (sin pasar por el código) se corrige con el comando
+    Matricula.objects.filter(pk=matriculas[1].pk).update(estado='Aprobado')
+    salida = StringIO()
+    call_command('reconstruir_resumen', stdout=salida)
+    assert 'claves desviadas: 2' in salida.getvalue()
+    assert obtener_resumen()["matriculas_por_estado"] == {"Aprobado": 2, "Pendiente": 1, "Rechazado": 1}
+
+@pytest.mark.django_db
+def test_transiciones_de_la_verificacion_sin_leer_ni_bloquear_la_fila():
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from matriculas.estados import cambiar_estado
+    from matriculas.pagos import confirmar_pago
+    from matriculas.resumen import totales_guardados, totales_reales
+
+    crear_matriculas(3)
+    matricula, pagada, otra = Matricula.objects.order_by('id')
+    client = APIClient()
+    client.force_authenticate(user=User.objects.create(username="admin", is_staff=True))
+    url = f'/api/matriculas/{matricula.id}/verificar/'
+
+    # El administrador puede cambiar de decisión
+    assert client.patch(url, {"estado": "Rechazado"}, format='json').status_code == 200
+    assert client.patch(url, {"estado": "Aprobado"}, format='json').status_code == 200
+    assert client.patch(url, {"estado": "Rechazado"}, format='json').status_code == 200
+
+    # Una confirmación que no puede mover la matrícula no deshace el cambio del pago
+    confirmar_pago("pi_0")
+    assert (Matricula.objects.get(pk=matricula.pk).estado, Pago.objects.get(matricula=matricula).estado) == ("Rechazado", "Completado")
+
+    # El cambio es un UPDATE condicional; el estado previo y el monto no se leen antes
+    with CaptureQueriesContext(connection) as consultas:
+        assert cambiar_estado(Matricula, otra.pk, 'Pagado') == 'Pendiente'
+    assert all(c["sql"].startswith(('UPDATE', 'INSERT')) for c in consultas.captured_queries)
+    assert sum(c["sql"].startswith('UPDATE "matriculas_matricula"') for c in consultas.captured_queries) == 1
+
+    # Una matrícula pagada no vuelve a 'Pendiente', tampoco después de aprobarla o rechazarla
+    confirmar_pago("pi_1")
+    for estado in ("Aprobado", "Rechazado"):
+        assert client.patch(f'/api/matriculas/{pagada.id}/verificar/', {"estado": estado}, format='json').status_code == 200
+        response = client.patch(f'/api/matriculas/{pagada.id}/verificar/', {"estado": "Pendiente"}, format='json')
+        assert (response.status_code, response.data["estado_actual"]) == (409, estado)
+    assert client.patch(url, {"estado": "Pendiente"}, format='json').status_code == 409
+    assert totales_guardados() == totales_reales()
+
+
+@pytest.mark.django_db
+def test_verificacion_en_lote_repite_fila_a_fila_si_el_bloque_cambio(monkeypatch):
+    from matriculas import estados
+    from matriculas.resumen import totales_guardados, totales_reales
+
+    crear_matriculas(4)
+    ids = list(Matricula.objects.order_by('id').values_list('id', flat=True))
+    for i in ids:
+        estados.cambiar_estado(Matricula, i, 'Pagado')
+
+    # Otra petición aprueba una matrícula entre la lectura del bloque y su UPDATE
+    pasar_grupo = estados._pasar_grupo
+
+    def con_cambio_concurrente(filas, grupo, nuevo):
+        estados.cambiar_estado(Matricula, grupo[1], 'Rechazado')
+        return pasar_grupo(filas, grupo, nuevo)
+
+    monkeypatch.setattr(estados, "_pasar_grupo", con_cambio_concurrente)
+    resultados = estados.verificar_en_lote('Aprobado', ids=ids)
+    assert [r['resultado'] for r in resultados] == ['actualizada', 'estado_invalido', 'actualizada', 'actualizada']
+    assert list(Matricula.objects.order_by('id').values_list('estado', flat=True)) == ['Aprobado', 'Rechazado', 'Aprobado', 'Aprobado']
+    assert totales_guardados() == totales_reales()
+@pytest.fixture
+def base_para_hilos(tmp_path):
+    """
+    Con SQLite, 'default' pasa a una base en archivo durante la prueba: la base en memoria de
+    las pruebas bloquea tablas enteras entre conexiones y las peticiones paralelas fallarían.
+    Con transacciones IMMEDIATE los hilos esperan su turno para escribir. En otros motores
+    no cambia nada.
+    """
+    from django.db import connection, connections
+    from matriculas.models import ArchivoCertificado, ContadorResumen, NotificacionEmail
+
+    if connection.vendor != 'sqlite':
+        yield
+        return
+
+    original, configuracion_original = connections['default'], connections.settings['default']
+    connections.settings['default'] = {
+        **configuracion_original, 'NAME': str(tmp_path / 'hilos.sqlite3'),
+        'OPTIONS': {**configuracion_original['OPTIONS'], 'transaction_mode': 'IMMEDIATE', 'timeout': 30},
+    }
+    connections['default'] = connections.create_connection('default')
+    with connections['default'].schema_editor() as editor:
+        for modelo in (User, ArchivoCertificado, Estudiante, Matricula, Pago, ContadorResumen, NotificacionEmail):
+            editor.create_model(modelo)
+    yield
+    connections['default'].close()
+    connections.settings['default'] = configuracion_original
+    connections['default'] = original
+
+@pytest.mark.django_db(transaction=True)
+def test_confirmacion_y_verificacion_concurrentes_no_se_sobrescriben(base_para_hilos, fake_stripe):
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+    from django.db import connection
+    from matriculas.models import NotificacionEmail
+    from matriculas.resumen import totales_guardados, totales_reales
+
+    crear_matriculas(30)
+    for pago in Pago.objects.all():
+        fake_stripe.retrieve(pago.stripe_payment_intent_id)
+        fake_stripe.intents[pago.stripe_payment_intent_id]["status"] = "succeeded"
+    admin = User.objects.create(username="admin", is_staff=True)
+    matriculas = list(Matricula.objects.select_related('estudiante__usuario').order_by('id'))
+    decisiones = {m.id: "Aprobado" if m.id % 2 else "Rechazado" for m in matriculas}
+
+    def confirmar(matricula):
+        client = APIClient()
+        client.force_authenticate(user=matricula.estudiante.usuario)
+        return client.post(f'/api/matriculas/pago/confirmar/pi_{matricula.estudiante.usuario.username[6:]}/')
+
+    def verificar(matricula, estado):
+        client = APIClient()
+        client.force_authenticate(user=admin)
+        return client.patch(f'/api/matriculas/{matricula.id}/verificar/', {"estado": estado}, format='json')
+
+    peticiones = [(confirmar, m) for m in matriculas for _ in range(2)]
+    peticiones += [(verificar, m, decisiones[m.id]) for m in matriculas for _ in range(2)]
+    # Reabrir compite con la decisión: según el orden se aplica o da conflicto
+    peticiones += [(verificar, m, "Pendiente") for m in matriculas[:10]]
+    random.Random(0).shuffle(peticiones)
+
+    def ejecutar(peticion):
+        try:
+            return peticion[0], peticion[1].id, peticion[0](*peticion[1:])
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        respuestas = list(pool.map(ejecutar, peticiones))
+
+    assert {r.status_code for funcion, _, r in respuestas if funcion is confirmar} == {200}
+    assert {r.status_code for funcion, _, r in respuestas if funcion is verificar} <= {200, 409}
+    assert set(Pago.objects.values_list('estado', flat=True)) == {"Completado"}
+    # Una decisión del administrador nunca vuelve a 'Pagado'
+    for matricula_id, estado in Matricula.objects.filter(id__in=[m.id for m in matriculas[10:]]).values_list('id', 'estado'):
+        assert estado == decisiones[matricula_id]
+    # Las reabiertas quedan en la decisión, en 'Pendiente' o, si la confirmación llegó después, en 'Pagado'
+    for matricula_id, estado in Matricula.objects.filter(id__in=[m.id for m in matriculas[:10]]).values_list('id', 'estado'):
+        assert estado in (decisiones[matricula_id], "Pendiente", "Pagado")
+    # Un correo por cada aprobación aplicada, sin duplicados por los reintentos
+    aprobaciones = NotificacionEmail.objects.count()
+    assert aprobaciones >= len([m for m in matriculas[10:] if decisiones[m.id] == "Aprobado"])
+    assert totales_guardados() == totales_reales()
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("modo", ["listar", "consultar"])
+def test_reconcile_payments_corrige_pendientes_en_bloque(servidor_stripe, modo):
+    from io import StringIO
+    from django.core.management import call_command
+    from matriculas.estados import verificar_en_lote
+    from matriculas.pagos import registrar_fallo_pago
+    from matriculas.resumen import totales_guardados, totales_reales
+
+    crear_matriculas(150)
+    estados_stripe = ("succeeded", "canceled", "requires_payment_method")
+    for i in range(149):  # pi_149 no existe en Stripe
+        servidor_stripe.intents[f"pi_{i}"] = {"id": f"pi_{i}", "object": "payment_intent",
+                                              "amount": 10000, "status": estados_stripe[i % 3]}
+    servidor_stripe.intents["pi_1"]["amount"] = 5000
+    servidor_stripe.crear_intent(10000)  # de otra matrícula: se ignora
+    verificar_en_lote("Aprobado", ids=[Matricula.objects.get(pago__stripe_payment_intent_id="pi_0").id])
+    registrar_fallo_pago("pi_3")  # fallido aquí, cobrado en Stripe
+    registrar_fallo_pago("pi_4")  # fallido en los dos
+
+    salida = StringIO()
+    call_command("reconcile_payments", "--modo", modo, "--simular", stdout=salida)
+    assert "Se corregirían: 50 a Completado, 49 a Fallido; sin cambios: 50" in salida.getvalue()
+    assert Pago.objects.filter(estado="Pendiente").count() == 148
+
+    servidor_stripe.llamadas.clear()
+    salida = StringIO()
+    call_command("reconcile_payments", "--modo", modo, "--hilos", "4", stdout=salida)
+    salida = salida.getvalue()
+    # Una página por cada 100 intents, o un retrieve por pago repartido entre los hilos
+    assert servidor_stripe.llamadas == (Counter(list=2) if modo == "listar" else Counter(retrieve=150))
+    assert "Corregidos: 50 a Completado, 49 a Fallido; sin cambios: 50, cambiados mientras tanto: 0" in salida
+    assert "No encontrados en Stripe: 1 (pi_149)" in salida
+    assert "Con importe distinto al de la matrícula: 1 (pi_1)" in salida
+
+    estados = dict(Pago.objects.values_list("stripe_payment_intent_id", "estado"))
+    assert [estados[f"pi_{i}"] for i in (0, 1, 2, 3, 4, 149)] == [
+        "Completado", "Fallido", "Pendiente", "Completado", "Fallido", "Pendiente"
+    ]
+    matriculas = dict(Matricula.objects.values_list("pago__stripe_payment_intent_id", "estado"))
+    # Una matrícula ya aprobada no vuelve a 'Pagado'
+    assert [matriculas[f"pi_{i}"] for i in (0, 1, 2, 3)] == ["Aprobado", "Pendiente", "Pendiente", "Pagado"]
+    assert list(matriculas.values()).count("Pagado") == 49
+    assert totales_guardados() == totales_reales()
+
+    # Una segunda pasada no encuentra nada que corregir
+    salida = StringIO()
+    call_command("reconcile_payments", "--modo", modo, stdout=salida)
+    assert "revisados: 100" in salida.getvalue()
+    assert "Corregidos: 0 a Completado, 0 a Fallido" in salida.getvalue()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_migracion_del_intent_unico_no_pierde_pagos_repetidos():
+    from datetime import date
+    from django.db import connection
+    from django.db.migrations.executor import MigrationExecutor
+
+    antes, despues = [('matriculas', '0005_notificacionemail')], [('matriculas', '0006_indices_consultas')]
+    executor = MigrationExecutor(connection)
+    ultima = executor.loader.graph.leaf_nodes('matriculas')
+    executor.migrate(antes)
+    try:
+        apps = MigrationExecutor(connection).loader.project_state(antes).apps
+        Estudiante_, Matricula_, Pago_ = (apps.get_model('matriculas', m) for m in ('Estudiante', 'Matricula', 'Pago'))
+        estudiante = Estudiante_.objects.create(
+            usuario_id=User.objects.create(username="migracion").id, nombre="Ana", dni="12345678",
+            fecha_nacimiento=date(2000, 1, 1), grado="1", direccion="x",
+        )
+        matricula = Matricula_.objects.create(estudiante=estudiante, curso="Matemáticas")
+        pagos = [Pago_.objects.create(matricula=matricula, stripe_payment_intent_id=i) for i in ('', '', 'pi_a', 'pi_a')]
+
+        with pytest.raises(RuntimeError, match=rf"pi_a: pagos {pagos[2].id}, {pagos[3].id}"):
+            MigrationExecutor(connection).migrate(despues)
+        assert Pago_.objects.filter(stripe_payment_intent_id='pi_a').count() == 2
+
+        Pago_.objects.filter(pk=pagos[3].pk).update(stripe_payment_intent_id=None)
+        MigrationExecutor(connection).migrate(despues)
+        assert list(Pago_.objects.order_by('id').values_list('stripe_payment_intent_id', flat=True)) == [None, None, 'pi_a', None]
+    finally:
+        MigrationExecutor(connection).migrate(ultima)
@@ -0,0 +1,109 @@
+"""
+Límite de peticiones por token bucket, compartido entre procesos a través de la caché.
+
+Cada vista indica su ``throttle_scope`` ('token', 'registro', 'estado') y
+settings.LIMITES_PETICIONES da para cada alcance la ráfaga y las fichas que se recargan
+por segundo. El cubo es por alcance y usuario (o IP si no hay sesión), así que las vistas
+del mismo alcance, síncronas o asíncronas, comparten el límite.
+
+Se guarda un solo valor por cubo, el instante teórico en que quedaría lleno (GCRA, que
+equivale a un token bucket). Con RedisCache la comprobación es un script Lua: atómica,
+con el reloj de Redis y en una sola ida y vuelta. Con las demás cachés se hace get + set,
+atómico solo dentro del proceso; sirve para desarrollo y pruebas, pero en producción
+debe configurarse CACHE_BACKEND con Redis para que el límite sea común a los workers.
+"""
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.throttling import BaseThrottle
+
+CACHE_PREFIX = 'limite:'
+
+# Devuelve los segundos a esperar ('0' si se admite la petición); como texto porque Redis
+# convierte los números de Lua a enteros
+SCRIPT_REDIS = """
+local t = redis.call('TIME')
+local ahora = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local intervalo = tonumber(ARGV[1])
+local limite = tonumber(ARGV[2])
+local lleno = math.max(tonumber(redis.call('GET', KEYS[1]) or ahora), ahora) + intervalo
+if lleno - ahora > limite then
+    return tostring(lleno - ahora - limite)
+end
+redis.call('SET', KEYS[1], tostring(lleno), 'PX', math.ceil((lleno - ahora) * 1000))
+return '0'
+"""
+
+_lock = threading.Lock()
+_script = None
+
+
+def _consumir_redis(cache, clave, intervalo, limite):
+    global _script
+    clave = cache.make_and_validate_key(clave)
+    cliente = cache._cache.get_client(clave, write=True)
+    if _script is None:
+        _script = cliente.register_script(SCRIPT_REDIS)
+    # EVALSHA; redis-py vuelve a cargar el script si el servidor no lo tiene
+    return float(_script(keys=[clave], args=[intervalo, limite], client=cliente))
+
+
+def _consumir_generico(cache, clave, intervalo, limite):
+    with _lock:
+        ahora = time.time()
+        lleno = max(cache.get(clave, ahora), ahora) + intervalo
+        if lleno - ahora > limite:
+            return lleno - ahora - limite
+        cache.set(clave, lleno, math.ceil(lleno - ahora))
+        return 0.0
+
+
+def consumir(clave, rafaga, recarga):
+    """
+    Toma una ficha del cubo ``clave``. Devuelve 0 si la petición se admite o los segundos
+    que faltan para que haya una ficha libre.
+    """
+    cache = caches[settings.LIMITES_CACHE]
+    intervalo = 1 / recarga
+    limite = rafaga * intervalo
+    clave = f'{CACHE_PREFIX}{clave}'
+    if isinstance(cache, RedisCache):
+        return _consumir_redis(cache, clave, intervalo, limite)
+    return _consumir_generico(cache, clave, intervalo, limite)
+
+
+def clave_de_cubo(alcance, ident):
+    """Clave del cubo de ``ident`` en el alcance; la usan las vistas de DRF y las asíncronas."""
+    return f'{alcance}:{ident}'
+
+
+def limite_de_alcance(alcance):
+    """(ráfaga, recarga) configurados para el alcance, o None si no se limita."""
+    limite = settings.LIMITES_PETICIONES.get(alcance) if alcance else None
+    if not limite or limite[0] <= 0 or limite[1] <= 0:
+        return None
+    return limite
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Throttle de DRF para las vistas con ``throttle_scope``. DRF responde 429 con Retry-After."""
+
+    def __init__(self):
+        self.espera = None
+
+    def allow_request(self, request, view):
+        limite = limite_de_alcance(getattr(view, 'throttle_scope', None))
+        if limite is None:
+            return True
+
+        user = request.user
+        ident = f'u{user.pk}' if user and user.is_authenticated else f'ip{self.get_ident(request)}'
+        self.espera = consumir(clave_de_cubo(view.throttle_scope, ident), *limite)
+        return not self.espera
+
+    def wait(self):
+        return self.espera
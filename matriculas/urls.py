@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import RegisterAPIView, UserRoleAPIView, MatriculaViewSet, MatriculaListAPIView, CrearEstudianteAPIView,  VerificarEstudianteAPIView, CheckStudentStatusAPIView, perfil_usuario, ConfirmarPagoAPIView # CrearMatriculaAPIView, CrearPagoAPIView, ConfirmarPagoAPIView,
+from .async_views import CrearEstudianteAsyncView, VerificarEstudianteAsyncView, CheckStudentStatusAsyncView, ConfirmarPagoAsyncView
+from .views import RegisterAPIView, UserRoleAPIView, MatriculaViewSet, MatriculaListAPIView, CrearEstudianteAPIView,  VerificarEstudianteAPIView, CheckStudentStatusAPIView, perfil_usuario, ConfirmarPagoAPIView, StripeWebhookAPIView, ExportarMatriculasAPIView, BuscarMatriculasAPIView, ResumenMatriculasAPIView, SubidaCertificadoAPIView, SubidaCertificadoDetalleAPIView, FinalizarSubidaAPIView # CrearMatriculaAPIView, CrearPagoAPIView, ConfirmarPagoAPIView,
 
 router = DefaultRouter()
 router.register(r'', MatriculaViewSet)
@@ -11,8 +12,19 @@ urlpatterns = [
     path('estudiante/verificar/', VerificarEstudianteAPIView.as_view(), name='verificar_estudiante'),
     path('check-student/', CheckStudentStatusAPIView.as_view(), name='check_student'),
     path('pago/confirmar/<str:payment_intent_id>/', ConfirmarPagoAPIView.as_view(), name='confirmar_pago'),
+    path('pago/webhook/', StripeWebhookAPIView.as_view(), name='stripe_webhook'),
+    path('async/estudiante/crear/', CrearEstudianteAsyncView.as_view(), name='crear_estudiante_async'),
+    path('async/estudiante/verificar/', VerificarEstudianteAsyncView.as_view(), name='verificar_estudiante_async'),
+    path('async/check-student/', CheckStudentStatusAsyncView.as_view(), name='check_student_async'),
+    path('async/pago/confirmar/<str:payment_intent_id>/', ConfirmarPagoAsyncView.as_view(), name='confirmar_pago_async'),
     path('perfil/', perfil_usuario, name='perfil_usuario'),
     path('role/', UserRoleAPIView.as_view(), name='user_role'),  
+    path('exportar/', ExportarMatriculasAPIView.as_view(), name='exportar_matriculas'),
+    path('buscar/', BuscarMatriculasAPIView.as_view(), name='buscar_matriculas'),
+    path('resumen/', ResumenMatriculasAPIView.as_view(), name='resumen_matriculas'),
+    path('certificados/subidas/', SubidaCertificadoAPIView.as_view(), name='subida_certificado'),
+    path('certificados/subidas/<uuid:pk>/', SubidaCertificadoDetalleAPIView.as_view(), name='subida_certificado_detalle'),
+    path('certificados/subidas/<uuid:pk>/finalizar/', FinalizarSubidaAPIView.as_view(), name='finalizar_subida_certificado'),
     path('', MatriculaListAPIView.as_view(), name='matricula_list'), 
     path('', include(router.urls)),
 
@@ -1,45 +1,66 @@
 import stripe
 from django.conf import settings
 from rest_framework import generics, status
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from .models import Estudiante, Matricula, Pago, PerfilUsuario
-from .serializers import RegisterSerializer, EstudianteSerializer, UsuarioSerializer, PerfilUsuarioSerializer, MatriculaSerializer
+from rest_framework_simplejwt.views import TokenObtainPairView
+from .models import Estudiante, Matricula, Pago, PerfilUsuario, SubidaCertificado
+from .serializers import RegisterSerializer, EstudianteSerializer, UsuarioSerializer, PerfilUsuarioSerializer, MatriculaSerializer, VerificacionLoteSerializer, SubidaCertificadoSerializer
+from .pagination import BusquedaCursorPagination, MatriculaCursorPagination
+from .stripe_client import cliente_stripe, obtener_client_secret, obtener_payment_intent
+from .estado_estudiante import ESTADOS_PAGO_PENDIENTE, obtener_estado_estudiante
+from .pagos import confirmar_pago, registrar_evento, procesar_evento
+from .estados import ESTADOS_VERIFICACION, TransicionNoPermitida, verificar_en_lote, verificar_matricula
+from .exportacion import FORMATOS, filas_exportacion
+from .media import puede_ver, respuesta_archivo
+from .subidas import ErrorSubida, finalizar_subida, iniciar_subida, recibir_parte
+from .metricas import exponer
+from .notificaciones import exponer_metricas_outbox
+from .roles import rol_de_usuario
+from .db_router import lecturas_en_replica
+from .busqueda import buscar_matriculas
+from .resumen import obtener_resumen
+from .throttling import TokenBucketThrottle
+from .renderers import JSONRapidoRenderer
+from .serializacion_rapida import filas_matriculas, serializar_matriculas
+from .inscripcion import con_idempotencia, falta_intent, guardar_pago, parametros_intent, preparar_inscripcion, respuesta_pago
+from django.shortcuts import get_object_or_404
 from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework import viewsets
-from django.core.mail import send_mail
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+import hmac
+import os
 
 class VerificarEstudianteAPIView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'estado'
 
     def get(self, request):
-        try:
-            estudiante = Estudiante.objects.get(usuario=request.user)
-            serializer = EstudianteSerializer(estudiante)
-            matricula = Matricula.objects.filter(estudiante=estudiante).first()
-            
-            if matricula:
-                pago = Pago.objects.filter(matricula=matricula, estado='Pendiente').first()
-                if pago:
-                    payment_intent = stripe.PaymentIntent.retrieve(pago.stripe_payment_intent_id)
-                    return Response({
-                        "exists": True,
-                        "estudiante": serializer.data,
-                        "client_secret": payment_intent['client_secret'] 
-                    })
-
-            return Response({"exists": True, "estudiante": serializer.data})
-
-        except Estudiante.DoesNotExist:
+        estado = obtener_estado_estudiante(request.user.id)
+        if estado['estudiante'] is None:
             return Response({"exists": False})
+
+        serializer = EstudianteSerializer(Estudiante(**estado['estudiante']))
+        if estado['pago_estado'] in ESTADOS_PAGO_PENDIENTE:
+            return Response({
+                "exists": True,
+                "estudiante": serializer.data,
+                "client_secret": estado['client_secret']
+            })
+
+        return Response({"exists": True, "estudiante": serializer.data})
     
 class RegisterAPIView(generics.CreateAPIView):
     serializer_class = RegisterSerializer
     permission_classes = [AllowAny]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'registro'
     parser_classes = [MultiPartParser, FormParser]
 
     def post(self, request, *args, **kwargs):
@@ -68,45 +89,37 @@ class CrearEstudianteAPIView(APIView):
     parser_classes = [MultiPartParser, FormParser]
 
     def post(self, request):
-        data = request.data
-        serializer = EstudianteSerializer(data=data)
-
-        if serializer.is_valid():
-            estudiante = serializer.save(usuario=request.user)
-            matricula = Matricula.objects.create(estudiante=estudiante, curso="Curso Ejemplo", monto=100.00)
-            
-            intent = stripe.PaymentIntent.create(
-                amount=int(matricula.monto * 100),
-                currency='usd',
-                metadata={'matricula_id': matricula.id}
-            )
-
-            Pago.objects.create(matricula=matricula, stripe_payment_intent_id=intent['id'])
-
-            return Response({
-                'client_secret': intent['client_secret'],
-                'payment_intent_id': intent['id']
-            }, status=status.HTTP_200_OK)
-
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        """
+        Admite la cabecera Idempotency-Key: los reintentos reciben la respuesta guardada.
+        Ver inscripcion.py.
+        """
+        codigo, cuerpo = con_idempotencia(request, lambda: self.inscribir(request))
+        return Response(cuerpo, status=codigo)
+
+    def inscribir(self, request):
+        serializer = EstudianteSerializer(data=request.data, context={'request': request})
+        matricula, pago, error = preparar_inscripcion(serializer, request.user)
+        if error:
+            return error
+        if falta_intent(pago):
+            pago = guardar_pago(matricula, cliente_stripe().payment_intents.create(params=parametros_intent(matricula)), pago)
+        return status.HTTP_200_OK, respuesta_pago(pago, obtener_client_secret(pago))
 
 
 class CheckStudentStatusAPIView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'estado'
 
     def get(self, request):
-        estudiante = Estudiante.objects.filter(usuario=request.user).first()
-        if estudiante:
-            matricula = Matricula.objects.filter(estudiante=estudiante).first()
-            if matricula:
-                pago = Pago.objects.filter(matricula=matricula).first()
-                estado = "rechazada" if matricula.estado == "Rechazado" else None
-                return Response({
-                    "has_student": True,
-                    "matricula_rechazada": estado == "rechazada",
-                    "payment_completed": pago.estado == "Completado" if pago else False,
-                    "client_secret": stripe.PaymentIntent.retrieve(pago.stripe_payment_intent_id).client_secret if pago else None
-                })
+        estado = obtener_estado_estudiante(request.user.id)
+        if estado['matricula_id']:
+            return Response({
+                "has_student": True,
+                "matricula_rechazada": estado['matricula_estado'] == "Rechazado",
+                "payment_completed": estado['pago_estado'] == "Completado",
+                "client_secret": estado['client_secret']
+            })
         return Response({"has_student": False}, status=200)
     
 class ConfirmarPagoAPIView(APIView):
@@ -114,26 +127,46 @@ class ConfirmarPagoAPIView(APIView):
 
     def post(self, request, payment_intent_id):
         try:
-            payment_intent = stripe.PaymentIntent.retrieve(payment_intent_id)
+            pago = Pago.objects.filter(stripe_payment_intent_id=payment_intent_id).only('estado').first()
+            if pago is None:
+                raise Pago.DoesNotExist
 
-            if payment_intent['status'] == 'succeeded':
-                pago = Pago.objects.get(stripe_payment_intent_id=payment_intent_id)
-                pago.estado = 'Completado'
-                pago.save()
+            # Si el webhook ya confirmó el pago no hace falta consultar a Stripe
+            if pago.estado != 'Completado':
+                payment_intent = obtener_payment_intent(payment_intent_id, usar_cache=False)
+                if payment_intent['status'] != 'succeeded':
+                    return Response({"message": "El pago no está completado."}, status=status.HTTP_400_BAD_REQUEST)
+                confirmar_pago(payment_intent_id)
 
-                matricula = pago.matricula
-                matricula.estado = 'Pagado'
-                matricula.save()
-
-                return Response({"message": "Pago confirmado exitosamente."}, status=status.HTTP_200_OK)
-            else:
-                return Response({"message": "El pago no está completado."}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({"message": "Pago confirmado exitosamente."}, status=status.HTTP_200_OK)
 
         except Pago.DoesNotExist:
             return Response({"error": "Pago no encontrado."}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class StripeWebhookAPIView(APIView):
+    """
+    Recibe los eventos payment_intent.* de Stripe. Verifica la firma, guarda el evento
+    una sola vez y aplica el cambio de estado con actualizaciones condicionales.
+    """
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def post(self, request):
+        try:
+            event = stripe.Webhook.construct_event(
+                request.body, request.META.get('HTTP_STRIPE_SIGNATURE', ''), settings.STRIPE_WEBHOOK_SECRET
+            )
+        except (ValueError, stripe.error.SignatureVerificationError):
+            return Response({"error": "Firma no válida."}, status=status.HTTP_400_BAD_REQUEST)
+
+        evento, creado = registrar_evento(event)
+        if creado or evento.procesado_en is None:
+            procesar_evento(evento)
+
+        return Response({"received": True}, status=status.HTTP_200_OK)
+
 @api_view(['GET', 'PUT'])
 @permission_classes([IsAuthenticated])
 def perfil_usuario(request):
@@ -161,6 +194,27 @@ def perfil_usuario(request):
 class MatriculaViewSet(viewsets.ModelViewSet):
     queryset = Matricula.objects.all()
     serializer_class = MatriculaSerializer
+    pagination_class = MatriculaCursorPagination
+    renderer_classes = [JSONRapidoRenderer, BrowsableAPIRenderer]
+    # El listado se serializa desde filas .values() (ver serializacion_rapida.py)
+    serializacion_rapida = True
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ['list', 'retrieve']:
+            queryset = queryset.con_detalle().order_by('id')
+        return queryset
+
+    @lecturas_en_replica()
+    def list(self, request, *args, **kwargs):
+        if not self.serializacion_rapida:
+            return super().list(request, *args, **kwargs)
+
+        filas = filas_matriculas(self.filter_queryset(Matricula.objects.order_by('id')))
+        page = self.paginate_queryset(filas)
+        if page is not None:
+            return self.get_paginated_response(serializar_matriculas(page, request))
+        return Response(serializar_matriculas(filas, request))
 
     def get_permissions(self):
         if self.action in ['list', 'verificar']:
@@ -171,56 +225,173 @@ class MatriculaViewSet(viewsets.ModelViewSet):
     def verificar(self, request, pk=None):
         matricula = self.get_object()
         nuevo_estado = request.data.get('estado')
-        if nuevo_estado in ['Aprobado', 'Rechazado', 'Pendiente']:
-            matricula.estado = nuevo_estado
-            matricula.save()
-
-            # Enviar correo si el estado es "Aprobado"
-            if nuevo_estado == 'Aprobado':
-                print(settings.EMAIL_HOST_USER)
-                self._send_approval_email(matricula)
-
-            return Response({"message": "Estado de la matrícula actualizado"}, status=status.HTTP_200_OK)
-        return Response({"error": "Estado no válido"}, status=status.HTTP_400_BAD_REQUEST)
-
-    def _send_approval_email(self, matricula):
-        """Envía un correo al usuario cuando la matrícula es aprobada."""
-        user_email = matricula.estudiante.usuario.email
-        student_name = matricula.estudiante.usuario.get_full_name()
-
-        subject = "¡Tu matrícula ha sido aprobada!"
-        message = (
-            f"Hola {student_name},\n\n"
-            f"Te informamos que tu matrícula para el curso '{matricula.curso}' ha sido aprobada. "
-            "Si tienes alguna consulta, no dudes en contactarnos.\n\n"
-            "Saludos,\nEl equipo de gestión de matrículas."
-        )
-        from_email = settings.DEFAULT_FROM_EMAIL
-        recipient_list = [user_email]
+        if nuevo_estado not in ESTADOS_VERIFICACION:
+            return Response({"error": "Estado no válido"}, status=status.HTTP_400_BAD_REQUEST)
 
+        # Cambio condicional sobre el estado actual; el correo de aprobación se encola y lo
+        # envía el comando enviar_notificaciones
         try:
-            send_mail(subject, message, from_email, recipient_list)
-        except Exception as e:
-            # Manejo de errores
-            print(f"Error al enviar el correo: {str(e)}")
+            verificar_matricula(matricula, nuevo_estado)
+        except TransicionNoPermitida as e:
+            return Response({"error": str(e), "estado_actual": e.actual}, status=status.HTTP_409_CONFLICT)
+        return Response({"message": "Estado de la matrícula actualizado"}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='verificar-lote', permission_classes=[IsAuthenticated, IsAdminUser])
+    def verificar_lote(self, request):
+        serializer = VerificacionLoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        datos = serializer.validated_data
+
+        resultados = verificar_en_lote(datos['estado'], ids=datos.get('ids'), filtro=datos.get('filtro'))
+        actualizadas = sum(1 for r in resultados if r['resultado'] == 'actualizada')
+        return Response({"actualizadas": actualizadas, "resultados": resultados}, status=status.HTTP_200_OK)
     
+class ObtenerTokenAPIView(TokenObtainPairView):
+    """TokenObtainPairView con límite de peticiones: cada intento calcula el hash de la contraseña."""
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'token'
+
+
 class UserRoleAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        user = request.user
-        role = 'authenticated' 
-        if user.is_staff:
-            role = 'is_staff'
-        elif user.is_superuser:
-            role = 'is_admin'
-        
-        return Response({"role": role})
+        # request.user viene de la caché de CachedJWTAuthentication: sin consultas y sin
+        # el retraso de los claims del token cuando cambia el rol
+        return Response({"role": rol_de_usuario(request.user)})
     
 class MatriculaListAPIView(APIView):
     permission_classes = [IsAuthenticated, IsAdminUser]
+    renderer_classes = [JSONRapidoRenderer, BrowsableAPIRenderer]
+    serializacion_rapida = True
 
+    @lecturas_en_replica()
     def get(self, request):
-        matriculas = Matricula.objects.all()
-        serializer = MatriculaSerializer(matriculas, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        paginator = MatriculaCursorPagination()
+        if self.serializacion_rapida:
+            matriculas = filas_matriculas(Matricula.objects.order_by('id'))
+            serializar = serializar_matriculas
+        else:
+            matriculas = Matricula.objects.con_detalle().order_by('id')
+            serializar = lambda page: MatriculaSerializer(page, many=True).data
+
+        page = paginator.paginate_queryset(matriculas, request, view=self)
+        if page is not None:
+            return paginator.get_paginated_response(serializar(page))
+        return Response(serializar(matriculas))
+
+class BuscarMatriculasAPIView(APIView):
+    """Busca matrículas por prefijo del nombre o DNI del estudiante (?q=), filtrables por estado y curso."""
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    @lecturas_en_replica()
+    def get(self, request):
+        paginator = BusquedaCursorPagination()
+        page = paginator.paginate_queryset(buscar_matriculas(request.query_params), request, view=self)
+        serializer = MatriculaSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+class ResumenMatriculasAPIView(APIView):
+    """Datos del panel de administración, leídos de la tabla de resumen en una consulta."""
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        return Response(obtener_resumen())
+
+class ExportarMatriculasAPIView(APIView):
+    """Exporta las matrículas en CSV o NDJSON enviando las filas a medida que se leen."""
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        formato = request.query_params.get('formato', 'csv')
+        if formato not in FORMATOS:
+            return Response({"error": "Formato no válido"}, status=status.HTTP_400_BAD_REQUEST)
+
+        generar, content_type = FORMATOS[formato]
+        response = StreamingHttpResponse(generar(filas_exportacion(request.query_params)), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="matriculas.{formato}"'
+        return response
+
+@api_view(['GET', 'HEAD'])
+@permission_classes([AllowAny])
+def servir_media(request, ruta):
+    """Sirve los archivos subidos comprobando que el usuario puede verlos."""
+    try:
+        ruta_absoluta = safe_join(settings.MEDIA_ROOT, ruta)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(ruta_absoluta):
+        raise Http404
+    # Los permisos se comprueban sobre la ruta ya resuelta: 'fotos_perfil/../certificados/x'
+    # no es una foto de perfil
+    ruta = os.path.relpath(ruta_absoluta, os.path.abspath(settings.MEDIA_ROOT)).replace(os.sep, '/')
+    if not puede_ver(request.user, ruta):
+        return Response({"error": "No tiene permiso para ver este archivo."}, status=status.HTTP_403_FORBIDDEN)
+    return respuesta_archivo(request, ruta, ruta_absoluta)
+
+class SubidaCertificadoAPIView(APIView):
+    """Inicia una subida por partes del certificado de estudios."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = SubidaCertificadoSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        datos = serializer.validated_data
+        try:
+            subida = iniciar_subida(request.user, datos['nombre'], datos['tamano'], datos.get('sha256'))
+        except ErrorSubida as e:
+            return Response({"error": str(e)}, status=e.status)
+
+        codigo = status.HTTP_200_OK if subida.estado == 'Completada' else status.HTTP_201_CREATED
+        return Response(SubidaCertificadoSerializer(subida, context={'request': request}).data, status=codigo)
+
+class SubidaCertificadoDetalleAPIView(APIView):
+    """
+    GET devuelve el offset confirmado para reanudar. PATCH recibe una parte en el cuerpo
+    crudo con la cabecera Upload-Offset (y opcionalmente X-Chunk-SHA256).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        subida = get_object_or_404(SubidaCertificado, pk=pk, usuario=request.user)
+        return Response(SubidaCertificadoSerializer(subida, context={'request': request}).data)
+
+    def patch(self, request, pk):
+        subida = get_object_or_404(SubidaCertificado, pk=pk, usuario=request.user)
+        try:
+            inicio = int(request.META.get('HTTP_UPLOAD_OFFSET', ''))
+            longitud = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return Response({"error": "Cabecera Upload-Offset no válida."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            sha256_parte = recibir_parte(
+                subida, inicio, request.stream, longitud, request.META.get('HTTP_X_CHUNK_SHA256')
+            )
+        except ErrorSubida as e:
+            return Response({"error": str(e), "recibido": subida.recibido}, status=e.status)
+
+        return Response({"recibido": subida.recibido, "sha256_parte": sha256_parte})
+
+class FinalizarSubidaAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk):
+        subida = get_object_or_404(SubidaCertificado, pk=pk, usuario=request.user)
+        try:
+            archivo = finalizar_subida(subida)
+        except ErrorSubida as e:
+            return Response({"error": str(e), "recibido": subida.recibido}, status=e.status)
+
+        datos = SubidaCertificadoSerializer(subida, context={'request': request}).data
+        datos['sha256'] = archivo.sha256
+        return Response(datos)
+
+
+def exponer_metricas(request):
+    """Histogramas de rendimiento y estado del outbox de correos en el formato de texto de Prometheus."""
+    if settings.METRICAS_TOKEN:
+        esperado = f'Bearer {settings.METRICAS_TOKEN}'
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), esperado):
+            return HttpResponse(status=401)
+    return HttpResponse(exponer() + exponer_metricas_outbox(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'matriculas.middleware.MetricasMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -88,9 +89,22 @@ DATABASES = {
         'PASSWORD': 'root',
         'HOST': '127.0.0.1',
         'PORT': '3306',
+        # Conexiones persistentes, comprobadas antes de reutilizarlas en cada petición
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Réplicas de lectura para listados y reportes de administración (ver matriculas/db_router.py),
+# p. ej. DB_REPLICA_HOSTS="10.0.0.2,10.0.0.3". En las pruebas apuntan a la base de datos default.
+DATABASE_REPLICAS = []
+for numero, host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    alias = f'replica_{numero}'
+    DATABASES[alias] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['matriculas.db_router.RouterReplicas']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -134,26 +148,85 @@ X_FRAME_OPTIONS = 'ALLOWALL'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# CACHE
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'sistema-matriculas'),
+    }
+}
+
+# Segundos que se reutiliza el estado de matrícula/pago de un estudiante (se invalida al cambiar)
+ESTADO_ESTUDIANTE_CACHE_TTL = int(os.getenv('ESTADO_ESTUDIANTE_CACHE_TTL', 300))
+
 # Stripe
 
 STRIPE_PUBLIC_KEY = os.getenv('STRIPE_PUBLIC_KEY')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+# Vistas asíncronas: segundos máximos de espera a Stripe y a la base de datos
+STRIPE_TIMEOUT = float(os.getenv('STRIPE_TIMEOUT', 10))
+ASYNC_DB_TIMEOUT = float(os.getenv('ASYNC_DB_TIMEOUT', 5))
+# Hilos para las llamadas a Stripe desde vistas asíncronas cuando no hay httpx/aiohttp
+STRIPE_ASYNC_HILOS = int(os.getenv('STRIPE_ASYNC_HILOS', 64))
+# Segundos que se reutilizan los datos de un PaymentIntent antes de volver a consultar a Stripe
+STRIPE_INTENT_CACHE_TTL = int(os.getenv('STRIPE_INTENT_CACHE_TTL', 300))
+
+# Tiempo durante el que un reintento con la misma Idempotency-Key devuelve la respuesta guardada
+IDEMPOTENCIA_VENTANA = int(os.getenv('IDEMPOTENCIA_VENTANA', 24 * 3600))
 
 # REST
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'matriculas.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
 }
 
+# Límites de peticiones por token bucket (ver matriculas/throttling.py): por alcance, la
+# ráfaga admitida y las fichas recargadas por segundo. Para que el límite sea común a todos
+# los workers la caché LIMITES_CACHE debe ser compartida (RedisCache).
+LIMITES_PETICIONES = {
+    'token': (int(os.getenv('LIMITE_TOKEN_RAFAGA', 10)), float(os.getenv('LIMITE_TOKEN_RECARGA', 0.2))),
+    'registro': (int(os.getenv('LIMITE_REGISTRO_RAFAGA', 5)), float(os.getenv('LIMITE_REGISTRO_RECARGA', 0.05))),
+    'estado': (int(os.getenv('LIMITE_ESTADO_RAFAGA', 30)), float(os.getenv('LIMITE_ESTADO_RECARGA', 1))),
+}
+LIMITES_CACHE = os.getenv('LIMITES_CACHE', 'default')
+
+# Caché de usuarios autenticados por JWT (ver matriculas/authentication.py)
+AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', 30))
+AUTH_CACHE_MAX_USUARIOS = int(os.getenv('AUTH_CACHE_MAX_USUARIOS', 10000))
+AUTH_CACHE_COMPARTIDA = os.getenv('AUTH_CACHE_COMPARTIDA', 'False') == 'True'
+
 # MEDIA
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Envío de archivos delegado al servidor web: None, 'x-sendfile' (Apache) o 'x-accel-redirect' (nginx)
+MEDIA_SENDFILE = os.getenv('MEDIA_SENDFILE') or None
+# Location interna de nginx que apunta a MEDIA_ROOT (solo para x-accel-redirect)
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media/')
+
+# Tamaño máximo de un certificado subido por partes
+CERTIFICADO_MAX_BYTES = int(os.getenv('CERTIFICADO_MAX_BYTES', 50 * 1024 * 1024))
+# Horas sin recibir partes tras las que el comando expirar_subidas descarta una subida
+SUBIDA_EXPIRACION_HORAS = float(os.getenv('SUBIDA_EXPIRACION_HORAS', 24))
+
+# Fotos de perfil: se limita el original y las miniaturas se generan en un pool de procesos
+FOTO_PERFIL_MAX_LADO = int(os.getenv('FOTO_PERFIL_MAX_LADO', 2048))
+FOTO_PERFIL_MAX_PIXELES = int(os.getenv('FOTO_PERFIL_MAX_PIXELES', 40_000_000))
+PROCESAR_FOTOS_EN_SEGUNDO_PLANO = os.getenv('PROCESAR_FOTOS_EN_SEGUNDO_PLANO', 'True') == 'True'
+FOTOS_PERFIL_PROCESOS = int(os.getenv('FOTOS_PERFIL_PROCESOS', 2))
+
+# Métricas de rendimiento expuestas en /metrics (formato Prometheus)
+# Si se define, /metrics exige la cabecera "Authorization: Bearer <METRICAS_TOKEN>"
+METRICAS_TOKEN = os.getenv('METRICAS_TOKEN', '')
+# Peticiones más lentas que este umbral se registran con su SQL (0 lo desactiva)
+PETICION_LENTA_MS = float(os.getenv('PETICION_LENTA_MS', 0))
 
 # CORS
 
@@ -177,4 +250,7 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': False,
     'BLACKLIST_AFTER_ROTATION': True,
     'UPDATE_LAST_LOGIN': False,
+    # Rol, username y avatar en los claims (ver matriculas/roles.py)
+    'TOKEN_OBTAIN_SERIALIZER': 'matriculas.serializers.TokenConClaimsSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'matriculas.serializers.TokenRefreshConClaimsSerializer',
 }
\ No newline at end of file
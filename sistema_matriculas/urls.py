@@ -15,14 +15,17 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from django.conf.urls.static import static
+from django.urls import path, re_path, include
+from rest_framework_simplejwt.views import TokenRefreshView
 from django.conf import settings
+from matriculas.views import ObtenerTokenAPIView, exponer_metricas, servir_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/matriculas/', include('matriculas.urls')),
-    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('api/token/', ObtenerTokenAPIView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    # Ruta habitual de Prometheus; también con barra final, que APPEND_SLASH no añade aquí
+    re_path(r'^metrics/?$', exponer_metricas, name='metricas'),
+    re_path(r'^%s(?P<ruta>.+)$' % settings.MEDIA_URL.lstrip('/'), servir_media, name='servir_media'),
+]